@@ -0,0 +1,291 @@
+"""
+Benchmark del client contro un server Ollama finto (files/mock_ollama.py).
+Misura solo l'overhead lato client: nessun modello reale coinvolto.
+
+    python benchmark.py
+    python benchmark.py --iterations 200 --latency 0.02 --chunks 50 --json bench.json
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+
+import main
+from files import addons
+from files import journal
+from files.settings import Settings
+from files.config_store import CONFIG_STORE
+from files.profiles import PROFILE_STATS
+from files.metrics import percentile
+from files.filters import remove_emojis, EmojiFilter
+from files.backend import BackendPool
+from files.mock_ollama import MockOllamaServer, DEFAULT_MODELS
+
+def summarize(name, samples, wall=None, server_time=0.0):
+    """Percentili in millisecondi; throughput in operazioni al secondo."""
+    wall = wall if wall is not None else sum(samples)
+    result = {
+        "name": name,
+        "n": len(samples),
+        "p50_ms": percentile(samples, 50) * 1000,
+        "p95_ms": percentile(samples, 95) * 1000,
+        "p99_ms": percentile(samples, 99) * 1000,
+        "max_ms": max(samples) * 1000 if samples else 0.0,
+        "ops_per_s": len(samples) / wall if wall else 0.0,
+    }
+    if server_time:
+        # Tempo speso dal client oltre a quello simulato dal server
+        result["client_overhead_ms"] = max(0.0, percentile(samples, 50) - server_time) * 1000
+    return result
+
+def timed(func, iterations):
+    samples = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+def make_settings(server):
+    settings = Settings(interactive=False)
+    settings.selected_model = DEFAULT_MODELS[0]
+    settings.ollama_url = server.url
+    settings.use_cache = False
+    settings.use_emoji = False
+    return settings
+
+# ----------------------------------------
+# Micro benchmark (nessuna rete)
+# ----------------------------------------
+
+def bench_micro(settings, iterations, workdir):
+    results = []
+    text = "Lorem ipsum dolor sit amet \U0001F600 consectetur " * 200
+
+    results.append(summarize("format_prompt", timed(lambda: settings.format_prompt("hello world"), iterations)))
+    results.append(summarize("remove_emojis (10 KB)", timed(lambda: remove_emojis(text), iterations)))
+
+    # Costo per chunk del filtro in streaming: deve restare costante con risposte lunghe
+    stream_filter = EmojiFilter()
+    chunk = "word \U0001F600 "
+    results.append(summarize("emoji stream filter (per chunk)", timed(lambda: stream_filter.feed(chunk), iterations * 100)))
+
+    # Catene di hook con 10 hook banali ciascuna
+    saved = (list(addons.USER_INPUT_HOOKS), list(addons.MODEL_OUTPUT_HOOKS))
+    addons.USER_INPUT_HOOKS[:] = [lambda agent, t: t] * 10
+    addons.MODEL_OUTPUT_HOOKS[:] = [lambda agent, t: t] * 10
+    try:
+        results.append(summarize("user input hooks x10", timed(lambda: addons.run_user_input_hooks(None, text), iterations)))
+        results.append(summarize("model output hooks x10", timed(lambda: addons.run_model_output_hooks(None, text), iterations)))
+    finally:
+        addons.USER_INPUT_HOOKS[:], addons.MODEL_OUTPUT_HOOKS[:] = saved
+
+    # load_addons su una cartella con 20 addon fittizi
+    addons_dir = os.path.join(workdir, "addons")
+    os.makedirs(addons_dir, exist_ok=True)
+    for i in range(20):
+        with open(os.path.join(addons_dir, f"bench_addon_{i}.py"), "w", encoding="utf-8") as f:
+            f.write(f'__description__ = "Bench addon {i}"\n\ndef main():\n    pass\n')
+    manifest = os.path.join(workdir, "addons_manifest.json")
+
+    def cold_load():
+        if os.path.exists(manifest):
+            os.remove(manifest)
+        addons.AddonManager(addons_dir, manifest).load_all()
+
+    warm = addons.AddonManager(addons_dir, manifest)
+    devnull = open(os.devnull, "w")
+    stdout = sys.stdout
+    try:
+        sys.stdout = devnull
+        cold = timed(cold_load, max(1, iterations // 10))
+        warm.load_all()
+        cached = timed(warm.load_all, iterations)
+    finally:
+        sys.stdout = stdout
+        devnull.close()
+    results.append(summarize("load_addons cold (20 addon)", cold))
+    results.append(summarize("load_addons cached (20 addon)", cached))
+
+    # Journal della chat: il costo per turno non deve crescere con la lunghezza della chat
+    chat = journal.ChatJournal(DEFAULT_MODELS[0], fsync=False)
+    for i in range(1000):
+        chat.append(f"question {i}", text[:500])
+    samples = timed(lambda: chat.append("question", text[:500]), iterations)
+    chat.close()
+    results.append(summarize("journal append (after 1000 turns)", samples))
+    return results
+
+# ----------------------------------------
+# Workload contro il server finto
+# ----------------------------------------
+
+def bench_single_turn(settings, server, iterations):
+    agent = main.LlamaAgent(persistent=False, settings=settings)
+    agent.stream = False
+    start = time.perf_counter()
+    samples = timed(lambda: agent.ask("What is the capital of France?"), iterations)
+    wall = time.perf_counter() - start
+    agent.client.close()
+    server_time = server.latency + server.chunk_delay * server.chunks
+    return [summarize("single turn", samples, wall, server_time)]
+
+def bench_streaming(settings, server, iterations):
+    agent = main.LlamaAgent(persistent=False, settings=settings)
+    agent.stream = True
+    ttft, totals = [], []
+    start = time.perf_counter()
+    for _ in range(iterations):
+        t0 = time.perf_counter()
+        first = None
+        for _chunk in agent.ask_stream("Tell me a story"):
+            if first is None:
+                first = time.perf_counter() - t0
+        totals.append(time.perf_counter() - t0)
+        ttft.append(first or 0.0)
+    wall = time.perf_counter() - start
+    agent.client.close()
+    return [
+        summarize("streaming time-to-first-token", ttft, wall, server.latency + server.chunk_delay),
+        summarize("streaming full response", totals, wall, server.latency + server.chunk_delay * server.chunks),
+    ]
+
+def bench_persistent(settings, server, turns):
+    agent = main.LlamaAgent(persistent=True, settings=settings)
+    agent.stream = False
+    samples = timed(lambda: agent.ask("And then what happened next in the story?"), turns)
+    agent.client.close()
+    server_time = server.latency + server.chunk_delay * server.chunks
+    tail = max(1, turns // 10)
+    first = summarize(f"persistent turns 1-{tail}", samples[:tail], server_time=server_time)
+    last = summarize(f"persistent turns {turns - tail + 1}-{turns}", samples[-tail:], server_time=server_time)
+    return [summarize(f"persistent session ({turns} turni)", samples, server_time=server_time), first, last]
+
+def bench_batch(settings, server, iterations, concurrency, workdir):
+    input_path = os.path.join(workdir, "batch_in.jsonl")
+    output_path = os.path.join(workdir, "batch_out.jsonl")
+    with open(input_path, "w", encoding="utf-8") as f:
+        for i in range(iterations):
+            f.write(json.dumps({"id": i, "prompt": f"prompt {i}"}) + "\n")
+    if os.path.exists(output_path):
+        os.remove(output_path)
+
+    devnull = open(os.devnull, "w")
+    stdout = sys.stdout
+    start = time.perf_counter()
+    try:
+        sys.stdout = devnull
+        main.run_batch(input_path, output_path, concurrency, settings)
+    finally:
+        sys.stdout = stdout
+        devnull.close()
+    wall = time.perf_counter() - start
+
+    with open(output_path, "r", encoding="utf-8") as f:
+        samples = [json.loads(line)["elapsed"] for line in f if line.strip()]
+    return [summarize(f"batch (concurrency {concurrency})", samples, wall)]
+
+def bench_pool(settings, server, iterations):
+    """
+    Tre server con latenze diverse dietro un BackendPool: routing normale, failover
+    dopo lo spegnimento del più veloce e hedging con un server che si blocca a metà.
+    """
+    fast = MockOllamaServer(latency=server.latency, chunks=server.chunks, chunk_delay=server.chunk_delay).start()
+    slow = MockOllamaServer(latency=server.latency * 10, chunks=server.chunks, chunk_delay=server.chunk_delay).start()
+    payload = {"model": DEFAULT_MODELS[0], "prompt": "ping"}
+    results = []
+    pool = BackendPool([fast.url, slow.url, server.url], health_interval=0.5)
+    try:
+        pool.check_all()
+        results.append(summarize("pool (3 server)", timed(lambda: pool.generate(payload), iterations)))
+        fast.stop()
+        # Il primo tentativo sul server spento fallisce e la richiesta passa al successivo
+        results.append(summarize("pool failover (1 server giù)", timed(lambda: pool.generate(payload), iterations)))
+    finally:
+        pool.close()
+
+    # Hedging: il server preferito diventa lentissimo, la copia parte dopo 2 x latenza
+    stalled = MockOllamaServer(latency=server.latency, chunks=server.chunks, chunk_delay=server.chunk_delay).start()
+    hedged = BackendPool([stalled.url, server.url], health_interval=60, hedge_after=server.latency * 2 or 0.01)
+    try:
+        hedged.check_all()
+        stalled.latency = 1.0
+        samples = timed(lambda: hedged.generate(payload), max(1, iterations // 5))
+        results.append(summarize(f"pool hedging (dopo {hedged.hedge_after * 1000:.0f} ms)", samples))
+    finally:
+        hedged.close()
+        stalled.stop()
+        slow.stop()
+    return results
+
+# ----------------------------------------
+# Report
+# ----------------------------------------
+
+def print_report(results):
+    header = f"{'benchmark':<38}{'n':>6}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'ops/s':>10}{'client ms':>11}"
+    print(header)
+    print("-" * len(header))
+    for r in results:
+        overhead = r.get("client_overhead_ms")
+        overhead = f"{overhead:>11.2f}" if overhead is not None else f"{'-':>11}"
+        print(f"{r['name']:<38}{r['n']:>6}{r['p50_ms']:>10.2f}{r['p95_ms']:>10.2f}"
+              f"{r['p99_ms']:>10.2f}{r['ops_per_s']:>10.1f}{overhead}")
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark del client contro un Ollama finto")
+    parser.add_argument("--iterations", type=int, default=50)
+    parser.add_argument("--turns", type=int, default=100, help="Turni della sessione persistente")
+    parser.add_argument("--concurrency", type=int, default=8, help="Worker della modalità batch")
+    parser.add_argument("--latency", type=float, default=0.005, help="Latenza simulata prima del primo chunk (s)")
+    parser.add_argument("--chunks", type=int, default=20, help="Chunk per risposta")
+    parser.add_argument("--chunk-delay", type=float, default=0.0005, help="Pausa tra i chunk (s)")
+    parser.add_argument("--only", nargs="*", choices=["micro", "single", "stream", "persistent", "batch", "pool"])
+    parser.add_argument("--json", metavar="PATH", help="Salva i risultati in JSON")
+    return parser.parse_args(argv)
+
+def run(args):
+    server = MockOllamaServer(latency=args.latency, chunks=args.chunks, chunk_delay=args.chunk_delay).start()
+    workdir = tempfile.mkdtemp(prefix="modular_bench_")
+    # Le chat persistenti del benchmark non finiscono tra quelle dell'utente
+    saved_chat_dir = journal.CHAT_DIR
+    journal.CHAT_DIR = os.path.join(workdir, "chats")
+    # ...e i token/s misurati sul mock non finiscono nelle statistiche dei profili
+    saved_stats_path = PROFILE_STATS.path
+    PROFILE_STATS.path = os.path.join(workdir, "profile_stats.json")
+    selected = set(args.only or ["micro", "single", "stream", "persistent", "batch", "pool"])
+    results = []
+    try:
+        settings = make_settings(server)
+        if "micro" in selected:
+            results += bench_micro(settings, args.iterations, workdir)
+        if "single" in selected:
+            results += bench_single_turn(settings, server, args.iterations)
+        if "stream" in selected:
+            results += bench_streaming(settings, server, args.iterations)
+        if "persistent" in selected:
+            results += bench_persistent(settings, server, args.turns)
+        if "batch" in selected:
+            results += bench_batch(settings, server, args.iterations, args.concurrency, workdir)
+        if "pool" in selected:
+            results += bench_pool(settings, server, args.iterations)
+    finally:
+        server.stop()
+        journal.CHAT_DIR = saved_chat_dir
+        # Scrittura in attesa scaricata ora, non nella cartella già cancellata
+        CONFIG_STORE.flush(PROFILE_STATS.path)
+        PROFILE_STATS.path = saved_stats_path
+        shutil.rmtree(workdir, ignore_errors=True)
+    return results
+
+if __name__ == "__main__":
+    args = parse_args()
+    results = run(args)
+    print_report(results)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nResults saved in: {args.json}")
@@ -0,0 +1,323 @@
+"""
+Esecuzione degli addon isolati (`__isolated__ = True`) in processi separati.
+
+Ogni worker importa tutti gli addon isolati; hook e comandi vengono chiamati via Pipe
+con un timeout per chiamata. main() e le voci di menu no: qui stdin è /dev/null, quindi
+girano nel processo principale (AddonManager._interactive). Un worker che va in timeout o termina
+viene sostituito da uno nuovo, così la chat resta reattiva e gli addon pesanti
+possono usare altri core.
+"""
+import time
+import threading
+import importlib.util
+import multiprocessing
+from types import SimpleNamespace
+from typing import Any, Dict, List, Optional, Tuple
+
+HOOK_KINDS = ("on_input", "on_output", "on_output_stream")
+
+class AddonCallError(Exception):
+    pass
+
+# ----------------------------------------
+# Lato worker (processo figlio)
+# ----------------------------------------
+
+def _describe_addon(registry, name: str, module) -> Dict[str, Any]:
+    """Raccoglie ciò che l'addon ha registrato durante l'import nel processo figlio."""
+    lists = {
+        id(registry.USER_INPUT_HOOKS): "on_input",
+        id(registry.MODEL_OUTPUT_HOOKS): "on_output",
+        id(registry.MODEL_OUTPUT_STREAM_HOOKS): "on_output_stream",
+        id(registry.CUSTOM_COMMANDS): "commands",
+        id(registry.ADDONS_MENU_ENTRIES): "menu",
+    }
+    table = {kind: [] for kind in HOOK_KINDS + ("commands", "menu")}
+    for reg, entry in registry.ADDON_REGISTRATIONS.get(name, []):
+        kind = lists.get(id(reg))
+        if kind:
+            table[kind].append(entry)
+    table["main"] = getattr(module, "main", None) if callable(getattr(module, "main", None)) else None
+    return table
+
+def _public(table: Dict[str, Any]) -> Dict[str, Any]:
+    """Versione serializzabile della tabella, da inviare al processo principale."""
+    return {
+        "on_input": len(table["on_input"]),
+        "on_output": len(table["on_output"]),
+        "on_output_stream": len(table["on_output_stream"]),
+        "commands": [(c["name"], c["help"]) for c in table["commands"]],
+        "menu": [label for (label, _handler) in table["menu"]],
+        "main": table["main"] is not None,
+    }
+
+def worker_main(conn, specs: List[Tuple[str, str]]) -> None:
+    from files import addons as registry  # registri propri del processo figlio
+    from files.config_store import CONFIG_STORE
+    # Il processo può essere terminato per timeout: le config si scrivono subito
+    CONFIG_STORE.delay = 0
+
+    tables: Dict[str, Dict[str, Any]] = {}
+
+    def load(name: str, path: str) -> Dict[str, Any]:
+        # Ricaricamento: via le registrazioni del vecchio import
+        registry.ADDON_MANAGER.unload(name)
+        registry._loading.name = name
+        try:
+            spec = importlib.util.spec_from_file_location(name, path)
+            module = importlib.util.module_from_spec(spec)
+            spec.loader.exec_module(module)
+        except Exception as e:
+            return {"error": str(e)}
+        finally:
+            registry._loading.name = None
+        tables[name] = _describe_addon(registry, name, module)
+        return _public(tables[name])
+
+    conn.send(("ready", {name: load(name, path) for name, path in specs}))
+
+    while True:
+        try:
+            op, name, index, args = conn.recv()
+        except (EOFError, OSError, KeyboardInterrupt):
+            return
+        try:
+            if op == "load":
+                result = load(name, args)
+            elif op == "unload":
+                tables.pop(name, None)
+                registry.ADDON_MANAGER.unload(name)
+                result = None
+            elif op in HOOK_KINDS:
+                agent, text = args
+                result = tables[name][op][index](SimpleNamespace(**agent), text)
+            elif op == "command":
+                agent, cmd_args, settings = args
+                handler = tables[name]["commands"][index]["handler"]
+                result = handler(SimpleNamespace(**agent), cmd_args, SimpleNamespace(**settings))
+            else:
+                raise ValueError(f"operazione sconosciuta: {op}")
+            conn.send(("ok", result))
+        except Exception as e:
+            conn.send(("error", f"{type(e).__name__}: {e}"))
+
+# ----------------------------------------
+# Lato processo principale
+# ----------------------------------------
+
+def agent_snapshot(agent: Any) -> Dict[str, Any]:
+    """L'agente non attraversa la Pipe: gli hook isolati ne ricevono una copia ridotta."""
+    if agent is None:
+        return {}
+    return {
+        "model": getattr(agent, "model", None),
+        "persistent": getattr(agent, "persistent", False),
+        "history": list(getattr(agent, "history", [])[-10:]),
+    }
+
+def settings_snapshot(settings: Any) -> Dict[str, Any]:
+    if settings is None:
+        return {}
+    return {k: v for k, v in vars(settings).items() if isinstance(v, (str, int, float, bool, list, dict, type(None)))}
+
+class _Worker:
+    def __init__(self, ctx, specs: List[Tuple[str, str]], generation: int = 0):
+        self.conn, child = ctx.Pipe()
+        self.process = ctx.Process(target=worker_main, args=(child, specs), daemon=True)
+        self.process.start()
+        child.close()
+        # Versione della lista di addon importata dal worker (vedi AddonWorkerPool.generation)
+        self.generation = generation
+
+    def request(self, message, timeout: Optional[float]):
+        self.conn.send(message)
+        if not self.conn.poll(timeout):
+            raise TimeoutError
+        return self.conn.recv()
+
+    def kill(self) -> None:
+        try:
+            self.process.kill()
+            self.process.join(1)
+        except Exception:
+            pass
+        self.conn.close()
+
+class AddonWorkerPool:
+    """
+    Pool di processi che eseguono gli addon isolati, con timeout e riavvio automatico.
+    Un worker in timeout o terminato fa fallire subito la chiamata: il sostituto parte
+    in background, il turno della chat non aspetta l'avvio di un processo.
+    """
+
+    def __init__(self, size: int = 2, timeout: float = 5.0, start_timeout: float = 30.0):
+        self.size = max(1, size)
+        self.timeout = timeout
+        self.start_timeout = start_timeout
+        self.specs: List[Tuple[str, str]] = []
+        self.tables: Dict[str, Dict[str, Any]] = {}
+        # Aumenta a ogni add/remove: un worker con una versione vecchia viene sostituito
+        self.generation = 0
+        self._ctx = multiprocessing.get_context("spawn")
+        self._cond = threading.Condition()
+        self._workers = set()            # worker vivi (liberi o occupati)
+        self._idle: List[_Worker] = []
+        self._spawning = 0
+        self._started = False
+
+    def _spawn(self) -> _Worker:
+        with self._cond:
+            specs, generation = list(self.specs), self.generation
+        worker = _Worker(self._ctx, specs, generation)
+        if not worker.conn.poll(self.start_timeout):
+            worker.kill()
+            raise AddonCallError("avvio del worker addon scaduto")
+        status, tables = worker.conn.recv()
+        with self._cond:
+            # Un avvio partito prima di un remove non deve far ricomparire l'addon tolto
+            names = {name for name, _path in self.specs}
+        self.tables.update({name: table for name, table in tables.items() if name in names})
+        return worker
+
+    def _spawn_async(self) -> None:
+        """Avvia un worker in un thread; a pronto entra tra quelli liberi."""
+        def run():
+            try:
+                worker = self._spawn()
+            except Exception:
+                worker = None
+            with self._cond:
+                self._spawning -= 1
+                if worker is not None:
+                    self._workers.add(worker)
+                self._cond.notify_all()
+            if worker is not None:
+                self._checkin(worker)
+
+        with self._cond:
+            self._spawning += 1
+        threading.Thread(target=run, daemon=True).start()
+
+    def _ensure_size(self) -> None:
+        """Riporta il pool a `size` worker (avvii in background)."""
+        with self._cond:
+            missing = self.size - len(self._workers) - self._spawning if self._started else 0
+        for _ in range(max(0, missing)):
+            self._spawn_async()
+
+    def _discard(self, worker: _Worker) -> None:
+        worker.kill()
+        with self._cond:
+            self._workers.discard(worker)
+            self._cond.notify_all()
+        self._ensure_size()
+
+    def _checkout(self, timeout: Optional[float]) -> Optional[_Worker]:
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while not self._idle:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return None
+                self._cond.wait(remaining)
+            return self._idle.pop()
+
+    def _checkin(self, worker: _Worker) -> None:
+        with self._cond:
+            if worker not in self._workers:
+                return
+            stale = worker.generation != self.generation
+            if not stale:
+                self._idle.append(worker)
+                self._cond.notify_all()
+        if stale:
+            # Occupato o in avvio durante un add/remove: non ha la lista di addon aggiornata
+            self._discard(worker)
+
+    def _all_workers(self) -> List[_Worker]:
+        """
+        Prende in esclusiva i worker liberi (per le operazioni broadcast), aspettando al massimo
+        start_timeout quelli occupati. Chi resta fuori viene sostituito quando torna libero.
+        """
+        deadline = time.monotonic() + self.start_timeout
+        taken = []
+        with self._cond:
+            while True:
+                taken += self._idle
+                self._idle = []
+                remaining = deadline - time.monotonic()
+                if len(taken) >= len(self._workers) or remaining <= 0:
+                    return taken
+                self._cond.wait(remaining)
+
+    def _broadcast(self, message, timeout: float) -> Optional[Dict[str, Any]]:
+        with self._cond:
+            self.generation += 1
+            generation = self.generation
+        result = None
+        for worker in self._all_workers():
+            try:
+                status, value = worker.request(message, timeout)
+            except (TimeoutError, EOFError, OSError):
+                self._discard(worker)
+                continue
+            worker.generation = generation
+            if status == "ok":
+                result = value
+            self._checkin(worker)
+        return result
+
+    def add(self, name: str, path: str) -> Dict[str, Any]:
+        with self._cond:
+            self.specs = [s for s in self.specs if s[0] != name] + [(name, path)]
+            first = not self._started
+            self._started = True
+        if first:
+            # Primo addon isolato: i worker partono qui, prima che la chat inizi
+            for _ in range(self.size):
+                worker = self._spawn()
+                with self._cond:
+                    self._workers.add(worker)
+                self._checkin(worker)
+            return self.tables.get(name, {"error": "addon non caricato"})
+
+        table = self._broadcast(("load", name, None, path), self.start_timeout)
+        if table is not None:
+            self.tables[name] = table
+        return self.tables.get(name, {"error": "addon non caricato"})
+
+    def remove(self, name: str) -> None:
+        with self._cond:
+            self.specs = [s for s in self.specs if s[0] != name]
+        self.tables.pop(name, None)
+        self._broadcast(("unload", name, None, None), self.timeout)
+
+    def call(self, name: str, op: str, index: Optional[int], args: Any, timeout: Optional[float] = -1):
+        """Esegue una chiamata su un worker libero. timeout=-1 usa il timeout del pool."""
+        timeout = self.timeout if timeout == -1 else timeout
+        worker = self._checkout(timeout)
+        if worker is None:
+            self._ensure_size()
+            raise AddonCallError(f"nessun worker libero per '{name}'")
+
+        try:
+            status, value = worker.request((op, name, index, args), timeout)
+        except TimeoutError:
+            self._discard(worker)
+            raise AddonCallError(f"'{name}' ha superato il timeout di {timeout}s, worker in riavvio")
+        except (EOFError, OSError):
+            self._discard(worker)
+            raise AddonCallError(f"il worker di '{name}' è terminato, worker in riavvio")
+        self._checkin(worker)
+
+        if status == "error":
+            raise AddonCallError(value)
+        return value
+
+    def shutdown(self) -> None:
+        with self._cond:
+            workers, self._workers, self._idle = list(self._workers), set(), []
+            self._started = False
+            self._cond.notify_all()
+        for worker in workers:
+            worker.kill()
@@ -1,10 +1,19 @@
 import os
+import ast
+import copy
 import json
+import time
+import hashlib
+import types
+import threading
 import importlib.util
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Callable, Optional, Dict, Any, Tuple
 
 from colorama import Fore, Style
 from files.menu import menu_loop
+from files.filters import OutputFilter, make_filter
+from files.config_store import CONFIG_STORE
 
 # ----------------------------------------
 # Percorsi e costanti globali
@@ -15,6 +24,8 @@ ADDONS_FOLDER = os.path.join(PROJECT_ROOT, "addons")
 # Allineato alla tua struttura: dati persistenti degli addon in /files/files/addons_data
 ADDONS_DATA_DIR = os.path.join(os.path.dirname(__file__), "files", "addons_data")
 os.makedirs(ADDONS_DATA_DIR, exist_ok=True)
+# Manifest degli addon: firma del file + __description__ letti senza importarli
+ADDONS_MANIFEST_PATH = os.path.join(os.path.dirname(__file__), "files", "addons_manifest.json")
 
 # ----------------------------------------
 # Colori e helper di stampa
@@ -94,11 +105,26 @@ CUSTOM_COMMANDS: List[Dict[str, Any]] = []
 # Ogni hook: callable(agent, text) -> text
 USER_INPUT_HOOKS: List[Callable[[Any, str], str]] = []
 MODEL_OUTPUT_HOOKS: List[Callable[[Any, str], str]] = []
+# Variante per lo streaming: callable(agent, chunk) -> chunk, chiamata su ogni pezzo
+MODEL_OUTPUT_STREAM_HOOKS: List[Callable[[Any, str], str]] = []
+
+# Filtri di output per la pipeline di streaming: factory() -> OutputFilter (una per risposta)
+OUTPUT_FILTERS: List[Callable[[], OutputFilter]] = []
 
 # Voci extra per menu (label, handler)
 MAIN_MENU_ENTRIES: List[Tuple[str, Callable[[], None]]] = []
 ADDONS_MENU_ENTRIES: List[Tuple[str, Callable[[], None]]] = []
 
+# Registrazioni fatte da ogni addon durante il suo import: nome -> [(registro, voce)].
+# Servono a togliere le voci vecchie quando un addon viene ricaricato.
+ADDON_REGISTRATIONS: Dict[str, List[Tuple[list, Any]]] = {}
+_loading = threading.local()
+
+def _track(registry: list, entry: Any) -> None:
+    name = getattr(_loading, "name", None)
+    if name:
+        ADDON_REGISTRATIONS.setdefault(name, []).append((registry, entry))
+
 def register_command(name: str, handler: Callable[[Any, str, Any], Optional[str]], help_text: str = "") -> None:
     """
     Registra un comando custom.
@@ -111,8 +137,11 @@ def register_command(name: str, handler: Callable[[Any, str, Any], Optional[str]
         if c["name"] == name:
             c["handler"] = handler
             c["help"] = help_text
+            _track(CUSTOM_COMMANDS, c)
             return
-    CUSTOM_COMMANDS.append({"name": name, "handler": handler, "help": help_text})
+    entry = {"name": name, "handler": handler, "help": help_text}
+    CUSTOM_COMMANDS.append(entry)
+    _track(CUSTOM_COMMANDS, entry)
 
 def get_registered_commands() -> List[str]:
     return [f"/{c['name']}" for c in CUSTOM_COMMANDS]
@@ -145,88 +174,441 @@ def handle_custom_command(agent: Any, raw_text: str, settings: Any) -> Tuple[boo
 
 def register_user_input_hook(func: Callable[[Any, str], str]) -> None:
     USER_INPUT_HOOKS.append(func)
+    _track(USER_INPUT_HOOKS, func)
 
 def register_model_output_hook(func: Callable[[Any, str], str]) -> None:
     MODEL_OUTPUT_HOOKS.append(func)
+    _track(MODEL_OUTPUT_HOOKS, func)
 
-def run_user_input_hooks(agent: Any, text: str) -> str:
+def register_model_output_stream_hook(func: Callable[[Any, str], str]) -> None:
+    MODEL_OUTPUT_STREAM_HOOKS.append(func)
+    _track(MODEL_OUTPUT_STREAM_HOOKS, func)
+
+def register_output_filter(spec: Any) -> None:
     """
-    Applica in cascata tutti gli hook di input registrati: text = hook(agent, text).
+    Aggiunge un filtro alla pipeline di output (dopo il filtro emoji).
+    spec può essere: pattern regex (rimosso dal testo), funzione text -> text,
+    classe o istanza di files.filters.OutputFilter (es. RegexFilter con window > 1).
     """
+    if isinstance(spec, OutputFilter):
+        # Una copia per risposta: il buffer di un filtro non va condiviso tra stream contemporanei
+        factory = lambda: copy.deepcopy(spec)
+    else:
+        make_filter(spec)  # valida subito, l'errore compare alla registrazione
+        factory = lambda: make_filter(spec)
+    OUTPUT_FILTERS.append(factory)
+    _track(OUTPUT_FILTERS, factory)
+
+# ----------------------------------------
+# Esecuzione hook con misura dei tempi e budget
+# ----------------------------------------
+
+# Budget per singola chiamata di hook; dopo HOOK_MAX_OVERRUNS sforamenti consecutivi
+# l'hook viene disattivato. Configurabili da Settings tramite set_hook_budget().
+HOOK_BUDGET_MS = 50.0
+HOOK_MAX_OVERRUNS = 3
+
+# hook -> {"name", "kind", "calls", "total_ms", "max_ms", "overruns", "disabled"}
+HOOK_STATS: Dict[Callable, Dict[str, Any]] = {}
+
+def set_hook_budget(budget_ms: float, max_overruns: int) -> None:
+    global HOOK_BUDGET_MS, HOOK_MAX_OVERRUNS
+    HOOK_BUDGET_MS = budget_ms
+    HOOK_MAX_OVERRUNS = max_overruns
+
+def _hook_name(hook: Callable) -> str:
+    module = getattr(hook, "__module__", None) or "?"
+    return f"{module}.{getattr(hook, '__qualname__', repr(hook))}"
+
+def _hook_stats(hook: Callable, kind: str) -> Dict[str, Any]:
+    stats = HOOK_STATS.get(hook)
+    if stats is None:
+        stats = {"name": _hook_name(hook), "kind": kind, "calls": 0, "total_ms": 0.0,
+                 "max_ms": 0.0, "overruns": 0, "disabled": False}
+        HOOK_STATS[hook] = stats
+    return stats
+
+def _run_hook_chain(kind: str, hooks: List[Callable[[Any, str], str]], agent: Any, text: str) -> str:
     out = text
-    for hook in USER_INPUT_HOOKS:
+    for hook in hooks:
+        stats = _hook_stats(hook, kind)
+        if stats["disabled"]:
+            continue
+        start = time.perf_counter()
         try:
             out = hook(agent, out)
             if out is None:
                 # Se un hook restituisce None, mantieni stringa corrente
                 out = text
         except Exception as e:
-            print_error(f"[Hook on_input] Errore: {e}")
+            print_error(f"[Hook {kind}] Errore: {e}")
+        elapsed = (time.perf_counter() - start) * 1000
+
+        stats["calls"] += 1
+        stats["total_ms"] += elapsed
+        stats["max_ms"] = max(stats["max_ms"], elapsed)
+        if HOOK_BUDGET_MS and elapsed > HOOK_BUDGET_MS:
+            stats["overruns"] += 1
+            if HOOK_MAX_OVERRUNS and stats["overruns"] >= HOOK_MAX_OVERRUNS:
+                stats["disabled"] = True
+                print_warning(f"[Hook {kind}] {stats['name']} disattivato: "
+                              f"{stats['overruns']} volte oltre {HOOK_BUDGET_MS:.0f} ms (ultima {elapsed:.0f} ms)")
+        else:
+            stats["overruns"] = 0
     return out
 
+def run_user_input_hooks(agent: Any, text: str) -> str:
+    """
+    Applica in cascata tutti gli hook di input registrati: text = hook(agent, text).
+    """
+    return _run_hook_chain("on_input", USER_INPUT_HOOKS, agent, text)
+
 def run_model_output_hooks(agent: Any, text: str) -> str:
     """
     Applica in cascata tutti gli hook di output registrati: text = hook(agent, text).
     """
-    out = text
-    for hook in MODEL_OUTPUT_HOOKS:
-        try:
-            out = hook(agent, out)
-            if out is None:
-                out = text
-        except Exception as e:
-            print_error(f"[Hook on_output] Errore: {e}")
-    return out
+    return _run_hook_chain("on_output", MODEL_OUTPUT_HOOKS, agent, text)
+
+def run_model_output_stream_hooks(agent: Any, chunk: str) -> str:
+    """
+    Applica in cascata gli hook di streaming su un singolo pezzo di risposta.
+    Un hook può restituire "" per scartare il pezzo.
+    """
+    return _run_hook_chain("on_output_stream", MODEL_OUTPUT_STREAM_HOOKS, agent, chunk)
+
+def get_hook_stats() -> List[Dict[str, Any]]:
+    """Statistiche degli hook, dal più lento (tempo cumulativo) al più veloce."""
+    return sorted(HOOK_STATS.values(), key=lambda s: s["total_ms"], reverse=True)
+
+def reset_hook_stats() -> None:
+    """Azzera i tempi e riattiva gli hook disattivati per sforamento del budget."""
+    HOOK_STATS.clear()
 
 def register_main_menu_entry(label: str, handler: Callable[[], None]) -> None:
     MAIN_MENU_ENTRIES.append((label, handler))
+    _track(MAIN_MENU_ENTRIES, MAIN_MENU_ENTRIES[-1])
 
 def register_addons_menu_entry(label: str, handler: Callable[[], None]) -> None:
     ADDONS_MENU_ENTRIES.append((label, handler))
+    _track(ADDONS_MENU_ENTRIES, ADDONS_MENU_ENTRIES[-1])
 
 # Config persistente per singolo addon
 def get_addon_config(name: str, default: Optional[dict] = None) -> dict:
+    # Dalla cache: dentro un hook costa solo una stat (il file può cambiarlo un worker)
     path = os.path.join(ADDONS_DATA_DIR, f"{name}.json")
-    if not os.path.exists(path):
-        return default or {}
     try:
-        with open(path, "r", encoding="utf-8") as f:
-            return json.load(f)
+        return CONFIG_STORE.load(path, default or {})
     except Exception as e:
         print_error(f"Errore lettura config {name}: {e}")
         return default or {}
 
 def save_addon_config(name: str, data: dict) -> None:
+    # La scrittura su disco è differita e atomica (vedi files.config_store)
     path = os.path.join(ADDONS_DATA_DIR, f"{name}.json")
     try:
-        with open(path, "w", encoding="utf-8") as f:
-            json.dump(data, f, indent=2)
+        CONFIG_STORE.set(path, data)
         print_success(f"Configurazione salvata: {name}")
     except Exception as e:
         print_error(f"Errore salvataggio config {name}: {e}")
 
+def watch_addon_config(name: str, callback: Callable[[dict], None]) -> None:
+    """Chiama callback(config) a ogni save_addon_config dello stesso addon."""
+    path = os.path.join(ADDONS_DATA_DIR, f"{name}.json")
+    CONFIG_STORE.subscribe(path, lambda _path, data: callback(data))
+
 # ----------------------------------------
 # Loader addon + applicazione modificatori agente
 # ----------------------------------------
 
-def load_addons() -> List[Any]:
-    addons: List[Any] = []
-    if not os.path.exists(ADDONS_FOLDER):
-        os.makedirs(ADDONS_FOLDER)
+def read_addon_header(path: str) -> Dict[str, Any]:
+    """
+    Legge __description__, __lazy__ e __isolated__ dal sorgente con ast,
+    senza eseguire l'addon.
+    """
+    header = {"description": None, "lazy": False, "isolated": False}
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            tree = ast.parse(f.read(), filename=path)
+    except (OSError, SyntaxError, ValueError):
+        return header
+    for node in tree.body:
+        if isinstance(node, ast.Assign) and isinstance(node.value, ast.Constant):
+            for target in node.targets:
+                if isinstance(target, ast.Name) and target.id == "__description__":
+                    header["description"] = str(node.value.value)
+                elif isinstance(target, ast.Name) and target.id == "__lazy__":
+                    header["lazy"] = bool(node.value.value)
+                elif isinstance(target, ast.Name) and target.id == "__isolated__":
+                    header["isolated"] = bool(node.value.value)
+    return header
+
+def _file_hash(path: str) -> str:
+    with open(path, "rb") as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+class AddonManager:
+    """
+    Loader degli addon con cache.
+    - un addon già importato non viene rieseguito finché il file non cambia (mtime/dimensione,
+      poi hash del contenuto per ignorare un semplice touch)
+    - al ricaricamento le vecchie registrazioni (hook, comandi, voci di menu, filtri) vengono tolte
+    - il manifest su disco conserva __description__: il menu addon non importa nulla
+    - gli addon con `__lazy__ = True` vengono importati solo quando servono davvero
+    - gli addon con `__isolated__ = True` girano in un pool di processi (files/addon_worker.py):
+      qui restano solo proxy che inoltrano le chiamate con un timeout; main() e le voci di menu
+      usano il terminale e girano invece in questo processo
+    """
+
+    def __init__(self, folder: str = ADDONS_FOLDER, manifest_path: str = ADDONS_MANIFEST_PATH):
+        self.folder = folder
+        self.manifest_path = manifest_path
+        self.modules: Dict[str, Any] = {}
+        self.loaded_signatures: Dict[str, Dict[str, Any]] = {}
+        self.manifest: Dict[str, Dict[str, Any]] = self._read_manifest()
+        self._lock = threading.RLock()
+        self.pool = None
+        # Addon isolati importati anche qui per main() e menu: nome -> (modulo, handler del menu)
+        self.interactive: Dict[str, Tuple[Any, List[Callable[[], None]]]] = {}
+        self.isolation = (2, 5.0)  # (worker, timeout per chiamata in secondi)
+
+    def configure_isolation(self, workers: int, timeout: float) -> None:
+        self.isolation = (workers, timeout)
+        if self.pool is not None:
+            self.pool.timeout = timeout
+
+    def _read_manifest(self) -> Dict[str, Dict[str, Any]]:
+        try:
+            with open(self.manifest_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
 
-    for file in os.listdir(ADDONS_FOLDER):
-        if file.endswith(".py") and not file.startswith("__"):
-            path = os.path.join(ADDONS_FOLDER, file)
+    def _write_manifest(self) -> None:
+        try:
+            with open(self.manifest_path, "w", encoding="utf-8") as f:
+                json.dump(self.manifest, f, indent=2)
+        except OSError as e:
+            print_error(f"[Addon] Errore salvataggio manifest: {e}")
+
+    def scan(self) -> Dict[str, str]:
+        """Nome -> percorso degli addon presenti; aggiorna il manifest solo per i file cambiati."""
+        if not os.path.exists(self.folder):
+            os.makedirs(self.folder)
+
+        found: Dict[str, str] = {}
+        changed = False
+        for file in sorted(os.listdir(self.folder)):
+            if not file.endswith(".py") or file.startswith("__"):
+                continue
             name = file[:-3]
+            path = os.path.join(self.folder, file)
+            found[name] = path
+            st = os.stat(path)
+            entry = self.manifest.get(name)
+            if entry and entry["mtime_ns"] == st.st_mtime_ns and entry["size"] == st.st_size:
+                continue
+            digest = _file_hash(path)
+            if entry and entry["sha1"] == digest:
+                entry["mtime_ns"] = st.st_mtime_ns
+            else:
+                entry = dict(read_addon_header(path), sha1=digest, size=st.st_size, mtime_ns=st.st_mtime_ns)
+                self.manifest[name] = entry
+            changed = True
+
+        for name in list(self.manifest):
+            if name not in found:
+                del self.manifest[name]
+                self.unload(name)
+                changed = True
+        if changed:
+            self._write_manifest()
+        return found
+
+    def describe(self, name: str) -> str:
+        entry = self.manifest.get(name) or {}
+        return entry.get("description") or name
+
+    def is_lazy(self, name: str) -> bool:
+        return bool((self.manifest.get(name) or {}).get("lazy"))
+
+    def unload(self, name: str) -> None:
+        """Toglie dai registri tutto ciò che l'addon aveva registrato."""
+        with self._lock:
+            module = self.modules.pop(name, None)
+            if getattr(module, "__isolated__", False) and self.pool is not None:
+                self.pool.remove(name)
+            self.interactive.pop(name, None)
+            self.loaded_signatures.pop(name, None)
+            for registry, entry in ADDON_REGISTRATIONS.pop(name, []):
+                if any(item is entry for item in registry):
+                    registry[:] = [item for item in registry if item is not entry]
+            # Hook aggiunti direttamente alle liste, senza register_*
+            for registry in (USER_INPUT_HOOKS, MODEL_OUTPUT_HOOKS, MODEL_OUTPUT_STREAM_HOOKS):
+                registry[:] = [h for h in registry if getattr(h, "__module__", None) != name]
+            for hook in [h for h in HOOK_STATS if getattr(h, "__module__", None) == name]:
+                del HOOK_STATS[hook]
+
+    def load(self, name: str, path: Optional[str] = None) -> Optional[Any]:
+        """Restituisce il modulo, importandolo solo se non è in cache o se il file è cambiato."""
+        path = path or os.path.join(self.folder, f"{name}.py")
+        entry = self.manifest.get(name)
+        if entry is None:
+            self.scan()
+            entry = self.manifest.get(name)
+            if entry is None:
+                return None
+
+        with self._lock:
+            module = self.modules.get(name)
+            if module is not None and self.loaded_signatures.get(name) == entry["sha1"]:
+                return module
+            if module is not None:
+                self.unload(name)
+
+        if entry.get("isolated"):
+            module = self._load_isolated(name, path, entry)
+            if module is not None:
+                with self._lock:
+                    self.modules[name] = module
+                    self.loaded_signatures[name] = entry["sha1"]
+                print_success(f"[Addon] Caricato in un processo separato: {name}.py")
+            return module
+
+        _loading.name = name
+        try:
+            spec = importlib.util.spec_from_file_location(name, path)
+            module = importlib.util.module_from_spec(spec)
+            spec.loader.exec_module(module)
+        except Exception as e:
+            self.unload(name)
+            print_error(f"[Addon] Errore nel caricamento di '{name}.py': {e}")
+            return None
+        finally:
+            _loading.name = None
+
+        with self._lock:
+            self.modules[name] = module
+            self.loaded_signatures[name] = entry["sha1"]
+        print_success(f"[Addon] Caricato: {name}.py")
+        return module
+
+    def _load_isolated(self, name: str, path: str, entry: Dict[str, Any]) -> Optional[Any]:
+        """Importa l'addon nei worker e registra qui dei proxy per hook, comandi e menu."""
+        from files.addon_worker import AddonWorkerPool, AddonCallError, agent_snapshot, settings_snapshot
+
+        try:
+            if self.pool is None:
+                self.pool = AddonWorkerPool(*self.isolation)
+            table = self.pool.add(name, path)
+        except Exception as e:
+            print_error(f"[Addon] Errore nell'avvio del worker per '{name}.py': {e}")
+            return None
+        if "error" in table:
+            print_error(f"[Addon] Errore nel caricamento di '{name}.py': {table['error']}")
+            self.pool.remove(name)
+            return None
+
+        def hook_proxy(kind: str, index: int) -> Callable[[Any, str], Optional[str]]:
+            def proxy(agent: Any, text: str) -> Optional[str]:
+                try:
+                    return self.pool.call(name, kind, index, (agent_snapshot(agent), text))
+                except AddonCallError as e:
+                    print_warning(f"[Addon {name}] {e}")
+                    return None
+            proxy.__module__ = name
+            proxy.__qualname__ = f"{kind}[{index}]"
+            return proxy
+
+        def command_proxy(index: int) -> Callable[[Any, str, Any], Optional[str]]:
+            def proxy(agent: Any, args: str, settings: Any) -> Optional[str]:
+                try:
+                    return self.pool.call(name, "command", index,
+                                          (agent_snapshot(agent), args, settings_snapshot(settings)))
+                except AddonCallError as e:
+                    print_warning(f"[Addon {name}] {e}")
+                    return None
+            return proxy
+
+        def menu_proxy(index: int) -> Callable[[], None]:
+            return lambda: self._interactive(name, path)[1][index]()
+
+        module = types.ModuleType(name)
+        module.__file__ = path
+        module.__description__ = entry.get("description") or name
+        module.__isolated__ = True
+        if table["main"]:
+            # Nel worker stdin è /dev/null: input() e i menu darebbero EOFError
+            module.main = lambda: self._interactive(name, path)[0].main()
+
+        _loading.name = name
+        try:
+            for kind, register in (("on_input", register_user_input_hook),
+                                   ("on_output", register_model_output_hook),
+                                   ("on_output_stream", register_model_output_stream_hook)):
+                for index in range(table[kind]):
+                    register(hook_proxy(kind, index))
+            for index, (cmd_name, help_text) in enumerate(table["commands"]):
+                register_command(cmd_name, command_proxy(index), help_text)
+            for index, label in enumerate(table["menu"]):
+                register_addons_menu_entry(label, menu_proxy(index))
+        finally:
+            _loading.name = None
+        return module
+
+    def _interactive(self, name: str, path: str) -> Tuple[Any, List[Callable[[], None]]]:
+        """
+        Import dell'addon isolato in questo processo, alla prima chiamata di main() o di una
+        voce di menu. Hook, comandi e filtri registrati dall'import vengono tolti: restano nei worker.
+        """
+        with self._lock:
+            cached = self.interactive.get(name)
+            if cached is not None:
+                return cached
+            registries = (USER_INPUT_HOOKS, MODEL_OUTPUT_HOOKS, MODEL_OUTPUT_STREAM_HOOKS,
+                          CUSTOM_COMMANDS, OUTPUT_FILTERS, MAIN_MENU_ENTRIES, ADDONS_MENU_ENTRIES)
+            before = {id(registry): list(registry) for registry in registries}
             try:
                 spec = importlib.util.spec_from_file_location(name, path)
                 module = importlib.util.module_from_spec(spec)
                 spec.loader.exec_module(module)
-                addons.append(module)
-                print_success(f"[Addon] Caricato: {file}")
-            except Exception as e:
-                print_error(f"[Addon] Errore nel caricamento di '{file}': {e}")
-    return addons
+            finally:
+                added = {}
+                for registry in registries:
+                    old = before[id(registry)]
+                    added[id(registry)] = [item for item in registry if not any(item is o for o in old)]
+                    registry[:] = old
+            menu = [handler for (_label, handler) in added[id(ADDONS_MENU_ENTRIES)]]
+            self.interactive[name] = (module, menu)
+            return module, menu
+
+    def shutdown(self) -> None:
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
+
+    def load_all(self, include_lazy: bool = False, parallel: bool = False, workers: int = 8) -> List[Any]:
+        """
+        Carica (o prende dalla cache) tutti gli addon non lazy.
+        parallel=True importa i file cambiati in parallelo: più veloce con molti addon,
+        ma l'ordine di registrazione degli hook non è più quello alfabetico.
+        """
+        found = self.scan()
+        names = [n for n in found if include_lazy or not self.is_lazy(n)]
+        if parallel and len(names) > 1:
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                modules = list(pool.map(lambda n: self.load(n, found[n]), names))
+        else:
+            modules = [self.load(n, found[n]) for n in names]
+        return [m for m in modules if m is not None]
+
+ADDON_MANAGER = AddonManager()
+
+def load_addons(include_lazy: bool = False, parallel: bool = False) -> List[Any]:
+    """
+    Addon pronti all'uso. Solo i file nuovi o modificati vengono (re)importati,
+    gli altri arrivano dalla cache di ADDON_MANAGER.
+    """
+    return ADDON_MANAGER.load_all(include_lazy=include_lazy, parallel=parallel)
 
 def apply_agent_modifiers(agent: Any, addons: List[Any]) -> None:
     """
@@ -246,19 +628,29 @@ def apply_agent_modifiers(agent: Any, addons: List[Any]) -> None:
 # Menu interattivo per addons
 # ----------------------------------------
 
-def show_addons_menu(addons: List[Any]) -> None:
+def show_addons_menu(addons: Optional[List[Any]] = None) -> None:
     """
     Mostra il menu addon con:
-      - elenco degli addon caricati (se hanno main())
+      - elenco degli addon (se hanno main())
       - eventuali voci extra registrate dagli addon (ADDONS_MENU_ENTRIES)
+    Senza lista esplicita le voci arrivano dal manifest: gli addon lazy vengono
+    importati solo quando si sceglie la loro voce.
     """
-    if not addons and not ADDONS_MENU_ENTRIES:
+    if addons is None:
+        load_addons()  # addon non lazy (dalla cache): registrano le loro voci di menu
+        names = list(ADDON_MANAGER.scan())
+        addon_labels = [ADDON_MANAGER.describe(name) for name in names]
+        get_addon = lambda idx: ADDON_MANAGER.load(names[idx])
+    else:
+        addon_labels = [getattr(mod, "__description__", mod.__name__) for mod in addons]
+        get_addon = lambda idx: addons[idx]
+
+    if not addon_labels and not ADDONS_MENU_ENTRIES:
         print_warning("Nessun addon disponibile.")
         input("Premi Invio per tornare al menu...")
         return
 
     # Costruisci voci menu: addon con main + voci extra registrate
-    addon_labels = [getattr(mod, "__description__", mod.__name__) for mod in addons]
     custom_labels = [label for (label, _handler) in ADDONS_MENU_ENTRIES]
     options = addon_labels + custom_labels + ["Torna al menu principale"]
 
@@ -267,10 +659,12 @@ def show_addons_menu(addons: List[Any]) -> None:
         if choice == -1 or choice == len(options) - 1:
             break
 
-        # Se scelta rientra negli addon caricati
+        # Se scelta rientra negli addon
         if 0 <= choice < len(addon_labels):
-            addon = addons[choice]
-            if hasattr(addon, "main") and callable(addon.main):
+            addon = get_addon(choice)
+            if addon is None:
+                pass  # errore di caricamento già segnalato
+            elif hasattr(addon, "main") and callable(addon.main):
                 try:
                     print_info(f"\nEsecuzione addon: {addon.__name__}")
                     addon.main()
@@ -309,13 +703,18 @@ __all__ = [
 
     # Loader e menu
     "load_addons", "show_addons_menu", "apply_agent_modifiers",
+    "AddonManager", "ADDON_MANAGER", "read_addon_header",
 
     # Registri e API per modding
     "CUSTOM_COMMANDS", "USER_INPUT_HOOKS", "MODEL_OUTPUT_HOOKS",
+    "MODEL_OUTPUT_STREAM_HOOKS", "OUTPUT_FILTERS",
     "MAIN_MENU_ENTRIES", "ADDONS_MENU_ENTRIES",
     "register_command", "get_registered_commands", "handle_custom_command",
     "register_user_input_hook", "register_model_output_hook",
+    "register_model_output_stream_hook", "register_output_filter",
     "run_user_input_hooks", "run_model_output_hooks",
+    "run_model_output_stream_hooks",
+    "HOOK_STATS", "set_hook_budget", "get_hook_stats", "reset_hook_stats",
     "register_main_menu_entry", "register_addons_menu_entry",
-    "get_addon_config", "save_addon_config",
+    "get_addon_config", "save_addon_config", "watch_addon_config",
 ]
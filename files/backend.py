@@ -0,0 +1,615 @@
+import os
+import copy
+import json
+import time
+import threading
+
+from files.config_store import CONFIG_STORE
+from files.profiles import load_options
+from files.scheduler import SCHEDULER, Task, TaskCancelled
+
+DEFAULT_OLLAMA_URL = "http://localhost:11434"
+# Impostazioni lette da create_client: se cambiano (es. con un profilo) serve un client nuovo
+CLIENT_SETTINGS = (
+    "ollama_url", "ollama_endpoints", "connect_timeout", "read_timeout", "pool_size",
+    "keep_alive", "max_concurrent_requests", "health_check_interval", "hedge_after_ms",
+)
+# Nomi dei modelli per URL del server, per aprire il menu senza attendere Ollama
+MODELS_CACHE_PATH = os.path.join(os.path.dirname(__file__), "files", "models_cache.json")
+
+class OllamaClient:
+    """
+    Client HTTP verso Ollama.
+    Usa una requests.Session condivisa: le connessioni restano aperte (keep-alive)
+    e vengono riutilizzate tra un turno e l'altro invece di riaprirle ogni volta.
+    requests (~30 ms di import) viene caricato alla prima richiesta, non all'avvio.
+    """
+
+    def __init__(self, base_url=DEFAULT_OLLAMA_URL, connect_timeout=5.0, read_timeout=300.0, pool_size=4,
+                 keep_alive=None, max_concurrent=0):
+        self.base_url = (base_url or DEFAULT_OLLAMA_URL).rstrip("/")
+        # requests accetta (connect, read): read vale anche tra un chunk e l'altro in streaming
+        self.timeout = (connect_timeout, read_timeout)
+        self.pool_size = pool_size
+        # Quanto Ollama tiene il modello in memoria dopo ogni richiesta ("30m", secondi, -1 = sempre)
+        self.keep_alive = keep_alive
+        # Generazioni contemporanee verso questo server (0 = nessun limite), vedi files/scheduler.py
+        self.max_concurrent = max_concurrent
+        self._session = None
+        self._session_lock = threading.Lock()
+
+    @property
+    def session(self):
+        if self._session is None:
+            with self._session_lock:
+                if self._session is None:
+                    import requests
+                    from requests.adapters import HTTPAdapter
+                    session = requests.Session()
+                    adapter = HTTPAdapter(pool_connections=self.pool_size, pool_maxsize=self.pool_size)
+                    session.mount("http://", adapter)
+                    session.mount("https://", adapter)
+                    self._session = session
+        return self._session
+
+    @classmethod
+    def from_settings(cls, settings):
+        return cls(
+            base_url=settings.ollama_url,
+            connect_timeout=settings.connect_timeout,
+            read_timeout=settings.read_timeout,
+            pool_size=settings.pool_size,
+            keep_alive=settings.keep_alive,
+            max_concurrent=settings.max_concurrent_requests
+        )
+
+    def url(self, path: str) -> str:
+        return f"{self.base_url}{path}"
+
+    def get(self, path: str):
+        return self.session.get(self.url(path), timeout=self.timeout)
+
+    def post(self, path: str, payload: dict, stream: bool = False):
+        if self.keep_alive is not None and "model" in payload and "keep_alive" not in payload:
+            payload = dict(payload, keep_alive=self.keep_alive)
+        return self.session.post(self.url(path), json=payload, stream=stream, timeout=self.timeout)
+
+    def generate(self, payload: dict, task=None) -> dict:
+        """
+        Risposta completa. Internamente è uno stream: Ollama invia gli header solo al primo
+        token e una risposta in streaming si può interrompere (task.cancel()) in qualunque momento.
+        """
+        parts, data = [], {}
+        for data in self.generate_stream(payload, task):
+            parts.append(data.get("response", ""))
+        return dict(data, response="".join(parts))
+
+    def generate_stream(self, payload: dict, task=None):
+        """
+        Generatore sui chunk NDJSON di /api/generate (un dict per riga).
+        La connessione viene chiusa anche se il chiamante interrompe lo stream;
+        con task.cancel() da un altro thread lo stream termina con TaskCancelled.
+        """
+        task = task or SCHEDULER.new_task("generate")
+        with SCHEDULER.slot(self.base_url, task, self.max_concurrent):
+            response = self.post("/api/generate", dict(payload, stream=True), stream=True)
+            with task.attached(response):
+                if response.status_code != 200:
+                    raise Exception(f"Request failed: {response.text}")
+                try:
+                    for line in response.iter_lines():
+                        if not line:
+                            continue
+                        data = json.loads(line)
+                        if "error" in data:
+                            raise Exception(f"Request failed: {data['error']}")
+                        yield data
+                        if data.get("done"):
+                            break
+                finally:
+                    response.close()
+
+    def embeddings(self, model: str, texts: list) -> list:
+        """Un vettore per testo, da /api/embed (più testi in una sola richiesta)."""
+        with SCHEDULER.slot(self.base_url, SCHEDULER.new_task("embed"), self.max_concurrent):
+            response = self.post("/api/embed", {"model": model, "input": texts})
+        if response.status_code != 200:
+            raise Exception(f"Request failed: {response.text}")
+        return response.json().get("embeddings", [])
+
+    def tags(self) -> list:
+        response = self.get("/api/tags")
+        if response.status_code != 200:
+            raise Exception(f"Request failed: {response.text}")
+        return response.json().get("models", [])
+
+    def load(self, model: str, options: dict = None) -> dict:
+        """Richiesta senza prompt: Ollama carica soltanto il modello in memoria."""
+        payload = {"model": model}
+        if options:
+            payload["options"] = dict(options)
+        return self.generate(payload)
+
+    def running(self) -> list:
+        """Modelli attualmente in memoria (/api/ps)."""
+        response = self.get("/api/ps")
+        if response.status_code != 200:
+            raise Exception(f"Request failed: {response.text}")
+        return response.json().get("models", [])
+
+    def close(self) -> None:
+        if self._session is not None:
+            self._session.close()
+
+class Endpoint:
+    """Stato di un server Ollama nel pool, aggiornato dagli health check e dalle richieste."""
+
+    def __init__(self, client: OllamaClient):
+        self.client = client
+        self.healthy = None      # None = non ancora controllato
+        self.models = None       # nomi da /api/tags (None = sconosciuti)
+        self.resident = set()    # modelli in memoria (/api/ps)
+        self.ping = None         # tempo di risposta di /api/tags all'ultimo health check (s)
+        self.latency = None      # media mobile della durata delle richieste riuscite (s)
+        self.in_flight = 0
+        self.requests = 0
+        self.failures = 0
+        self.last_error = ""
+
+    @property
+    def url(self) -> str:
+        return self.client.base_url
+
+    def has_model(self, model: str) -> bool:
+        return self.models is None or model in self.models
+
+class _Attempts:
+    """
+    Un Task per ogni tentativo (failover e hedging) di una richiesta del pool.
+    cancel() della richiesta li chiude tutti; settle(vincitore) chiude gli altri,
+    così il tentativo perdente smette di generare e libera il suo posto nello scheduler.
+    """
+
+    def __init__(self, task: Task):
+        self.task = task
+        self.tasks = []
+        self.settled = False
+        self._lock = threading.Lock()
+
+    def new(self) -> Task:
+        attempt = Task(self.task.name, self.task.priority)
+        self.task.on_cancel(attempt.cancel)
+        with self._lock:
+            self.tasks.append(attempt)
+            settled = self.settled
+        if settled or self.task.cancelled.is_set():
+            attempt.cancel()
+        return attempt
+
+    def settle(self, winner: Task) -> None:
+        with self._lock:
+            self.settled = True
+            losers = [t for t in self.tasks if t is not winner]
+        for attempt in losers:
+            attempt.cancel()
+
+class BackendPool:
+    """
+    Più server Ollama dietro la stessa interfaccia di OllamaClient.
+    - routing: tra gli endpoint sani che hanno il modello, prima quelli che lo hanno
+      già in memoria, poi il meno carico (richieste in corso), poi il più veloce
+    - health check in background su /api/tags e /api/ps ogni `health_interval` secondi
+    - failover: errore o timeout su un endpoint -> si prova il successivo
+    - hedging opzionale: se la risposta (o il primo chunk) non arriva entro `hedge_after`
+      secondi la stessa richiesta parte anche sul secondo endpoint e vince il più rapido
+    """
+
+    # Peso della nuova misura nella media mobile della latenza
+    LATENCY_ALPHA = 0.3
+
+    def __init__(self, urls, connect_timeout=5.0, read_timeout=300.0, pool_size=4, keep_alive=None,
+                 health_interval=10.0, hedge_after=0.0, max_concurrent=0):
+        self.endpoints = [
+            Endpoint(OllamaClient(url, connect_timeout, read_timeout, pool_size, keep_alive, max_concurrent))
+            for url in urls
+        ]
+        if not self.endpoints:
+            raise ValueError("BackendPool richiede almeno un endpoint")
+        # Usato come chiave della cache dei modelli
+        self.base_url = ",".join(e.url for e in self.endpoints)
+        self.keep_alive = keep_alive
+        self.health_interval = health_interval
+        self.hedge_after = hedge_after
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._health = threading.Thread(target=self._health_loop, daemon=True)
+        self._health.start()
+
+    @classmethod
+    def from_settings(cls, settings):
+        return cls(
+            settings.ollama_endpoints,
+            connect_timeout=settings.connect_timeout,
+            read_timeout=settings.read_timeout,
+            pool_size=settings.pool_size,
+            keep_alive=settings.keep_alive,
+            health_interval=settings.health_check_interval,
+            hedge_after=settings.hedge_after_ms / 1000,
+            max_concurrent=settings.max_concurrent_requests
+        )
+
+    # ---------- health check ----------
+
+    def check(self, endpoint: Endpoint) -> None:
+        start = time.perf_counter()
+        try:
+            models = {m.get("name") or m.get("model") for m in endpoint.client.tags()}
+        except Exception as e:
+            with self._lock:
+                endpoint.healthy = False
+                endpoint.last_error = str(e)
+            return
+        elapsed = time.perf_counter() - start
+        try:
+            resident = {m.get("name") or m.get("model") for m in endpoint.client.running()}
+        except Exception:
+            resident = set()  # server senza /api/ps: solo niente affinità
+        with self._lock:
+            endpoint.healthy = True
+            endpoint.models = models
+            endpoint.resident = resident
+            endpoint.ping = elapsed
+
+    def check_all(self) -> None:
+        # In parallelo: un endpoint irraggiungibile non rallenta il controllo degli altri
+        threads = [threading.Thread(target=self.check, args=(e,), daemon=True) for e in self.endpoints]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+    def _health_loop(self) -> None:
+        while not self._stop.is_set():
+            self.check_all()
+            self._stop.wait(self.health_interval)
+
+    # ---------- routing ----------
+
+    def candidates(self, model: str = None) -> list:
+        """Endpoint in ordine di preferenza per `model`; quelli guasti restano in fondo come ultima risorsa."""
+        with self._lock:
+            def rank(e: Endpoint):
+                return (
+                    e.healthy is False,
+                    model is not None and not e.has_model(model),
+                    model is not None and model not in e.resident,
+                    e.in_flight,
+                    # Finché non ci sono richieste misurate vale il tempo dell'health check
+                    e.latency if e.latency is not None else e.ping if e.ping is not None else float("inf"),
+                )
+            return sorted(self.endpoints, key=rank)
+
+    def _begin(self, endpoint: Endpoint) -> None:
+        with self._lock:
+            endpoint.in_flight += 1
+            endpoint.requests += 1
+
+    def _end(self, endpoint: Endpoint, error: Exception = None, elapsed: float = None) -> None:
+        with self._lock:
+            endpoint.in_flight -= 1
+            if elapsed is not None:
+                if endpoint.latency is None:
+                    endpoint.latency = elapsed
+                else:
+                    endpoint.latency += self.LATENCY_ALPHA * (elapsed - endpoint.latency)
+            if error is not None:
+                endpoint.failures += 1
+                endpoint.last_error = str(error)
+                # Errori di rete e timeout (requests.RequestException è un OSError): endpoint fuori
+                # dal routing fino al prossimo health check; un errore HTTP (es. modello assente) no
+                if isinstance(error, OSError):
+                    endpoint.healthy = False
+
+    def _call(self, model: str, func, endpoints=None):
+        """Esegue func(client) sul primo endpoint che risponde, in ordine di preferenza."""
+        last_error = None
+        for endpoint in endpoints or self.candidates(model):
+            self._begin(endpoint)
+            start = time.perf_counter()
+            try:
+                result = func(endpoint.client)
+            except TaskCancelled:
+                # Interrotta dall'utente: nessun failover e l'endpoint resta sano
+                self._end(endpoint)
+                raise
+            except Exception as e:
+                self._end(endpoint, e)
+                last_error = e
+                continue
+            self._end(endpoint, elapsed=time.perf_counter() - start)
+            return result
+        raise Exception(f"Request failed: no backend available ({last_error})")
+
+    def _submit(self, model: str, func, endpoints):
+        """
+        _call in un thread daemon: un tentativo bloccato su un server lento non occupa
+        un worker condiviso e non impedisce al processo di uscire.
+        """
+        from concurrent.futures import Future
+        future = Future()
+
+        def run():
+            try:
+                future.set_result(self._call(model, func, endpoints))
+            except Exception as e:
+                future.set_exception(e)
+
+        threading.Thread(target=run, daemon=True).start()
+        return future
+
+    def _hedged(self, model: str, func):
+        """
+        Come _call, ma se il primo tentativo non finisce entro hedge_after secondi
+        parte una copia sul prossimo endpoint; vince il primo risultato valido.
+        Restituisce (risultato, futures dei tentativi ancora in corso).
+        """
+        from concurrent.futures import wait, FIRST_COMPLETED
+        order = self.candidates(model)
+        if self.hedge_after <= 0 or len(order) < 2:
+            return self._call(model, func, order), []
+
+        futures = [self._submit(model, func, [order[0]] + order[2:])]
+        done, _ = wait(futures, timeout=self.hedge_after)
+        if not done:
+            futures.append(self._submit(model, func, [order[1]] + order[2:]))
+
+        last_error = None
+        pending = set(futures)
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    return future.result(), list(pending)
+                except Exception as e:
+                    last_error = e
+        raise last_error
+
+    # ---------- interfaccia di OllamaClient ----------
+
+    def url(self, path: str) -> str:
+        return self.candidates()[0].client.url(path)
+
+    def get(self, path: str):
+        return self._call(None, lambda c: c.get(path))
+
+    def post(self, path: str, payload: dict, stream: bool = False):
+        return self._call(payload.get("model"), lambda c: c.post(path, payload, stream))
+
+    def generate(self, payload: dict, task=None) -> dict:
+        attempts = _Attempts(task or SCHEDULER.new_task("generate"))
+
+        def attempt(client):
+            attempt_task = attempts.new()
+            return attempt_task, client.generate(payload, attempt_task)
+
+        (winner, result), _losers = self._hedged(payload.get("model"), attempt)
+        attempts.settle(winner)
+        return result
+
+    def generate_stream(self, payload: dict, task=None):
+        """
+        Failover e hedging valgono fino al primo chunk: da lì lo stream resta
+        sull'endpoint che ha risposto per primo, l'altro viene chiuso.
+        """
+        attempts = _Attempts(task or SCHEDULER.new_task("generate"))
+
+        def first_chunk(client):
+            attempt_task = attempts.new()
+            stream = client.generate_stream(payload, attempt_task)
+            try:
+                return attempt_task, client, stream, next(stream)
+            except StopIteration:
+                return attempt_task, client, stream, None
+
+        def close_loser(future):
+            try:
+                _task, _client, stream, _chunk = future.result()
+                stream.close()
+            except Exception:
+                pass
+
+        (winner, client, stream, chunk), losers = self._hedged(payload.get("model"), first_chunk)
+        # Il perdente viene interrotto subito; se aveva già il primo chunk si chiude anche il generatore
+        attempts.settle(winner)
+        for future in losers:
+            future.add_done_callback(close_loser)
+        endpoint = next(e for e in self.endpoints if e.client is client)
+        # La richiesta è già contata da _call: qui resta solo "in corso" fino alla fine dello stream
+        with self._lock:
+            endpoint.in_flight += 1
+        error = None
+        try:
+            if chunk is not None:
+                yield chunk
+                yield from stream
+        except GeneratorExit:
+            raise
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            stream.close()
+            self._end(endpoint, error)
+
+    def embeddings(self, model: str, texts: list) -> list:
+        return self._call(model, lambda c: c.embeddings(model, texts))
+
+    def tags(self) -> list:
+        """Unione dei modelli degli endpoint raggiungibili."""
+        seen, models = set(), []
+        for endpoint in self.endpoints:
+            try:
+                entries = endpoint.client.tags()
+            except Exception:
+                continue
+            for m in entries:
+                name = m.get("name") or m.get("model")
+                if name not in seen:
+                    seen.add(name)
+                    models.append(m)
+        if not models and not any(e.healthy for e in self.endpoints):
+            raise Exception("Request failed: no backend available")
+        return models
+
+    def load(self, model: str, options: dict = None) -> dict:
+        return self._call(model, lambda c: c.load(model, options))
+
+    def running(self) -> list:
+        models = []
+        for endpoint in self.endpoints:
+            try:
+                models.extend(dict(m, endpoint=endpoint.url) for m in endpoint.client.running())
+            except Exception:
+                continue
+        return models
+
+    def stats(self) -> list:
+        with self._lock:
+            return [{
+                "url": e.url,
+                "healthy": e.healthy,
+                "latency_ms": e.latency * 1000 if e.latency is not None else None,
+                "in_flight": e.in_flight,
+                "requests": e.requests,
+                "failures": e.failures,
+                "models": sorted(e.models) if e.models is not None else None,
+                "resident": sorted(e.resident),
+                "last_error": e.last_error,
+            } for e in self.endpoints]
+
+    def close(self) -> None:
+        self._stop.set()
+        for endpoint in self.endpoints:
+            endpoint.client.close()
+
+def create_client(settings):
+    """OllamaClient per un solo server, BackendPool se settings.ollama_endpoints elenca più server."""
+    if settings.ollama_endpoints:
+        return BackendPool.from_settings(settings)
+    return OllamaClient.from_settings(settings)
+
+def client_config(settings) -> dict:
+    """Valori di CLIENT_SETTINGS, da confrontare per sapere se il client va ricreato."""
+    return {key: copy.deepcopy(getattr(settings, key, None)) for key in CLIENT_SETTINGS}
+
+class ModelPreloader:
+    """
+    Carica i modelli in background, così la prima domanda non paga load_duration,
+    e tiene uno stato di residenza per l'indicatore in chat:
+    "loading" (caricamento in corso), "resident", "not loaded", "unknown".
+    /api/ps viene interrogato in un thread e al massimo ogni `refresh` secondi:
+    status() non blocca mai il prompt.
+    """
+
+    def __init__(self, client, settings=None, refresh: float = 5.0):
+        self.client = client
+        # Le opzioni del profilo attivo si leggono a ogni caricamento (il profilo può cambiare)
+        self.settings = settings
+        self.refresh = refresh
+        self.loading = set()
+        self.resident = {}       # nome -> voce di /api/ps
+        self.checked_at = 0.0
+        self.reachable = None
+        self._polling = False
+        self._lock = threading.Lock()
+
+    def preload(self, model: str) -> None:
+        if not model:
+            return
+        with self._lock:
+            if model in self.loading:
+                return
+            self.loading.add(model)
+        threading.Thread(target=self._load, args=(model,), daemon=True).start()
+
+    def _load(self, model: str) -> None:
+        try:
+            with SCHEDULER.background():
+                self.client.load(model, load_options(getattr(self.settings, "options", None)))
+            with self._lock:
+                self.resident.setdefault(model, {"name": model})
+        except Exception:
+            pass
+        finally:
+            with self._lock:
+                self.loading.discard(model)
+            self._poll()
+
+    def _poll(self) -> None:
+        try:
+            models = self.client.running()
+            resident = {m.get("name") or m.get("model"): m for m in models}
+            reachable = True
+        except Exception:
+            resident, reachable = {}, False
+        with self._lock:
+            self.resident = resident
+            self.reachable = reachable
+            self.checked_at = time.time()
+            self._polling = False
+
+    def status(self, model: str) -> str:
+        with self._lock:
+            if time.time() - self.checked_at > self.refresh and not self._polling:
+                self._polling = True
+                threading.Thread(target=self._poll, daemon=True).start()
+            if model in self.loading:
+                return "loading"
+            if self.reachable is None:
+                return "unknown"
+            return "resident" if model in self.resident else "not loaded"
+
+    def info(self, model: str) -> dict:
+        with self._lock:
+            return dict(self.resident.get(model) or {})
+
+def preload_model(settings, model: str) -> None:
+    """Carica `model` in background con un client dedicato (es. dopo la scelta nel menu)."""
+    client = create_client(settings)
+
+    def run():
+        try:
+            with SCHEDULER.background():
+                client.load(model, load_options(settings.options))
+        except Exception:
+            pass
+        finally:
+            # Sessione HTTP (e, con un pool, thread di health check) chiusa a caricamento finito
+            client.close()
+
+    threading.Thread(target=run, daemon=True).start()
+
+def _refresh_model_names(client) -> list:
+    models = [m.get("name") or m.get("model") for m in client.tags()]
+    cache = CONFIG_STORE.load(MODELS_CACHE_PATH, {})
+    cache[client.base_url] = {"ts": time.time(), "models": models}
+    CONFIG_STORE.set(MODELS_CACHE_PATH, cache)
+    return models
+
+def list_model_names(client, ttl: float = 300.0, refresh: bool = False) -> list:
+    """
+    Modelli installati (da /api/tags) con cache su disco per server.
+    Una lista in cache viene restituita subito anche se scaduta: l'aggiornamento
+    parte in background e sarà pronto per la volta successiva.
+    """
+    entry = None if refresh else CONFIG_STORE.load(MODELS_CACHE_PATH, {}).get(client.base_url)
+    if entry is None:
+        return _refresh_model_names(client)
+    if time.time() - entry.get("ts", 0) > ttl:
+        def update():
+            try:
+                _refresh_model_names(client)
+            except Exception:
+                pass  # Ollama non raggiungibile: resta la lista in cache
+        threading.Thread(target=update, daemon=True).start()
+    return entry.get("models", [])
@@ -0,0 +1,143 @@
+import os
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+
+CACHE_DIR = os.path.join(os.path.dirname(__file__), "files", "cache")
+
+class ResponseCache:
+    """
+    Cache delle risposte del modello, chiave = modello + prompt formattato + opzioni.
+    Livello 1: LRU in memoria (OrderedDict). Livello 2: un file JSON per voce in CACHE_DIR.
+    Entrambi i livelli sono limitati a max_entries voci; ttl in secondi (0 = nessuna scadenza).
+    """
+
+    def __init__(self, max_entries: int = 256, ttl: float = 86400, directory: str = CACHE_DIR):
+        self.max_entries = max(1, max_entries)
+        self.ttl = ttl
+        self.directory = directory
+        self.hits = 0
+        self.misses = 0
+        self._memory = OrderedDict()  # key -> (created, response)
+        self._disk_count = None       # calcolato alla prima scrittura
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_settings(cls, settings):
+        return cls(max_entries=settings.cache_max_entries, ttl=settings.cache_ttl)
+
+    @staticmethod
+    def make_key(model: str, prompt: str, options: dict = None) -> str:
+        raw = json.dumps([model, prompt, options or {}], sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.json")
+
+    def _expired(self, created: float) -> bool:
+        return bool(self.ttl) and time.time() - created > self.ttl
+
+    def get(self, key: str):
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                if not self._expired(entry[0]):
+                    self._memory.move_to_end(key)
+                    self.hits += 1
+                    return entry[1]
+                del self._memory[key]
+
+            entry = self._read_disk(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._remember(key, entry)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key: str, response: str, model: str = "") -> None:
+        entry = (time.time(), response)
+        with self._lock:
+            self._remember(key, entry)
+            self._write_disk(key, entry, model)
+
+    def _remember(self, key: str, entry) -> None:
+        self._memory[key] = entry
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def _read_disk(self, key: str):
+        path = self._path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if self._expired(data.get("created", 0)):
+            self._remove(path)
+            return None
+        # mtime = ultimo accesso, usato per l'evizione LRU su disco
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return data["created"], data["response"]
+
+    def _write_disk(self, key: str, entry, model: str) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._path(key)
+        is_new = not os.path.exists(path)
+        try:
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump({"created": entry[0], "model": model, "response": entry[1]}, f, ensure_ascii=False)
+        except OSError:
+            return
+        if self._disk_count is None:
+            self._disk_count = len(self._disk_files())
+        elif is_new:
+            self._disk_count += 1
+        if self._disk_count > self.max_entries:
+            self._prune_disk()
+
+    def _disk_files(self) -> list:
+        if not os.path.isdir(self.directory):
+            return []
+        return [os.path.join(self.directory, f) for f in os.listdir(self.directory) if f.endswith(".json")]
+
+    def _prune_disk(self) -> None:
+        files = sorted(self._disk_files(), key=lambda p: os.path.getmtime(p))
+        # Si scende a 3/4 del limite, così il prune non scatta a ogni scrittura
+        excess = len(files) - (self.max_entries * 3) // 4
+        for path in files[:max(0, excess)]:
+            self._remove(path)
+        self._disk_count = len(files) - max(0, excess)
+
+    @staticmethod
+    def _remove(path: str) -> None:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def clear(self) -> None:
+        with self._lock:
+            self._memory.clear()
+            for path in self._disk_files():
+                self._remove(path)
+            self._disk_count = 0
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            files = self._disk_files()
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "memory_entries": len(self._memory),
+                "disk_entries": len(files),
+                "disk_bytes": sum(os.path.getsize(p) for p in files),
+            }
@@ -0,0 +1,141 @@
+import os
+import copy
+import sys
+import json
+import atexit
+import threading
+from typing import Any, Callable, Dict, List, Optional
+
+class ConfigStore:
+    """
+    Cache dei file JSON di configurazione (settings.json, config degli addon).
+    - ogni file viene parsato una sola volta, poi le letture arrivano dalla memoria; una stat
+      (mtime/dimensione) per lettura rileva le scritture di altri processi (worker addon)
+    - le scritture ravvicinate vengono raggruppate: il file si scrive dopo `delay` secondi
+    - scrittura atomica: file temporaneo nella stessa cartella + os.replace
+    - subscribe(path, callback) notifica ogni modifica, senza aspettare il disco
+    Con delay=0 ogni set scrive subito (es. nei processi dei worker addon).
+    Se una scrittura differita fallisce la modifica resta in attesa: l'errore viene segnalato
+    su stderr, restituito da error(path) e sollevato dalla prossima flush.
+    """
+
+    def __init__(self, delay: float = 0.5):
+        self.delay = delay
+        self._data: Dict[str, Any] = {}
+        self._dirty = set()
+        self._stamps: Dict[str, Any] = {}
+        # Ultimo errore di scrittura dei file ancora in attesa
+        self._errors: Dict[str, OSError] = {}
+        self._listeners: Dict[str, List[Callable]] = {}
+        self._lock = threading.RLock()
+        self._timer = None
+        # Le modifiche ancora in attesa vengono scritte all'uscita
+        atexit.register(self._flush_pending)
+
+    @staticmethod
+    def _key(path: str) -> str:
+        return os.path.abspath(path)
+
+    @staticmethod
+    def _stamp(key: str) -> Any:
+        try:
+            st = os.stat(key)
+        except OSError:
+            return None
+        return (st.st_mtime_ns, st.st_size)
+
+    def load(self, path: str, default: Any = None) -> Any:
+        """Contenuto del file (copia), riletto dal disco solo se è cambiato."""
+        key = self._key(path)
+        with self._lock:
+            if key in self._dirty:
+                # Modifiche non ancora scritte: la copia in memoria è la più recente
+                return copy.deepcopy(self._data[key])
+            stamp = self._stamp(key)
+            if stamp is None:
+                self._data.pop(key, None)
+                self._stamps.pop(key, None)
+                return copy.deepcopy(default)
+            if key not in self._data or self._stamps.get(key) != stamp:
+                with open(key, "r", encoding="utf-8") as f:
+                    self._data[key] = json.load(f)
+                self._stamps[key] = stamp
+            return copy.deepcopy(self._data[key])
+
+    def set(self, path: str, data: Any) -> None:
+        key = self._key(path)
+        with self._lock:
+            self._data[key] = copy.deepcopy(data)
+            self._dirty.add(key)
+            listeners = list(self._listeners.get(key, []))
+            if self.delay <= 0:
+                self._write(key)
+            elif self._timer is None:
+                # Un solo timer per tutte le modifiche della finestra
+                self._timer = threading.Timer(self.delay, self._flush_pending)
+                self._timer.daemon = True
+                self._timer.start()
+        for callback in listeners:
+            try:
+                callback(path, copy.deepcopy(data))
+            except Exception:
+                pass
+
+    def update(self, path: str, **values) -> None:
+        with self._lock:
+            data = self.load(path, {})
+            data.update(values)
+            self.set(path, data)
+
+    def forget(self, path: str) -> None:
+        """Scarta la copia in memoria: la prossima load rilegge il file."""
+        with self._lock:
+            key = self._key(path)
+            if key not in self._dirty:
+                self._data.pop(key, None)
+                self._stamps.pop(key, None)
+
+    def subscribe(self, path: str, callback: Callable[[str, Any], None]) -> None:
+        with self._lock:
+            self._listeners.setdefault(self._key(path), []).append(callback)
+
+    def _write(self, key: str) -> None:
+        directory = os.path.dirname(key)
+        os.makedirs(directory, exist_ok=True)
+        tmp = f"{key}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self._data[key], f, indent=2)
+        os.replace(tmp, key)
+        self._stamps[key] = self._stamp(key)
+        self._dirty.discard(key)
+        self._errors.pop(key, None)
+
+    def _flush_pending(self) -> None:
+        with self._lock:
+            self._timer = None
+            for key in list(self._dirty):
+                try:
+                    self._write(key)
+                except OSError as e:
+                    # Resta in attesa: si riprova alla prossima scrittura, alla flush o all'uscita
+                    if key not in self._errors:
+                        print(f"Config not saved: {key}: {e}", file=sys.stderr)
+                    self._errors[key] = e
+
+    def error(self, path: str) -> Optional[OSError]:
+        """Errore dell'ultima scrittura differita di `path`, None se non ce ne sono in attesa."""
+        with self._lock:
+            return self._errors.get(self._key(path))
+
+    def flush(self, path: Optional[str] = None) -> None:
+        """Scrive subito le modifiche in attesa (di un file o di tutti); solleva OSError se la scrittura fallisce."""
+        with self._lock:
+            if path is None and self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            keys = [self._key(path)] if path else list(self._dirty)
+            for key in keys:
+                if key in self._dirty:
+                    self._write(key)
+
+CONFIG_STORE = ConfigStore()
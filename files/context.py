@@ -0,0 +1,132 @@
+import threading
+
+from files.profiles import load_options
+from files.scheduler import SCHEDULER
+
+SUMMARY_PROMPT = (
+    "Summarize the following conversation between User and Assistant in a few sentences. "
+    "Keep names, facts, decisions and open questions. Reply with the summary only.\n\n"
+    "{previous}{transcript}\n\nSummary:"
+)
+
+def format_turns(turns) -> str:
+    return "\n".join(f"User: {h['user']}\nAssistant: {h['llm']}" for h in turns)
+
+class ContextBudget:
+    """
+    Budget di contesto per le chat persistenti.
+    - misura il prompt con i contatori restituiti da Ollama (prompt_eval_count / eval_count)
+    - tiene in chiaro solo gli ultimi `window` turni
+    - riassume i turni più vecchi in un thread separato, senza bloccare il turno successivo
+    """
+
+    # Frazione del budget oltre la quale si avvia la compattazione
+    COMPACT_AT = 0.8
+    # Stima usata solo quando i contatori di Ollama non ci sono ancora (es. chat ripresa)
+    CHARS_PER_TOKEN = 4
+
+    def __init__(self, client, max_tokens: int = 4096, window: int = 6):
+        self.client = client
+        self.max_tokens = max_tokens
+        self.window = max(1, window)
+        self.used_tokens = 0
+        self.summary = ""
+        self.summarized_turns = 0  # quanti turni di history sono coperti dal riassunto
+        self._lock = threading.Lock()
+        self._worker = None
+        self._pending = None  # (summary, summarized_turns, generation) pronto da applicare
+        # Aumenta a ogni reset(): un riassunto partito prima non appartiene più a questa cronologia
+        self._generation = 0
+
+    @classmethod
+    def from_settings(cls, client, settings):
+        return cls(client, max_tokens=settings.context_budget, window=settings.history_window)
+
+    def reset(self) -> None:
+        with self._lock:
+            self.used_tokens = 0
+            self.summary = ""
+            self.summarized_turns = 0
+            self._pending = None
+            self._generation += 1
+
+    def update(self, data: dict) -> None:
+        """Aggiorna la dimensione del contesto con la risposta finale di Ollama."""
+        context = data.get("context")
+        if context:
+            # Con il context array riusato, prompt_eval_count conta solo i token nuovi
+            self.used_tokens = len(context)
+        else:
+            self.used_tokens = data.get("prompt_eval_count", 0) + data.get("eval_count", 0)
+
+    def char_budget(self) -> int:
+        """Caratteri di cronologia che stanno nel budget prima della compattazione."""
+        return int(self.max_tokens * self.COMPACT_AT * self.CHARS_PER_TOKEN)
+
+    def is_over_budget(self) -> bool:
+        return self.used_tokens >= self.max_tokens * self.COMPACT_AT
+
+    def compacting(self) -> bool:
+        return self._worker is not None and self._worker.is_alive()
+
+    def maybe_compact(self, model: str, history: list, options: dict = None) -> None:
+        """Avvia il riassunto in background se il budget è quasi esaurito."""
+        cut = len(history) - self.window
+        if not self.is_over_budget() or cut <= self.summarized_turns or self.compacting():
+            return
+        # Finestra recente già oltre il budget da sola: riassumere i turni vecchi non la riduce,
+        # si rifarebbe solo un riassunto a ogni turno
+        if len(format_turns(history[cut:])) >= self.char_budget():
+            return
+        turns = list(history[self.summarized_turns:cut])
+        self._worker = threading.Thread(
+            target=self._summarize, args=(model, turns, cut, self.summary, options, self._generation),
+            daemon=True
+        )
+        self._worker.start()
+
+    def _summarize(self, model: str, turns: list, cut: int, previous: str, options: dict = None,
+                   generation: int = 0) -> None:
+        prompt = SUMMARY_PROMPT.format(
+            previous=f"Earlier summary: {previous}\n\n" if previous else "",
+            transcript=format_turns(turns)
+        )
+        payload = {"model": model, "prompt": prompt}
+        # Stesse opzioni di caricamento della chat, altrimenti Ollama ricarica il modello
+        options = load_options(options)
+        if options:
+            payload["options"] = options
+        try:
+            # Lavoro in background: le domande dell'utente passano avanti nella coda del server
+            with SCHEDULER.background():
+                data = self.client.generate(payload)
+        except Exception:
+            # Niente riassunto: si riproverà al prossimo turno
+            return
+        with self._lock:
+            # Cronologia cancellata (/clear, chat ripresa) mentre il riassunto era in corso: si scarta
+            if generation == self._generation:
+                self._pending = (data.get("response", "").strip(), cut, generation)
+
+    def apply_pending(self, history: list):
+        """
+        Se un riassunto è pronto lo rende attivo e restituisce il nuovo prefisso
+        (riassunto + finestra recente); altrimenti restituisce None.
+        """
+        with self._lock:
+            if self._pending is None:
+                return None
+            summary, cut, generation = self._pending
+            self._pending = None
+            if generation != self._generation:
+                return None
+            self.summary = summary
+            self.summarized_turns = min(cut, len(history))
+        return self.build_prefix(history)
+
+    def build_prefix(self, history: list) -> str:
+        recent = format_turns(history[self.summarized_turns:])
+        if not self.summary:
+            return recent
+        header = f"Summary of the earlier conversation: {self.summary}"
+        return f"{header}\n{recent}" if recent else header
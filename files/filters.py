@@ -0,0 +1,180 @@
+import re
+import codecs
+from typing import Callable, List, Optional, Union
+
+# ----------------------------------------
+# Pattern compilati una sola volta
+# ----------------------------------------
+
+EMOJI_RANGES = (
+    "\U0001F600-\U0001F64F"  # emoticon
+    "\U0001F300-\U0001F5FF"  # simboli
+    "\U0001F680-\U0001F6FF"  # trasporti
+    "\U0001F1E0-\U0001F1FF"  # bandiere
+    "\U00002700-\U000027BF"
+    "\U0001F900-\U0001F9FF"
+    "\U0001FA70-\U0001FAFF"
+)
+# Joiner e variation selector che seguono un'emoji fanno parte della stessa sequenza
+EMOJI_JOINERS = "\u200d\ufe0f"  # zero width joiner, variation selector-16
+
+EMOJI_PATTERN = re.compile(f"[{EMOJI_RANGES}][{EMOJI_RANGES}{EMOJI_JOINERS}]*", flags=re.UNICODE)
+LEADING_JOINERS = re.compile(f"^[{EMOJI_RANGES}{EMOJI_JOINERS}]+", flags=re.UNICODE)
+
+def remove_emojis(text: str) -> str:
+    return EMOJI_PATTERN.sub("", text)
+
+# ----------------------------------------
+# Stadi della pipeline: feed(chunk) -> testo pronto, flush() -> resto
+# ----------------------------------------
+
+class OutputFilter:
+    """Stadio base: non modifica nulla. Le sottoclassi possono tenere stato tra i chunk."""
+
+    def feed(self, chunk: str) -> str:
+        return chunk
+
+    def flush(self) -> str:
+        return ""
+
+class EmojiFilter(OutputFilter):
+    """
+    Rimuove le emoji da uno stream. Se un chunk finisce dentro una sequenza
+    (es. 👨 + ZWJ | 👩), i joiner all'inizio del chunk successivo vengono scartati
+    anche loro: basta un flag, il costo per chunk non dipende dalla lunghezza totale.
+    """
+
+    def __init__(self):
+        self._in_sequence = False
+
+    def feed(self, chunk: str) -> str:
+        if self._in_sequence:
+            chunk = LEADING_JOINERS.sub("", chunk)
+        if not chunk:
+            return ""
+        last = None
+        for last in EMOJI_PATTERN.finditer(chunk):
+            pass
+        self._in_sequence = last is not None and last.end() == len(chunk)
+        return EMOJI_PATTERN.sub("", chunk)
+
+    def flush(self) -> str:
+        self._in_sequence = False
+        return ""
+
+# Finestra dei RegexFilter quando un match non ha lunghezza massima (es. "<think>.*?</think>")
+DEFAULT_WINDOW = 64
+MAX_WINDOW = 1024
+
+def match_width(pattern: "re.Pattern") -> int:
+    """Lunghezza massima di un match, da usare come finestra; DEFAULT_WINDOW se non è limitata."""
+    try:
+        from re import _parser as parser
+    except ImportError:  # Python < 3.11
+        import sre_parse as parser
+    try:
+        _low, high = parser.parse(pattern.pattern, pattern.flags).getwidth()
+    except Exception:
+        return DEFAULT_WINDOW
+    if high >= parser.MAXREPEAT:
+        return DEFAULT_WINDOW
+    return max(1, min(high, MAX_WINDOW))
+
+class RegexFilter(OutputFilter):
+    """
+    Sostituzione regex su uno stream. `window` è la lunghezza massima di un match:
+    gli ultimi window-1 caratteri restano in attesa del chunk successivo, così un
+    match spezzato tra due chunk viene comunque trovato. Senza `window` la si
+    ricava dal pattern (DEFAULT_WINDOW se un match può essere lungo a piacere).
+    """
+
+    def __init__(self, pattern: Union[str, "re.Pattern"], replacement: str = "", window: Optional[int] = None):
+        self.pattern = re.compile(pattern) if isinstance(pattern, str) else pattern
+        self.replacement = replacement
+        self.window = max(1, window) if window is not None else match_width(self.pattern)
+        self._carry = ""
+
+    def feed(self, chunk: str) -> str:
+        buf = self._carry + chunk
+        cut = max(0, len(buf) - (self.window - 1))
+        # Un match che inizia prima del taglio ma lo attraversa va rimandato per intero
+        for match in self.pattern.finditer(buf):
+            if match.start() >= cut:
+                break
+            if match.end() > cut:
+                cut = match.start()
+                break
+        self._carry = buf[cut:]
+        return self.pattern.sub(self.replacement, buf[:cut])
+
+    def flush(self) -> str:
+        rest, self._carry = self._carry, ""
+        return self.pattern.sub(self.replacement, rest)
+
+class FunctionFilter(OutputFilter):
+    """Adatta una funzione text -> text (senza stato) a stadio della pipeline."""
+
+    def __init__(self, func: Callable[[str], str]):
+        self.func = func
+
+    def feed(self, chunk: str) -> str:
+        out = self.func(chunk)
+        return chunk if out is None else out
+
+def make_filter(spec) -> OutputFilter:
+    """Accetta uno stadio, una classe di stadio, un pattern regex o una funzione."""
+    if isinstance(spec, OutputFilter):
+        return spec
+    if isinstance(spec, type) and issubclass(spec, OutputFilter):
+        return spec()
+    if isinstance(spec, (str, re.Pattern)):
+        return RegexFilter(spec)
+    if callable(spec):
+        return FunctionFilter(spec)
+    raise TypeError(f"Filtro non valido: {spec!r}")
+
+# ----------------------------------------
+# Pipeline
+# ----------------------------------------
+
+class OutputFilterPipeline:
+    """
+    Catena di stadi applicata all'output del modello, chunk per chunk.
+    Accetta anche bytes: un decoder incrementale ricompone i caratteri UTF-8
+    spezzati tra due chunk.
+    """
+
+    def __init__(self, stages: Optional[List[OutputFilter]] = None):
+        self.stages = list(stages or [])
+        self._decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+
+    def feed(self, chunk: Union[str, bytes]) -> str:
+        if isinstance(chunk, bytes):
+            chunk = self._decoder.decode(chunk)
+        for stage in self.stages:
+            if not chunk:
+                break
+            chunk = stage.feed(chunk)
+        return chunk
+
+    def flush(self) -> str:
+        out = self._decoder.decode(b"", final=True)
+        for stage in self.stages:
+            out = stage.feed(out) if out else ""
+            out += stage.flush()
+        return out
+
+    def apply(self, text: str) -> str:
+        return self.feed(text) + self.flush()
+
+def build_output_pipeline(settings, extra: Optional[list] = None) -> OutputFilterPipeline:
+    """
+    Pipeline per una risposta: filtro emoji se Settings.use_emoji è False,
+    poi i filtri registrati dagli addon (nuove istanze, lo stato è per risposta).
+    """
+    stages: List[OutputFilter] = []
+    if not settings.use_emoji:
+        stages.append(EmojiFilter())
+    for factory in extra or []:
+        stages.append(factory())
+    return OutputFilterPipeline(stages)
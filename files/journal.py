@@ -0,0 +1,375 @@
+import os
+import json
+import gzip
+import mmap
+import time
+import shutil
+import threading
+from collections import deque
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from files.settings import CHAT_DIR
+
+INDEX_NAME = "index.jsonl"
+
+def _chat_dir(directory: Optional[str]) -> str:
+    # Risolto a ogni chiamata: CHAT_DIR può essere sostituito (es. dal benchmark)
+    return directory or CHAT_DIR
+
+class ChatJournal:
+    """
+    Journal di una chat persistente: un file JSONL in CHAT_DIR, una riga per turno,
+    scritta e sincronizzata su disco subito dopo ogni scambio. Il costo per turno
+    non dipende dalla lunghezza della chat e un crash perde al massimo il turno in corso.
+    """
+
+    def __init__(self, model: str, directory: Optional[str] = None, fsync: bool = True, search_index=None):
+        self.directory = _chat_dir(directory)
+        self.model = model
+        self.fsync = fsync
+        # Indice di ricerca (files.search) aggiornato a ogni turno, opzionale
+        self.search_index = search_index
+        self.chat_id = f"chat_{datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}"
+        self.path = os.path.join(self.directory, f"{self.chat_id}.jsonl")
+        self.started = time.time()
+        self.turns = 0
+        self.title = ""
+        self._file = None
+        self._resumed = False
+        self._lock = threading.Lock()
+
+    def resume(self, entry: Dict[str, Any]) -> bool:
+        """
+        Continua a scrivere in coda a una chat esistente (solo journal non compressi).
+        Restituisce False se la chat non è riprendibile: si scriverà in un nuovo journal.
+        """
+        if not entry["file"].endswith(".jsonl"):
+            return False
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            self.chat_id = entry["id"]
+            self.path = os.path.join(self.directory, entry["file"])
+            self.started = entry.get("started", self.started)
+            # Dal journal, non dall'indice: dopo un crash la voce può essere indietro
+            # e i nuovi turni avrebbero numeri già usati (indice di ricerca, memoria)
+            try:
+                self.turns = count_turns(self.path)
+            except OSError:
+                self.turns = entry.get("turns", 0)
+            self.title = entry.get("title", "")
+            self._resumed = True
+        return True
+
+    def _open(self) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+        # Due chat avviate nello stesso secondo: suffisso progressivo
+        n = 1
+        while os.path.exists(self.path):
+            n += 1
+            self.path = os.path.join(self.directory, f"{self.chat_id}_{n}.jsonl")
+        if n > 1:
+            self.chat_id = f"{self.chat_id}_{n}"
+        self._file = open(self.path, "a", encoding="utf-8")
+
+    def append(self, user: str, llm: str, model: Optional[str] = None) -> None:
+        with self._lock:
+            if self._file is None:
+                if self._resumed:
+                    self._file = open(self.path, "a", encoding="utf-8")
+                else:
+                    self._open()
+            record = {"user": user, "llm": llm, "model": model or self.model, "ts": time.time()}
+            self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+            self._file.flush()
+            if self.fsync:
+                os.fsync(self._file.fileno())
+            self.turns += 1
+            turn_no = self.turns
+            if not self.title:
+                self.title = user[:80]
+                # Prima riga: la chat compare subito nell'indice, anche dopo un crash
+                append_index(self.entry(), self.directory)
+        if self.search_index is not None:
+            self.search_index.add_turn(self.chat_id, turn_no, user, llm, record["ts"])
+
+    def entry(self) -> Dict[str, Any]:
+        return {
+            "id": self.chat_id,
+            "file": os.path.basename(self.path),
+            "model": self.model,
+            "title": self.title,
+            "started": self.started,
+            "updated": time.time(),
+            "turns": self.turns,
+        }
+
+    def close(self) -> Optional[str]:
+        """Chiude il journal; restituisce il percorso se è stato scritto almeno un turno."""
+        with self._lock:
+            if self._file is None:
+                return None
+            self._file.close()
+            self._file = None
+            append_index(self.entry(), self.directory)
+            return self.path
+
+# ----------------------------------------
+# Indice delle chat
+# ----------------------------------------
+
+def append_index(entry: Dict[str, Any], directory: Optional[str] = None) -> None:
+    """L'indice è append-only: per ogni id vale l'ultima riga."""
+    path = os.path.join(_chat_dir(directory), INDEX_NAME)
+    with open(path, "a", encoding="utf-8") as f:
+        f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+def count_turns(path: str) -> int:
+    """Turni di un journal .jsonl contando le righe complete (una riga troncata da un crash non conta)."""
+    turns = 0
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            turns += block.count(b"\n")
+    return turns
+
+def _refresh_entry(entry: Dict[str, Any], directory: str) -> bool:
+    """
+    L'indice riceve una riga al primo turno e alla chiusura: dopo un crash la voce è
+    ferma al primo turno. Se il journal è più recente della voce si contano le sue righe.
+    """
+    if not entry.get("file", "").endswith(".jsonl"):
+        return False
+    path = os.path.join(directory, entry["file"])
+    try:
+        mtime = os.path.getmtime(path)
+        if mtime <= entry.get("updated", 0):
+            return False
+        turns = count_turns(path)
+    except OSError:
+        return False
+    entry["turns"] = turns
+    entry["updated"] = mtime
+    return True
+
+def list_chats(directory: Optional[str] = None) -> List[Dict[str, Any]]:
+    """Chat salvate, dalla più recente, lette dall'indice (ricostruito se manca, corretto se indietro)."""
+    directory = _chat_dir(directory)
+    path = os.path.join(directory, INDEX_NAME)
+    if not os.path.exists(path):
+        rebuild_index(directory)
+    chats: Dict[str, Dict[str, Any]] = {}
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                chats[entry["id"]] = entry
+    except OSError:
+        return []
+    stale = [entry for entry in chats.values() if _refresh_entry(entry, directory)]
+    for entry in stale:
+        # Voce corretta in coda all'indice: il conteggio si rifà una volta sola
+        try:
+            append_index(entry, directory)
+        except OSError:
+            break
+    return sorted(chats.values(), key=lambda e: e.get("started", 0), reverse=True)
+
+def chat_files(directory: Optional[str] = None) -> List[str]:
+    directory = _chat_dir(directory)
+    if not os.path.isdir(directory):
+        return []
+    return sorted(
+        f for f in os.listdir(directory)
+        if f.startswith("chat_") and f.endswith((".jsonl", ".jsonl.gz", ".json"))
+    )
+
+def chat_id_of(filename: str) -> str:
+    for ext in (".jsonl.gz", ".jsonl", ".json"):
+        if filename.endswith(ext):
+            return filename[:-len(ext)]
+    return filename
+
+def open_chat_file(path: str):
+    if path.endswith(".gz"):
+        return gzip.open(path, "rt", encoding="utf-8")
+    return open(path, "r", encoding="utf-8")
+
+def rebuild_index(directory: Optional[str] = None) -> None:
+    """
+    Ricostruisce l'indice leggendo ogni chat (una volta sola): journal JSONL,
+    journal compressi e vecchi salvataggi chat_*.json.
+    """
+    directory = _chat_dir(directory)
+    entries = []
+    for name in chat_files(directory):
+        path = os.path.join(directory, name)
+        turns, title, model = 0, "", None
+        try:
+            if name.endswith(".json"):
+                with open(path, "r", encoding="utf-8") as f:
+                    history = json.load(f)
+            else:
+                with open_chat_file(path) as f:
+                    history = [json.loads(line) for line in f if line.strip()]
+        except (OSError, ValueError):
+            continue
+        turns = len(history)
+        if history:
+            title = history[0].get("user", "")[:80]
+            model = history[0].get("model")
+        mtime = os.path.getmtime(path)
+        entries.append({"id": chat_id_of(name), "file": name, "model": model, "title": title,
+                        "started": mtime, "updated": mtime, "turns": turns})
+
+    tmp = os.path.join(directory, INDEX_NAME + ".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        for entry in entries:
+            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+    os.replace(tmp, os.path.join(directory, INDEX_NAME))
+
+def chat_path(entry: Dict[str, Any], directory: Optional[str] = None) -> str:
+    return os.path.join(_chat_dir(directory), entry["file"])
+
+def find_chat(query: str, directory: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    """Chat per id esatto, altrimenti la più recente il cui id o titolo contiene `query`."""
+    chats = list_chats(directory)
+    for entry in chats:
+        if entry["id"] == query:
+            return entry
+    query = query.lower()
+    for entry in chats:
+        if query in entry["id"].lower() or query in entry.get("title", "").lower():
+            return entry
+    return None
+
+def _turn_size(turn: Dict[str, Any]) -> int:
+    return len(turn.get("user", "")) + len(turn.get("llm", ""))
+
+def _iter_json_array(f, chunk_size: int = 65536):
+    """Elementi di un array JSON letti a blocchi, senza caricare tutto il file."""
+    decoder = json.JSONDecoder()
+    buf, pos, started = "", 0, False
+    for chunk in iter(lambda: f.read(chunk_size), ""):
+        buf = buf[pos:] + chunk
+        pos = 0
+        while True:
+            while pos < len(buf) and buf[pos] in " \t\r\n,":
+                pos += 1
+            if pos >= len(buf):
+                break
+            if not started:
+                if buf[pos] != "[":
+                    raise ValueError("il file non contiene un array JSON")
+                started = True
+                pos += 1
+                continue
+            if buf[pos] == "]":
+                return
+            try:
+                obj, pos = decoder.raw_decode(buf, pos)
+            except ValueError:
+                break  # oggetto a metà: serve il blocco successivo
+            yield obj
+
+def _tail_jsonl(path: str, max_chars: int, max_turns: Optional[int]) -> List[Dict[str, Any]]:
+    """Ultimi turni di un journal JSONL letti a ritroso con mmap: si tocca solo la coda del file."""
+    turns: List[Dict[str, Any]] = []
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:
+            return turns
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            # `end` = fine della riga corrente, newline escluso; -1 quando si arriva all'inizio
+            end = size - 1 if mm[size - 1:size] == b"\n" else size
+            used = 0
+            while end >= 0 and (max_turns is None or len(turns) < max_turns):
+                start = mm.rfind(b"\n", 0, end)
+                line = mm[start + 1:end]
+                end = start
+                if not line.strip():
+                    continue
+                try:
+                    turn = json.loads(line)
+                except ValueError:
+                    continue  # ultima riga troncata da un crash
+                cost = _turn_size(turn)
+                if turns and used + cost > max_chars:
+                    break
+                used += cost
+                turns.append(turn)
+    turns.reverse()
+    return turns
+
+def iter_chat_turns(path: str):
+    """Turni di una chat in qualunque formato (.jsonl, .jsonl.gz, vecchio .json), in streaming."""
+    with open_chat_file(path) as f:
+        if path.endswith(".json"):
+            yield from _iter_json_array(f)
+            return
+        for line in f:
+            if not line.strip():
+                continue
+            try:
+                yield json.loads(line)
+            except ValueError:
+                continue
+
+def load_recent_turns(path: str, max_chars: int, max_turns: Optional[int] = None) -> List[Dict[str, Any]]:
+    """
+    Gli ultimi turni di una chat che stanno in `max_chars` caratteri (almeno uno).
+    I journal .jsonl vengono letti dal fondo via mmap; .jsonl.gz e i vecchi .json
+    vengono scorsi in streaming tenendo in memoria solo la finestra finale.
+    """
+    if path.endswith(".jsonl"):
+        return _tail_jsonl(path, max_chars, max_turns)
+
+    window: deque = deque()
+    used = 0
+    for turn in iter_chat_turns(path):
+        window.append(turn)
+        used += _turn_size(turn)
+        while len(window) > 1 and (used > max_chars or (max_turns and len(window) > max_turns)):
+            used -= _turn_size(window.popleft())
+    return list(window)
+
+def compress_old_chats(days: float, directory: Optional[str] = None) -> int:
+    """Comprime con gzip i journal non modificati da più di `days` giorni."""
+    if not days:
+        return 0
+    directory = _chat_dir(directory)
+    limit = time.time() - days * 86400
+    compressed = 0
+    for name in chat_files(directory):
+        if not name.endswith(".jsonl"):
+            continue
+        path = os.path.join(directory, name)
+        if os.path.getmtime(path) > limit:
+            continue
+        try:
+            with open(path, "rb") as src, gzip.open(path + ".gz", "wb") as dst:
+                shutil.copyfileobj(src, dst)
+            os.remove(path)
+        except OSError:
+            continue
+        compressed += 1
+    if compressed:
+        # I nomi dei file sono cambiati: l'indice si riallinea una volta sola
+        _rewrite_index_files(directory)
+    return compressed
+
+def _rewrite_index_files(directory: str) -> None:
+    existing = set(chat_files(directory))
+    entries = list_chats(directory)
+    for entry in entries:
+        if entry["file"] not in existing and entry["file"] + ".gz" in existing:
+            entry["file"] += ".gz"
+    tmp = os.path.join(directory, INDEX_NAME + ".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        for entry in entries:
+            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+    os.replace(tmp, os.path.join(directory, INDEX_NAME))
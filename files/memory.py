@@ -0,0 +1,291 @@
+"""
+Memoria a lungo termine per le chat persistenti: ogni turno viene trasformato in un
+vettore (endpoint embeddings di Ollama) in un thread separato e salvato accanto alle
+chat. A ogni prompt si recuperano solo i turni passati più simili, di questa chat e
+delle precedenti, invece di incollare tutta la cronologia.
+
+NumPy è opzionale: se non è installato la memoria resta disattivata.
+"""
+import os
+import re
+import json
+import queue
+import threading
+import importlib.util
+from typing import Any, Dict, List, Optional
+
+from files import journal
+from files.scheduler import SCHEDULER
+
+# NumPy si importa solo quando la memoria viene usata (~30 ms risparmiati all'avvio)
+MEMORY_AVAILABLE = importlib.util.find_spec("numpy") is not None
+np = None
+
+def _load_numpy():
+    global np
+    if np is None:
+        import numpy
+        np = numpy
+    return np
+
+MEMORY_DIR_NAME = "memory"
+RECALL_HEADER = "Relevant earlier conversation:"
+
+def memory_dir(model: str, directory: Optional[str] = None) -> str:
+    # Una cartella per modello di embedding: vettori di modelli diversi non sono confrontabili
+    slug = re.sub(r"[^A-Za-z0-9._-]+", "_", model)
+    return os.path.join(journal._chat_dir(directory), MEMORY_DIR_NAME, slug)
+
+def embedding_text(user: str, llm: str) -> str:
+    return f"User: {user}\nAssistant: {llm}"
+
+# File dei vettori: intestazione (magic + dimensione) e poi righe float32 di lunghezza fissa
+VECTOR_MAGIC = b"MVEC"
+HEADER_SIZE = 8
+
+class VectorStore:
+    """
+    Vettori di una chat, solo in aggiunta: <chat_id>.vec (intestazione + righe float32 normalizzate)
+    più un sidecar <chat_id>.jsonl con il testo dei turni, una riga per vettore con il suo numero.
+    Il vettore si scrive prima della riga di testo: dopo un crash tra le due scritture, al
+    caricamento si tengono solo le righe presenti in entrambi i file (il resto si tronca).
+    """
+
+    def __init__(self, folder: str, chat_id: str):
+        self.chat_id = chat_id
+        self.vec_path = os.path.join(folder, f"{chat_id}.vec")
+        self.meta_path = os.path.join(folder, f"{chat_id}.jsonl")
+        # Formato precedente (.npy riscritto a ogni turno): convertito al primo caricamento
+        self.npy_path = os.path.join(folder, f"{chat_id}.npy")
+        self.vectors = None
+        self.dim = None
+        self._meta = None
+        self._buffer = None  # righe in memoria con spazio libero in coda (chat corrente)
+
+    @classmethod
+    def load(cls, folder: str, chat_id: str, mmap: bool = True) -> "VectorStore":
+        store = cls(folder, chat_id)
+        if not os.path.exists(store.vec_path) and os.path.exists(store.npy_path):
+            store._convert_npy()
+        if not os.path.exists(store.vec_path):
+            return store
+        rows = store._repair()
+        if rows:
+            # Le chat passate restano su disco: il sistema operativo carica solo le pagine lette
+            vectors = np.memmap(store.vec_path, dtype="<f4", mode="r", offset=HEADER_SIZE, shape=(rows, store.dim))
+            store.vectors = vectors if mmap else np.array(vectors)
+        return store
+
+    def _read_dim(self) -> int:
+        with open(self.vec_path, "rb") as f:
+            header = f.read(HEADER_SIZE)
+        if len(header) < HEADER_SIZE or header[:4] != VECTOR_MAGIC:
+            raise ValueError(f"file di vettori non valido: {self.vec_path}")
+        return int.from_bytes(header[4:], "little")
+
+    def _repair(self) -> int:
+        """Allinea i due file alle righe complete presenti in entrambi; restituisce quante sono."""
+        self.dim = self._read_dim()
+        row_size = self.dim * 4
+        vec_rows = (os.path.getsize(self.vec_path) - HEADER_SIZE) // row_size
+        meta_rows = journal.count_turns(self.meta_path) if os.path.exists(self.meta_path) else 0
+        rows = min(vec_rows, meta_rows)
+        if os.path.getsize(self.vec_path) != HEADER_SIZE + rows * row_size:
+            with open(self.vec_path, "r+b") as f:
+                f.truncate(HEADER_SIZE + rows * row_size)
+        if meta_rows != rows or not self._meta_ends_cleanly():
+            # Riga di testo senza vettore o scritta a metà: il file si riscrive senza
+            with open(self.meta_path, "rb") as f:
+                lines = f.read().split(b"\n")[:rows]
+            tmp = self.meta_path + ".tmp"
+            with open(tmp, "wb") as f:
+                f.write(b"".join(line + b"\n" for line in lines))
+            os.replace(tmp, self.meta_path)
+        return rows
+
+    def _meta_ends_cleanly(self) -> bool:
+        if not os.path.exists(self.meta_path) or os.path.getsize(self.meta_path) == 0:
+            return True
+        with open(self.meta_path, "rb") as f:
+            f.seek(-1, os.SEEK_END)
+            return f.read(1) == b"\n"
+
+    def _convert_npy(self) -> None:
+        vectors = np.load(self.npy_path)
+        if vectors.ndim != 2:
+            return
+        self._write_header(vectors.shape[1])
+        with open(self.vec_path, "ab") as f:
+            f.write(np.ascontiguousarray(vectors, dtype="<f4").tobytes())
+        os.remove(self.npy_path)
+
+    def _write_header(self, dim: int) -> None:
+        os.makedirs(os.path.dirname(self.vec_path), exist_ok=True)
+        with open(self.vec_path, "wb") as f:
+            f.write(VECTOR_MAGIC + dim.to_bytes(4, "little"))
+        self.dim = dim
+
+    @property
+    def meta(self) -> List[Dict[str, Any]]:
+        # Il testo serve solo per i turni recuperati: letto alla prima occorrenza
+        if self._meta is None:
+            self._meta = []
+            if os.path.exists(self.meta_path):
+                with open(self.meta_path, "r", encoding="utf-8") as f:
+                    self._meta = [json.loads(line) for line in f if line.strip()]
+        return self._meta
+
+    def __len__(self) -> int:
+        return 0 if self.vectors is None else len(self.vectors)
+
+    def add(self, vector, turn: Dict[str, Any]) -> None:
+        row = np.asarray(vector, dtype="<f4").reshape(-1)
+        if self.dim is None:
+            self._write_header(len(row))
+        elif len(row) != self.dim:
+            raise ValueError(f"dimensione del vettore {len(row)} diversa da {self.dim}")
+        index = len(self)
+        meta = self.meta
+        # Una riga in coda per file: il costo non cresce con la lunghezza della chat
+        with open(self.vec_path, "ab") as f:
+            f.write(row.tobytes())
+        with open(self.meta_path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(dict(turn, row=index), ensure_ascii=False) + "\n")
+        meta.append(dict(turn, row=index))
+
+        if self._buffer is None or len(self._buffer) <= index:
+            grown = np.empty((max(16, 2 * (index + 1)), self.dim), dtype=np.float32)
+            if index:
+                grown[:index] = self.vectors
+            self._buffer = grown
+        self._buffer[index] = row
+        self.vectors = self._buffer[:index + 1]
+
+    def top(self, query, k: int, after: Optional[int] = None) -> List[tuple]:
+        """(score, turno) dei k vettori più simili; `after` esclude i turni con numero maggiore."""
+        if self.vectors is None or self.vectors.shape[1] != query.shape[0]:
+            return []
+        scores = np.asarray(self.vectors) @ query
+        if after is not None:
+            turns = np.array([m["turn"] for m in self.meta[:len(scores)]])
+            scores = np.where(turns > after, -np.inf, scores)
+        k = min(k, len(scores))
+        best = np.argpartition(-scores, k - 1)[:k]
+        meta = self.meta
+        return [(float(scores[i]), meta[i]) for i in best if np.isfinite(scores[i])]
+
+class RetrievalMemory:
+    """
+    Indice vettoriale dei turni salvati.
+    - add_turn: accoda il turno; l'embedding e il salvataggio avvengono in background
+    - recall: i top_k turni più simili al prompt, escludendo la finestra recente
+    Le chat precedenti vengono aperte (in mmap) da un thread all'avvio.
+    """
+
+    def __init__(self, client, model: str = "nomic-embed-text", top_k: int = 4, directory: Optional[str] = None):
+        _load_numpy()
+        self.client = client
+        self.model = model
+        self.top_k = max(1, top_k)
+        self.folder = memory_dir(model, directory)
+        self.error = None
+        self.stores: Dict[str, VectorStore] = {}
+        self._lock = threading.Lock()
+        self._queue: "queue.Queue" = queue.Queue()
+        self._worker = threading.Thread(target=self._run, daemon=True)
+        self._worker.start()
+        self._loader = threading.Thread(target=self._load_stores, daemon=True)
+        self._loader.start()
+
+    @classmethod
+    def from_settings(cls, client, settings) -> Optional["RetrievalMemory"]:
+        if not settings.memory_enabled or not MEMORY_AVAILABLE:
+            return None
+        return cls(client, model=settings.embedding_model, top_k=settings.memory_top_k)
+
+    def _load_stores(self) -> None:
+        if not os.path.isdir(self.folder):
+            return
+        for name in os.listdir(self.folder):
+            chat_id, ext = os.path.splitext(name)
+            # .npy: chat salvate con il formato precedente, convertite da load()
+            if ext not in (".vec", ".npy"):
+                continue
+            # Sotto il lock: load() può troncare i file, non durante un add() della stessa chat
+            with self._lock:
+                if chat_id in self.stores:
+                    continue
+                try:
+                    self.stores[chat_id] = VectorStore.load(self.folder, chat_id)
+                except (OSError, ValueError):
+                    continue
+
+    def _store(self, chat_id: str) -> VectorStore:
+        with self._lock:
+            store = self.stores.get(chat_id)
+            if store is None:
+                store = self.stores[chat_id] = VectorStore.load(self.folder, chat_id, mmap=False)
+            return store
+
+    def _embed(self, text: str):
+        vectors = self.client.embeddings(self.model, [text])
+        if not vectors:
+            raise Exception("Request failed: empty embedding")
+        vector = np.asarray(vectors[0], dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _run(self) -> None:
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            chat_id, turn, user, llm = item
+            try:
+                with SCHEDULER.background():
+                    vector = self._embed(embedding_text(user, llm))
+                store = self._store(chat_id)
+                with self._lock:
+                    store.add(vector, {"turn": turn, "user": user, "llm": llm})
+                self.error = None
+            except Exception as e:
+                self.error = str(e)  # turno senza vettore: resta comunque nel journal
+            finally:
+                self._queue.task_done()
+
+    def add_turn(self, chat_id: str, turn: int, user: str, llm: str) -> None:
+        self._queue.put((chat_id, turn, user, llm))
+
+    def recall(self, text: str, chat_id: Optional[str] = None, after: Optional[int] = None) -> List[Dict[str, Any]]:
+        """
+        Turni passati più simili a `text`, dal più vecchio al più recente.
+        Per la chat `chat_id` si escludono i turni dopo `after` (già nella finestra recente).
+        """
+        try:
+            query = self._embed(text)
+        except Exception as e:
+            self.error = str(e)
+            return []
+        hits = []
+        with self._lock:
+            for cid, store in list(self.stores.items()):
+                for score, turn in store.top(query, self.top_k, after if cid == chat_id else None):
+                    hits.append((score, cid, turn))
+        hits.sort(key=lambda h: h[0], reverse=True)
+        chosen = hits[:self.top_k]
+        # In ordine cronologico il modello legge uno scambio coerente
+        chosen.sort(key=lambda h: (h[1], h[2]["turn"]))
+        return [turn for _score, _cid, turn in chosen]
+
+    def flush(self, timeout: Optional[float] = None) -> None:
+        """Attende gli embedding in coda (usato a fine chat e nei benchmark)."""
+        if timeout is None:
+            self._queue.join()
+            return
+        done = threading.Event()
+        threading.Thread(target=lambda: (self._queue.join(), done.set()), daemon=True).start()
+        done.wait(timeout)
+
+    def close(self, timeout: float = 5.0) -> None:
+        self.flush(timeout)
+        self._queue.put(None)
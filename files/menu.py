@@ -1,53 +1,316 @@
 import os
-import msvcrt
+import sys
+import shutil
 from colorama import init, Fore, Style
 
 init(autoreset=True)
 
+HEADER = "====== ModulaR LLM emulator ======"
+
+# Sequenze ANSI (su Windows le traduce colorama, o il terminale stesso)
+CLEAR_SCREEN = "\x1b[2J\x1b[H"
+CLEAR_LINE = "\x1b[K"
+CLEAR_BELOW = "\x1b[J"
+HIDE_CURSOR = "\x1b[?25l"
+SHOW_CURSOR = "\x1b[?25h"
+
+def _vt_enabled() -> bool:
+    """
+    Sequenze private come HIDE_CURSOR: colorama non le traduce, quindi su Windows
+    servono una console con ENABLE_VIRTUAL_TERMINAL_PROCESSING attivo (es. Windows Terminal).
+    """
+    if sys.platform != "win32":
+        return True
+    try:
+        import ctypes
+        kernel32 = ctypes.windll.kernel32
+        mode = ctypes.c_ulong()
+        if not kernel32.GetConsoleMode(kernel32.GetStdHandle(-11), ctypes.byref(mode)):
+            return False
+        return bool(mode.value & 0x0004)
+    except Exception:
+        return False
+
 def clear():
-    os.system("cls" if os.name == "nt" else "clear")
+    # Niente os.system("cls"/"clear"): nessun processo per pulire lo schermo
+    sys.stdout.write(CLEAR_SCREEN)
+    sys.stdout.flush()
 
-def print_menu(options, selected_index):
-    clear()
-    print(Fore.CYAN + "====== ModulaR LLM emulator ======\n" + Style.RESET_ALL)
-    for i, option in enumerate(options):
-        if i == selected_index:
-            print(Fore.GREEN + f"> {option}" + Style.RESET_ALL)
+# ----------------------------------------
+# Lettura dei tasti
+# ----------------------------------------
+
+class _PosixKeys:
+    """Tasti da un terminale POSIX in modalità cbreak (senza eco né attesa di Invio)."""
+
+    # Sequenze dopo ESC: xterm (ESC [ A), modalità applicazione (ESC O A), tasti a numero (ESC [ 5 ~)
+    SEQUENCES = {
+        "[A": "up", "[B": "down", "OA": "up", "OB": "down",
+        "[H": "home", "[F": "end", "OH": "home", "OF": "end",
+        "[1~": "home", "[4~": "end", "[7~": "home", "[8~": "end",
+        "[5~": "pageup", "[6~": "pagedown",
+    }
+
+    def __init__(self):
+        import termios
+        import tty
+        import select
+        import codecs
+        self._termios, self._tty, self._select = termios, tty, select
+        self.fd = sys.stdin.fileno()
+        self._decoder = codecs.getincrementaldecoder("utf-8")("replace")
+        self._saved = None
+
+    def __enter__(self):
+        self._saved = self._termios.tcgetattr(self.fd)
+        # cbreak e non raw: Ctrl-C resta un KeyboardInterrupt e l'output non cambia
+        self._tty.setcbreak(self.fd)
+        return self
+
+    def __exit__(self, *exc):
+        self._termios.tcsetattr(self.fd, self._termios.TCSADRAIN, self._saved)
+
+    def _pending(self, timeout: float) -> bool:
+        return bool(self._select.select([self.fd], [], [], timeout)[0])
+
+    def _char(self) -> str:
+        while True:
+            char = self._decoder.decode(os.read(self.fd, 1))
+            if char:
+                return char
+
+    def read(self) -> str:
+        char = self._char()
+        if char == "\x1b":
+            # ESC da solo o inizio di una sequenza (frecce, PgUp...): i byte seguenti arrivano subito
+            if not self._pending(0.03):
+                return "esc"
+            sequence = self._char()
+            while self._pending(0.01) and not (len(sequence) > 1 and (sequence[-1].isalpha() or sequence[-1] == "~")):
+                sequence += self._char()
+            return self.SEQUENCES.get(sequence, "")
+        if char in ("\r", "\n"):
+            return "enter"
+        if char in ("\x7f", "\x08"):
+            return "backspace"
+        return char
+
+class _WindowsKeys:
+    """Tasti dalla console Windows (msvcrt, importato solo qui)."""
+
+    SPECIAL = {"H": "up", "P": "down", "I": "pageup", "Q": "pagedown", "G": "home", "O": "end"}
+
+    def __init__(self):
+        import msvcrt
+        self._msvcrt = msvcrt
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+    def read(self) -> str:
+        char = self._msvcrt.getwch()
+        if char in ("\x00", "\xe0"):  # frecce e tasti speciali: due caratteri
+            return self.SPECIAL.get(self._msvcrt.getwch(), "")
+        if char == "\x03":
+            raise KeyboardInterrupt
+        if char == "\r":
+            return "enter"
+        if char == "\x08":
+            return "backspace"
+        if char == "\x1b":
+            return "esc"
+        return char
+
+def _key_reader():
+    return _WindowsKeys() if os.name == "nt" else _PosixKeys()
+
+# ----------------------------------------
+# Disegno
+# ----------------------------------------
+
+class _Screen:
+    """
+    Ridisegna solo le righe cambiate rispetto al frame precedente, con una sola
+    write per frame. Lo schermo viene pulito solo al primo frame e dopo un resize.
+    """
+
+    def __init__(self, out=None):
+        self.out = out or sys.stdout
+        self.lines = []
+        self.size = None
+
+    def draw(self, lines) -> None:
+        size = shutil.get_terminal_size()
+        buf = []
+        if size != self.size:
+            buf.append(CLEAR_SCREEN)
+            self.lines = []
+            self.size = size
+        for row, line in enumerate(lines):
+            if row < len(self.lines) and self.lines[row] == line:
+                continue
+            buf.append(f"\x1b[{row + 1};1H{line}{CLEAR_LINE}")
+        if len(lines) < len(self.lines):
+            buf.append(f"\x1b[{len(lines) + 1};1H{CLEAR_BELOW}")
+        # Cursore sotto il menu: quello che viene stampato dopo non lo sovrascrive
+        buf.append(f"\x1b[{len(lines) + 1};1H")
+        self.out.write("".join(buf))
+        self.out.flush()
+        self.lines = list(lines)
+
+def _fit(text: str, width: int) -> str:
+    # Una riga per voce: il testo che andrebbe a capo sposterebbe tutte le righe successive
+    return text if len(text) <= width else text[:max(0, width - 1)] + "…"
+
+class _Menu:
+    """Stato del menu: voci visibili (filtro), selezione e scorrimento."""
+
+    def __init__(self, options):
+        self.options = [str(o) for o in options]
+        self._lower = [o.lower() for o in self.options]
+        self.query = ""
+        self.filtering = False
+        self.visible = list(range(len(self.options)))
+        self.selected = 0   # posizione in self.visible
+        self.offset = 0     # prima voce visibile nella finestra
+
+    def set_query(self, query: str) -> None:
+        current = self.visible[self.selected] if self.visible else None
+        self.query = query
+        needle = query.lower()
+        self.visible = [i for i, text in enumerate(self._lower) if needle in text]
+        # Se la voce selezionata passa il filtro resta selezionata
+        self.selected = self.visible.index(current) if current in self.visible else 0
+
+    def move(self, delta: int, wrap: bool = True) -> None:
+        if not self.visible:
+            return
+        if wrap:
+            self.selected = (self.selected + delta) % len(self.visible)
         else:
-            print(f"  {option}")
+            self.selected = min(max(self.selected + delta, 0), len(self.visible) - 1)
+
+    def render(self, rows: int, width: int) -> list:
+        if self.selected < self.offset:
+            self.offset = self.selected
+        elif self.selected >= self.offset + rows:
+            self.offset = self.selected - rows + 1
+        self.offset = max(0, min(self.offset, max(0, len(self.visible) - rows)))
+
+        lines = [Fore.CYAN + HEADER + Style.RESET_ALL, ""]
+        for pos in range(self.offset, min(len(self.visible), self.offset + rows)):
+            text = _fit(self.options[self.visible[pos]], width - 3)
+            if pos == self.selected:
+                lines.append(Fore.GREEN + f"> {text}" + Style.RESET_ALL)
+            else:
+                lines.append(f"  {text}")
+        if not self.visible:
+            lines.append(Style.DIM + "  (nessun risultato)" + Style.RESET_ALL)
+
+        if self.filtering or self.query:
+            status = f"filtro: {self.query}" + ("_" if self.filtering else "")
+            lines += ["", _fit(f"{status}  [{len(self.visible)}/{len(self.options)}]", width - 1)]
+        elif len(self.visible) > rows:
+            lines += ["", Style.DIM + _fit(f"[{self.selected + 1}/{len(self.visible)}]  / filtra  PgUp/PgDn scorre",
+                                           width - 1) + Style.RESET_ALL]
+        return lines
+
+    def handle(self, key: str, rows: int):
+        """None = continua, altrimenti l'indice da restituire (-1 = ESC)."""
+        if key == "enter":
+            if self.visible:
+                return self.visible[self.selected]
+            return None
+        if key == "up":
+            self.move(-1)
+        elif key == "down":
+            self.move(1)
+        elif key == "pageup":
+            self.move(-rows, wrap=False)
+        elif key == "pagedown":
+            self.move(rows, wrap=False)
+        elif key == "home":
+            self.selected = 0
+        elif key == "end":
+            self.selected = max(0, len(self.visible) - 1)
+        elif key == "esc":
+            if not self.filtering and not self.query:
+                return -1
+            # ESC con un filtro attivo lo toglie soltanto
+            self.filtering = False
+            self.set_query("")
+        elif self.filtering:
+            if key == "backspace":
+                if self.query:
+                    self.set_query(self.query[:-1])
+                else:
+                    self.filtering = False
+            elif len(key) == 1 and key.isprintable():
+                self.set_query(self.query + key)
+        elif key == "/":
+            self.filtering = True
+        elif key in ("w", "W"):
+            self.move(-1)
+        elif key in ("s", "S"):
+            self.move(1)
+        return None
+
+def _menu_fallback(options) -> int:
+    """Senza terminale interattivo (input da pipe): lista numerata e numero da tastiera."""
+    print(HEADER)
+    for i, option in enumerate(options, 1):
+        print(f"{i:>3}. {option}")
+    while True:
+        try:
+            answer = input("> ").strip()
+        except EOFError:
+            return -1
+        if not answer:
+            return -1
+        if answer.isdigit() and 1 <= int(answer) <= len(options):
+            return int(answer) - 1
 
 def menu_loop(options):
     """
     Mostra un menu interattivo per selezionare un'opzione da una lista.
     Ritorna l'indice selezionato, oppure -1 se si preme ESC.
+    Frecce / W S per muoversi, PgUp PgDn Home End per scorrere le liste lunghe,
+    / per filtrare le voci scrivendo parte del nome.
     """
-    selected = 0
-    print_menu(options, selected)
-
-    while True:
-        key = msvcrt.getch()
-
-        if key == b'\xe0':  # tasti freccia
-            arrow = msvcrt.getch()
-            if arrow == b'H':  # freccia su
-                selected = (selected - 1) % len(options)
-            elif arrow == b'P':  # freccia giù
-                selected = (selected + 1) % len(options)
-        elif key in (b'w', b'W'):
-            selected = (selected - 1) % len(options)
-        elif key in (b's', b'S'):
-            selected = (selected + 1) % len(options)
-        elif key == b'\r':  # Invio
-            return selected
-        elif key == b'\x1b':  # ESC
-            return -1
+    if not options:
+        return -1
+    if not sys.stdin.isatty() or not sys.stdout.isatty():
+        return _menu_fallback(options)
 
-        print_menu(options, selected)
+    menu = _Menu(options)
+    screen = _Screen()
+    # Console Windows senza VT: la sequenza comparirebbe come testo
+    cursor = _vt_enabled()
+    if cursor:
+        sys.stdout.write(HIDE_CURSOR)
+    try:
+        with _key_reader() as keys:
+            while True:
+                size = shutil.get_terminal_size()
+                # Intestazione (2 righe) e riga di stato (2) restano sempre visibili
+                rows = max(1, size.lines - 5)
+                screen.draw(menu.render(rows, size.columns))
+                result = menu.handle(keys.read(), rows)
+                if result is not None:
+                    return result
+    finally:
+        if cursor:
+            sys.stdout.write(SHOW_CURSOR)
+        sys.stdout.flush()
 
 # Menu principale fisso (puoi personalizzarlo)
 MENU_OPTIONS = [
     "Temporary Chat",
     "Persistent Chat (with memory)",
+    "Resume Chat",
     "Settings",
     "Load Addons",
     "Exit"
@@ -0,0 +1,95 @@
+import os
+import json
+import time
+import threading
+
+# Campi di durata restituiti da Ollama (in nanosecondi)
+DURATION_FIELDS = ("total_duration", "load_duration", "prompt_eval_duration", "eval_duration")
+COUNT_FIELDS = ("prompt_eval_count", "eval_count")
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    k = (len(ordered) - 1) * p / 100
+    lo = int(k)
+    hi = min(lo + 1, len(ordered) - 1)
+    return ordered[lo] + (ordered[hi] - ordered[lo]) * (k - lo)
+
+class MetricsTracker:
+    """
+    Metriche per turno: contatori di Ollama + tempo reale lato client e time-to-first-byte.
+    Aggregate per sessione e per modello; opzionalmente ogni turno viene aggiunto
+    a un file JSONL (export_path).
+    """
+
+    def __init__(self, export_path: str = None):
+        self.export_path = export_path
+        self.turns = []
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_settings(cls, settings):
+        return cls(export_path=settings.metrics_file or None)
+
+    def record(self, model: str, data: dict, wall_time: float, ttfb: float, cached: bool = False) -> dict:
+        turn = {
+            "timestamp": time.time(),
+            "model": model,
+            "wall_time": wall_time,
+            "ttfb": ttfb,
+            "cached": cached,
+        }
+        for field in DURATION_FIELDS:
+            # secondi, come wall_time
+            turn[field] = data.get(field, 0) / 1e9
+        for field in COUNT_FIELDS:
+            turn[field] = data.get(field, 0)
+
+        with self._lock:
+            self.turns.append(turn)
+            if self.export_path:
+                self._export(turn)
+        return turn
+
+    def _export(self, turn: dict) -> None:
+        try:
+            directory = os.path.dirname(self.export_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(self.export_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(turn) + "\n")
+        except OSError:
+            self.export_path = None  # niente export ripetuti se il file non è scrivibile
+
+    def clear(self) -> None:
+        with self._lock:
+            self.turns.clear()
+
+    def models(self) -> list:
+        with self._lock:
+            return sorted({t["model"] for t in self.turns})
+
+    def summary(self, model: str = None) -> dict:
+        with self._lock:
+            turns = [t for t in self.turns if model is None or t["model"] == model]
+        generated = [t for t in turns if not t["cached"]]
+        walls = [t["wall_time"] for t in turns]
+        ttfbs = [t["ttfb"] for t in turns]
+        eval_count = sum(t["eval_count"] for t in generated)
+        eval_time = sum(t["eval_duration"] for t in generated)
+        prompt_count = sum(t["prompt_eval_count"] for t in generated)
+        prompt_time = sum(t["prompt_eval_duration"] for t in generated)
+        total_time = sum(t["total_duration"] for t in generated)
+        load_time = sum(t["load_duration"] for t in generated)
+        return {
+            "turns": len(turns),
+            "cached": len(turns) - len(generated),
+            "tokens": eval_count,
+            "tokens_per_s": eval_count / eval_time if eval_time else 0.0,
+            "prompt_tokens_per_s": prompt_count / prompt_time if prompt_time else 0.0,
+            "p50_latency": percentile(walls, 50),
+            "p95_latency": percentile(walls, 95),
+            "p50_ttfb": percentile(ttfbs, 50),
+            "load_fraction": load_time / total_time if total_time else 0.0,
+        }
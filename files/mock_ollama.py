@@ -0,0 +1,236 @@
+"""
+Server HTTP locale che imita le API di Ollama (/api/generate, /api/chat, /api/embed, /api/tags, /api/ps).
+Serve per benchmark e prove senza un modello reale: latenza e velocità dei chunk
+sono configurabili. Uso da riga di comando:
+
+    python -m files.mock_ollama --port 11435 --latency 0.05 --chunks 20 --chunk-delay 0.01 --load-latency 2
+"""
+import sys
+import json
+import time
+import zlib
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+DEFAULT_MODELS = ["mock-small:1b", "mock-large:7b"]
+EMBEDDING_DIM = 64
+
+def keep_alive_seconds(value, default: float = 300.0) -> float:
+    """"30m", "10s", "1h" o un numero di secondi; negativo = per sempre."""
+    if value is None:
+        return default
+    if isinstance(value, (int, float)):
+        return float(value)
+    units = {"s": 1, "m": 60, "h": 3600}
+    value = str(value).strip()
+    if value and value[-1] in units:
+        return float(value[:-1]) * units[value[-1]]
+    return float(value)
+
+def fake_embedding(text: str) -> list:
+    """Bag of words con hashing: testi con parole in comune hanno vettori simili."""
+    vector = [0.0] * EMBEDDING_DIM
+    for word in text.lower().split():
+        vector[zlib.crc32(word.encode("utf-8")) % EMBEDDING_DIM] += 1.0
+    return vector
+
+class MockOllamaHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Header e corpo partono in write separate: senza TCP_NODELAY il delayed ACK aggiunge ~40 ms
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass  # niente log per ogni richiesta
+
+    # ---------- helper di risposta ----------
+
+    def _send_json(self, data: dict, status: int = 200) -> None:
+        body = json.dumps(data).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _start_stream(self) -> None:
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+    def _send_chunk(self, data: dict) -> None:
+        line = (json.dumps(data) + "\n").encode("utf-8")
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(line), line))
+        self.wfile.flush()
+
+    def _end_stream(self) -> None:
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+    def _read_json(self) -> dict:
+        length = int(self.headers.get("Content-Length", 0))
+        if not length:
+            return {}
+        try:
+            return json.loads(self.rfile.read(length))
+        except ValueError:
+            return {}
+
+    # ---------- endpoint ----------
+
+    def do_GET(self):
+        server = self.server
+        if self.path == "/api/tags":
+            self._send_json({"models": [{"name": m, "model": m} for m in server.models]})
+        elif self.path == "/api/ps":
+            self._send_json({"models": [
+                {"name": m, "model": m, "size_vram": 2**30, "expires_at": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(t))}
+                for m, t in server.resident().items()
+            ]})
+        else:
+            self._send_json({"error": "not found"}, 404)
+
+    def do_POST(self):
+        server = self.server
+        payload = self._read_json()
+        with server.lock:
+            server.request_count += 1
+
+        if self.path == "/api/embed":
+            # Qualsiasi nome di modello va bene: gli embedding finti non dipendono dal modello
+            inputs = payload.get("input", "")
+            inputs = [inputs] if isinstance(inputs, str) else inputs
+            time.sleep(server.latency)
+            self._send_json({"model": payload.get("model"), "embeddings": [fake_embedding(t) for t in inputs]})
+            return
+        if self.path not in ("/api/generate", "/api/chat"):
+            self._send_json({"error": "not found"}, 404)
+            return
+        if payload.get("model") not in server.models:
+            self._send_json({"error": f"model '{payload.get('model')}' not found"}, 404)
+            return
+
+        # Primo uso (o modello scaricato dopo keep_alive): si paga load_latency
+        load_time = server.ensure_loaded(payload["model"], payload.get("keep_alive"))
+        if self.path == "/api/generate" and "prompt" not in payload:
+            # Richiesta di solo caricamento, come in Ollama
+            self._send_json({"model": payload["model"], "response": "", "done": True,
+                             "done_reason": "load", "load_duration": int(load_time * 1e9)})
+            return
+
+        if self.path == "/api/chat":
+            messages = payload.get("messages", [])
+            prompt = "\n".join(m.get("content", "") for m in messages)
+        else:
+            prompt = payload.get("prompt", "")
+        context = list(payload.get("context") or [])
+        prompt_tokens = len(prompt.split())
+
+        time.sleep(server.latency)
+        words = [f"word{i} " for i in range(server.chunks)]
+        final = {
+            "model": payload["model"],
+            "done": True,
+            "total_duration": int((load_time + server.latency + server.chunk_delay * server.chunks) * 1e9),
+            "load_duration": int(load_time * 1e9),
+            "prompt_eval_count": prompt_tokens,
+            "prompt_eval_duration": int(server.latency * 1e9),
+            "eval_count": server.chunks,
+            "eval_duration": int(server.chunk_delay * server.chunks * 1e9),
+        }
+
+        if self.path == "/api/generate":
+            final["context"] = context + list(range(prompt_tokens + server.chunks))
+
+        def piece(text: str) -> dict:
+            if self.path == "/api/chat":
+                return {"model": payload["model"], "message": {"role": "assistant", "content": text}, "done": False}
+            return {"model": payload["model"], "response": text, "done": False}
+
+        if payload.get("stream", True):
+            self._start_stream()
+            for word in words:
+                time.sleep(server.chunk_delay)
+                self._send_chunk(piece(word))
+            final.update(piece(""), done=True)
+            self._send_chunk(final)
+            self._end_stream()
+        else:
+            time.sleep(server.chunk_delay * server.chunks)
+            final.update(piece("".join(words)), done=True)
+            self._send_json(final)
+
+class MockOllamaServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, port: int = 0, latency: float = 0.0, chunks: int = 10,
+                 chunk_delay: float = 0.0, models=None, load_latency: float = 0.0):
+        super().__init__(("127.0.0.1", port), MockOllamaHandler)
+        self.latency = latency
+        self.chunks = chunks
+        self.chunk_delay = chunk_delay
+        self.models = list(models or DEFAULT_MODELS)
+        self.load_latency = load_latency
+        self.loaded = {}  # modello -> scadenza (time.time())
+        self.request_count = 0
+        self.lock = threading.Lock()
+        self._thread = None
+
+    def handle_error(self, request, client_address):
+        # Client che chiude a metà stream (Ctrl-C, tentativo di hedging perdente): normale, come per Ollama
+        if isinstance(sys.exc_info()[1], (BrokenPipeError, ConnectionResetError)):
+            return
+        super().handle_error(request, client_address)
+
+    def resident(self) -> dict:
+        now = time.time()
+        with self.lock:
+            self.loaded = {m: t for m, t in self.loaded.items() if t > now}
+            return dict(self.loaded)
+
+    def ensure_loaded(self, model: str, keep_alive=None) -> float:
+        """Restituisce i secondi spesi a caricare il modello (0 se era già in memoria)."""
+        load_time = 0.0 if model in self.resident() else self.load_latency
+        if load_time:
+            time.sleep(load_time)
+        seconds = keep_alive_seconds(keep_alive)
+        with self.lock:
+            if seconds == 0:
+                self.loaded.pop(model, None)
+            else:
+                self.loaded[model] = time.time() + (seconds if seconds > 0 else 10 ** 9)
+        return load_time
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "MockOllamaServer":
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.shutdown()
+        self.server_close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Server finto compatibile con Ollama")
+    parser.add_argument("--port", type=int, default=11435)
+    parser.add_argument("--latency", type=float, default=0.05, help="Secondi prima del primo chunk")
+    parser.add_argument("--chunks", type=int, default=20, help="Chunk per risposta")
+    parser.add_argument("--chunk-delay", type=float, default=0.01, help="Secondi tra un chunk e l'altro")
+    parser.add_argument("--load-latency", type=float, default=0.0, help="Secondi per caricare un modello non in memoria")
+    args = parser.parse_args()
+
+    server = MockOllamaServer(args.port, args.latency, args.chunks, args.chunk_delay, load_latency=args.load_latency)
+    print(f"Mock Ollama in ascolto su {server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+
+if __name__ == "__main__":
+    main()
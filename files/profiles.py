@@ -0,0 +1,111 @@
+"""
+Preset come profili di prestazioni: ogni settings_preset{N}.json ha un nome, le
+impostazioni salvate e un blocco `options` passato a Ollama (num_ctx, num_predict,
+num_thread, num_batch, num_gpu). Per ogni profilo e modello si registrano i token/s
+misurati, così la scelta tra profili si basa su numeri reali.
+"""
+import os
+import re
+import threading
+from typing import Any, Dict, List, Optional
+
+from files.config_store import CONFIG_STORE
+
+PRESETS_DIR = os.path.join(os.path.dirname(__file__), "files")
+PRESET_PATTERN = re.compile(r"^settings_preset(\d+)\.json$")
+PROFILE_STATS_PATH = os.path.join(PRESETS_DIR, "profile_stats.json")
+
+# Opzioni di runtime di Ollama che incidono su velocità e memoria
+OPTION_KEYS = ("num_ctx", "num_predict", "num_thread", "num_batch", "num_gpu")
+# Quelle con cui Ollama carica il modello: se cambiano tra due richieste il modello viene ricaricato
+LOAD_OPTION_KEYS = ("num_ctx", "num_thread", "num_batch", "num_gpu")
+
+def load_options(options: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """Opzioni di caricamento del profilo, da mandare anche con warm-up, preload e riassunti."""
+    return {k: v for k, v in (options or {}).items() if k in LOAD_OPTION_KEYS and v is not None}
+
+def parse_options(text: str) -> Dict[str, int]:
+    """"num_ctx=4096 num_predict=256" -> dict; `chiave=` (senza valore) rimuove l'opzione (None)."""
+    options: Dict[str, Any] = {}
+    for item in text.split():
+        key, sep, value = item.partition("=")
+        if not sep or key not in OPTION_KEYS:
+            raise ValueError(f"opzione non valida: {item} (ammesse: {', '.join(OPTION_KEYS)})")
+        options[key] = int(value) if value else None
+    return options
+
+def list_presets(directory: str = PRESETS_DIR) -> List[Dict[str, Any]]:
+    """Preset salvati, in ordine di numero: {"name", "path", "data"}."""
+    presets = []
+    if not os.path.isdir(directory):
+        return presets
+    for filename in os.listdir(directory):
+        match = PRESET_PATTERN.match(filename)
+        if not match:
+            continue
+        path = os.path.join(directory, filename)
+        try:
+            data = CONFIG_STORE.load(path, {})
+        except (OSError, ValueError):
+            continue
+        # I preset salvati prima dei profili non hanno un nome: si usa il numero
+        name = data.get("name") or f"preset{match.group(1)}"
+        presets.append({"name": name, "path": path, "number": int(match.group(1)), "data": data})
+    presets.sort(key=lambda p: p["number"])
+    return presets
+
+def find_preset(name: str, directory: str = PRESETS_DIR) -> Optional[Dict[str, Any]]:
+    for preset in list_presets(directory):
+        if preset["name"] == name:
+            return preset
+    return None
+
+def next_preset_path(directory: str = PRESETS_DIR) -> str:
+    used = {p["number"] for p in list_presets(directory)}
+    i = 1
+    while i in used or os.path.exists(os.path.join(directory, f"settings_preset{i}.json")):
+        i += 1
+    return os.path.join(directory, f"settings_preset{i}.json")
+
+class ProfileStats:
+    """Token/s misurati per profilo e modello, salvati in profile_stats.json (scritture raggruppate)."""
+
+    def __init__(self, path: str = PROFILE_STATS_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def record(self, profile: str, model: str, turn: dict) -> None:
+        if turn.get("cached") or not turn.get("eval_count"):
+            return
+        with self._lock:
+            data = CONFIG_STORE.load(self.path, {})
+            entry = data.setdefault(profile, {}).setdefault(model, {
+                "turns": 0, "tokens": 0, "eval_seconds": 0.0,
+                "prompt_tokens": 0, "prompt_seconds": 0.0, "load_seconds": 0.0
+            })
+            entry["turns"] += 1
+            entry["tokens"] += turn["eval_count"]
+            entry["eval_seconds"] += turn["eval_duration"]
+            entry["prompt_tokens"] += turn["prompt_eval_count"]
+            entry["prompt_seconds"] += turn["prompt_eval_duration"]
+            entry["load_seconds"] += turn["load_duration"]
+            CONFIG_STORE.set(self.path, data)
+
+    def summary(self, profile: str, model: str) -> Optional[Dict[str, float]]:
+        entry = CONFIG_STORE.load(self.path, {}).get(profile, {}).get(model)
+        if not entry:
+            return None
+        return {
+            "turns": entry["turns"],
+            "tokens_per_s": entry["tokens"] / entry["eval_seconds"] if entry["eval_seconds"] else 0.0,
+            "prompt_tokens_per_s": entry["prompt_tokens"] / entry["prompt_seconds"] if entry["prompt_seconds"] else 0.0,
+            "load_seconds": entry["load_seconds"] / entry["turns"],
+        }
+
+    def clear(self, profile: Optional[str] = None) -> None:
+        with self._lock:
+            data = CONFIG_STORE.load(self.path, {}) if profile else {}
+            data.pop(profile, None)
+            CONFIG_STORE.set(self.path, data)
+
+PROFILE_STATS = ProfileStats()
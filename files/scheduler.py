@@ -0,0 +1,176 @@
+"""
+Scheduler delle richieste a Ollama.
+- ogni generazione è un Task annullabile: cancel() chiude la connessione, quindi
+  Ollama smette di generare, e chi legge lo stream riceve TaskCancelled
+- per ogni server al massimo `limit` richieste contemporanee; quelle in attesa
+  partono in ordine di priorità: prima le interattive, poi il lavoro in background
+  (riassunti, embedding, warm-up, preload)
+La priorità di default è quella del thread: i thread in background usano
+`with SCHEDULER.background():`.
+"""
+import heapq
+import socket
+import itertools
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, List
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BACKGROUND = 10
+
+class TaskCancelled(Exception):
+    """Generazione interrotta (Ctrl-C, /stop, client disconnesso)."""
+
+class Task:
+    """Una richiesta (o uno stream) annullabile da qualunque thread."""
+
+    def __init__(self, name: str = "", priority: int = PRIORITY_INTERACTIVE):
+        self.name = name
+        self.priority = priority
+        self.cancelled = threading.Event()
+        self._responses: List[Any] = []
+        self._callbacks = []
+        self._lock = threading.Lock()
+
+    def cancel(self) -> None:
+        with self._lock:
+            self.cancelled.set()
+            responses, callbacks = list(self._responses), list(self._callbacks)
+        for response in responses:
+            _abort(response)
+        for callback in callbacks:
+            callback()
+
+    def check(self) -> None:
+        if self.cancelled.is_set():
+            raise TaskCancelled(f"Request cancelled: {self.name or 'generation'}")
+
+    def on_cancel(self, callback) -> None:
+        with self._lock:
+            self._callbacks.append(callback)
+
+    @contextmanager
+    def attached(self, response):
+        """
+        Lega la risposta HTTP al task finché il blocco è attivo: cancel() la chiude.
+        Gli errori di lettura dovuti alla chiusura diventano TaskCancelled.
+        """
+        with self._lock:
+            cancelled = self.cancelled.is_set()
+            if not cancelled:
+                self._responses.append(response)
+        if cancelled:
+            _abort(response)
+            self.check()
+        try:
+            yield response
+        except Exception:
+            self.check()
+            raise
+        finally:
+            with self._lock:
+                if response in self._responses:
+                    self._responses.remove(response)
+        self.check()
+
+def _abort(response) -> None:
+    """
+    Chiude la connessione di una risposta requests. close() da un altro thread non
+    sblocca una lettura in corso: prima si fa shutdown del socket.
+    """
+    try:
+        connection = getattr(response.raw, "connection", None)
+        sock = getattr(connection, "sock", None)
+        if sock is not None:
+            sock.shutdown(socket.SHUT_RDWR)
+    except (OSError, AttributeError):
+        pass
+    try:
+        response.close()
+    except Exception:
+        pass
+
+class Scheduler:
+    """Code con priorità per server (chiave = URL) e limite di richieste contemporanee."""
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._backends: Dict[str, Dict[str, Any]] = {}
+        self._seq = itertools.count()
+        self._local = threading.local()
+
+    def current_priority(self) -> int:
+        return getattr(self._local, "priority", PRIORITY_INTERACTIVE)
+
+    @contextmanager
+    def background(self):
+        """Le richieste fatte dal thread corrente nel blocco hanno priorità di background."""
+        previous = self.current_priority()
+        self._local.priority = PRIORITY_BACKGROUND
+        try:
+            yield
+        finally:
+            self._local.priority = previous
+
+    def new_task(self, name: str = "") -> Task:
+        return Task(name, self.current_priority())
+
+    def _state(self, key: str) -> Dict[str, Any]:
+        state = self._backends.get(key)
+        if state is None:
+            state = self._backends[key] = {"running": 0, "waiting": [], "served": 0}
+        return state
+
+    def acquire(self, key: str, task: Task, limit: int = 0) -> None:
+        """Attende il turno di `task` su `key`; limit <= 0 = nessun limite."""
+        task.check()
+        with self._cond:
+            state = self._state(key)
+            entry = (task.priority, next(self._seq), task)
+            heapq.heappush(state["waiting"], entry)
+            task.on_cancel(self._wake)
+            try:
+                while state["waiting"][0] is not entry or (0 < limit <= state["running"]):
+                    task.check()
+                    self._cond.wait()
+                task.check()
+            except BaseException:
+                # Anche Ctrl-C durante l'attesa: una voce rimasta in testa bloccherebbe la coda
+                state["waiting"].remove(entry)
+                heapq.heapify(state["waiting"])
+                self._cond.notify_all()
+                raise
+            heapq.heappop(state["waiting"])
+            state["running"] += 1
+            # Il prossimo in coda potrebbe avere già un posto libero
+            self._cond.notify_all()
+
+    def release(self, key: str) -> None:
+        with self._cond:
+            state = self._state(key)
+            state["running"] -= 1
+            state["served"] += 1
+            self._cond.notify_all()
+
+    def _wake(self) -> None:
+        with self._cond:
+            self._cond.notify_all()
+
+    @contextmanager
+    def slot(self, key: str, task: Task, limit: int = 0):
+        self.acquire(key, task, limit)
+        try:
+            yield
+        finally:
+            self.release(key)
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        with self._cond:
+            return {key: {
+                "running": s["running"],
+                "waiting": len(s["waiting"]),
+                "waiting_background": sum(1 for p, _n, _t in s["waiting"] if p >= PRIORITY_BACKGROUND),
+                "served": s["served"],
+            } for key, s in self._backends.items()}
+
+SCHEDULER = Scheduler()
@@ -0,0 +1,177 @@
+import os
+import threading
+from typing import Any, Dict, List, Optional
+
+from files import journal
+
+# sqlite3 si importa alla prima apertura di un indice, non all'import di main.py
+sqlite3 = None
+
+def _load_sqlite():
+    global sqlite3
+    if sqlite3 is None:
+        import sqlite3 as module
+        sqlite3 = module
+    return sqlite3
+
+INDEX_NAME = "search.db"
+
+SCHEMA = (
+    # Testo dei turni: FTS5 con ranking bm25; le colonne UNINDEXED non entrano nella ricerca
+    "CREATE VIRTUAL TABLE IF NOT EXISTS turns USING fts5("
+    "user, llm, chat_id UNINDEXED, turn UNINDEXED, ts UNINDEXED, "
+    "tokenize = 'unicode61 remove_diacritics 2')",
+    # Quanti turni di ogni chat sono già nell'indice
+    "CREATE TABLE IF NOT EXISTS chats (id TEXT PRIMARY KEY, turns INTEGER NOT NULL)",
+)
+
+def fts_query(terms: str) -> str:
+    """Ogni parola diventa una frase tra virgolette: la punteggiatura non rompe la sintassi FTS5."""
+    words = [w.replace('"', '""') for w in terms.split()]
+    return " ".join(f'"{w}"' for w in words if w)
+
+class ChatSearchIndex:
+    """
+    Indice full-text (SQLite FTS5) dei turni salvati, in CHAT_DIR/search.db.
+    - add_turn: chiamato dal ChatJournal a ogni turno, un INSERT per turno
+    - sync: riallinea l'indice con le chat su disco leggendo solo i turni mancanti
+    - search: risultati ordinati per bm25 con snippet evidenziati
+    """
+
+    def __init__(self, directory: Optional[str] = None):
+        self.directory = journal._chat_dir(directory)
+        self.path = os.path.join(self.directory, INDEX_NAME)
+        self.error = None
+        self._lock = threading.Lock()
+        self._worker = None
+        try:
+            _load_sqlite()
+        except ImportError as e:
+            # Python compilato senza sqlite3
+            self._db = None
+            self.error = str(e)
+            return
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self._db = sqlite3.connect(self.path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode = WAL")
+            self._db.execute("PRAGMA synchronous = NORMAL")
+            for statement in SCHEMA:
+                self._db.execute(statement)
+            self._db.commit()
+        except sqlite3.Error as e:
+            # Es. SQLite compilato senza FTS5: la ricerca resta disattivata
+            self._db = None
+            self.error = str(e)
+
+    @property
+    def available(self) -> bool:
+        return self._db is not None
+
+    def indexing(self) -> bool:
+        return self._worker is not None and self._worker.is_alive()
+
+    def _indexed(self, chat_id: str) -> int:
+        row = self._db.execute("SELECT turns FROM chats WHERE id = ?", (chat_id,)).fetchone()
+        return row[0] if row else 0
+
+    def add_turn(self, chat_id: str, turn: int, user: str, llm: str, ts: float) -> None:
+        """Aggiunge il turno `turn` (da 1); se mancano turni precedenti ci penserà sync."""
+        if not self.available:
+            return
+        try:
+            with self._lock:
+                if self._indexed(chat_id) != turn - 1:
+                    return
+                self._db.execute(
+                    "INSERT INTO turns (user, llm, chat_id, turn, ts) VALUES (?, ?, ?, ?, ?)",
+                    (user, llm, chat_id, turn, ts)
+                )
+                self._db.execute("INSERT OR REPLACE INTO chats (id, turns) VALUES (?, ?)", (chat_id, turn))
+                self._db.commit()
+        except sqlite3.Error:
+            pass  # l'indice si riallinea al prossimo sync
+
+    def _catch_up(self, entry: Dict[str, Any], indexed: int) -> None:
+        rows = []
+        for n, turn in enumerate(journal.iter_chat_turns(journal.chat_path(entry, self.directory)), 1):
+            if n > indexed:
+                rows.append((turn.get("user", ""), turn.get("llm", ""), entry["id"], n, turn.get("ts", 0)))
+        if not rows:
+            return
+        with self._lock:
+            # add_turn potrebbe aver già scritto gli stessi turni nel frattempo
+            if self._indexed(entry["id"]) != indexed:
+                return
+            self._db.executemany("INSERT INTO turns (user, llm, chat_id, turn, ts) VALUES (?, ?, ?, ?, ?)", rows)
+            self._db.execute("INSERT OR REPLACE INTO chats (id, turns) VALUES (?, ?)", (entry["id"], rows[-1][3]))
+            self._db.commit()
+
+    def sync(self) -> int:
+        """Indicizza i turni non ancora presenti e rimuove le chat cancellate. Restituisce le chat aggiornate."""
+        if not self.available:
+            return 0
+        chats = journal.list_chats(self.directory)
+        with self._lock:
+            indexed = dict(self._db.execute("SELECT id, turns FROM chats").fetchall())
+        updated = 0
+        for entry in chats:
+            done = indexed.pop(entry["id"], 0)
+            # Journal ancora aperto: l'indice delle chat è indietro, non la ricerca
+            if done >= entry.get("turns", 0):
+                continue
+            try:
+                self._catch_up(entry, done)
+            except (OSError, ValueError, sqlite3.Error):
+                continue
+            updated += 1
+        if indexed:
+            with self._lock:
+                for chat_id in indexed:
+                    self._db.execute("DELETE FROM turns WHERE chat_id = ?", (chat_id,))
+                    self._db.execute("DELETE FROM chats WHERE id = ?", (chat_id,))
+                self._db.commit()
+        return updated
+
+    def sync_async(self) -> None:
+        """Riallinea l'indice in un thread separato (se non è già in corso)."""
+        if not self.available or self.indexing():
+            return
+        self._worker = threading.Thread(target=self.sync, daemon=True)
+        self._worker.start()
+
+    def search(self, terms: str, limit: int = 10, mark=("[", "]")) -> List[Dict[str, Any]]:
+        if not self.available:
+            raise Exception(f"Request failed: search index unavailable ({self.error})")
+        query = fts_query(terms)
+        if not query:
+            return []
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT chat_id, turn, snippet(turns, -1, ?, ?, '…', 16), bm25(turns) "
+                "FROM turns WHERE turns MATCH ? ORDER BY bm25(turns) LIMIT ?",
+                (mark[0], mark[1], query, limit)
+            ).fetchall()
+        return [{"chat_id": c, "turn": t, "snippet": s, "score": -r} for c, t, s, r in rows]
+
+    def close(self) -> None:
+        if self._db is not None:
+            with self._lock:
+                self._db.close()
+                self._db = None
+
+_INDEXES: Dict[str, ChatSearchIndex] = {}
+_INDEXES_LOCK = threading.Lock()
+
+def get_search_index(directory: Optional[str] = None) -> ChatSearchIndex:
+    """
+    Un indice per cartella di chat, condiviso da journal e comando /search.
+    Alla prima apertura parte un sync in background (indice mancante o non aggiornato).
+    """
+    path = journal._chat_dir(directory)
+    with _INDEXES_LOCK:
+        index = _INDEXES.get(path)
+        if index is None:
+            index = _INDEXES[path] = ChatSearchIndex(directory)
+            index.sync_async()
+    return index
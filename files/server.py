@@ -0,0 +1,430 @@
+"""
+Modalità server: LlamaAgent (format_prompt, hook e filtri degli addon compresi)
+esposto su HTTP locale con API compatibili OpenAI e Ollama.
+
+    POST /v1/chat/completions   OpenAI (stream: server-sent events)
+    POST /api/chat              Ollama, messaggi (stream: NDJSON, attivo di default)
+    POST /api/generate          Ollama, singolo prompt
+    GET  /v1/models, /api/tags  modelli installati
+    POST /sessions/<id>/stop    interrompe la generazione in corso della sessione
+    DELETE /sessions/<id>       dimentica una sessione
+    GET  /health                code e sessioni attive
+
+Sessioni: con l'header X-Session-Id (o il campo "session" nel corpo) la cronologia resta
+sul server e basta inviare l'ultimo messaggio; senza, la cronologia arriva nei messaggi.
+Le richieste passano da una coda limitata: al massimo `concurrency` generazioni
+contemporanee, `queue_size` in attesa, oltre si risponde 429. Le richieste di una sessione
+già occupata aspettano il proprio turno prima di entrare in coda.
+"""
+import json
+import time
+import uuid
+import threading
+from contextlib import nullcontext
+from datetime import datetime, timezone
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Any, Callable, Dict, List, Optional
+
+from files.backend import list_model_names
+from files.scheduler import TaskCancelled
+
+DEFAULT_PORT = 8085
+
+class RequestQueue:
+    """Coda limitata: `concurrency` richieste in esecuzione, al massimo `max_waiting` in attesa."""
+
+    def __init__(self, concurrency: int = 4, max_waiting: int = 16):
+        self.concurrency = max(1, concurrency)
+        self.max_waiting = max(0, max_waiting)
+        self.running = 0
+        self.waiting = 0
+        self.served = 0
+        self.rejected = 0
+        self._lock = threading.Lock()
+        self._slots = threading.Semaphore(self.concurrency)
+
+    def acquire(self) -> bool:
+        """Attende un posto libero; False (subito) se anche la coda è piena."""
+        with self._lock:
+            if self.running + self.waiting >= self.concurrency + self.max_waiting:
+                self.rejected += 1
+                return False
+            self.waiting += 1
+        self._slots.acquire()
+        with self._lock:
+            self.waiting -= 1
+            self.running += 1
+        return True
+
+    def release(self) -> None:
+        with self._lock:
+            self.running -= 1
+            self.served += 1
+        self._slots.release()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"running": self.running, "waiting": self.waiting, "concurrency": self.concurrency,
+                    "max_waiting": self.max_waiting, "served": self.served, "rejected": self.rejected}
+
+class SessionStore:
+    """Un agente per sessione; le sessioni inattive da più di `ttl` secondi vengono scartate."""
+
+    def __init__(self, factory: Callable[[], Any], ttl: float = 1800.0, max_sessions: int = 256):
+        self.factory = factory
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self._sessions: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, session_id: str) -> Dict[str, Any]:
+        now = time.time()
+        with self._lock:
+            self._expire(now)
+            session = self._sessions.get(session_id)
+            if session is None:
+                if len(self._sessions) >= self.max_sessions:
+                    # La meno usata di recente lascia il posto
+                    oldest = min(self._sessions, key=lambda k: self._sessions[k]["used"])
+                    self._sessions.pop(oldest)
+                session = self._sessions[session_id] = {
+                    "agent": self.factory(), "lock": threading.Lock(), "used": now
+                }
+            session["used"] = now
+            return session
+
+    def _expire(self, now: float) -> None:
+        if not self.ttl:
+            return
+        for key in [k for k, s in self._sessions.items() if now - s["used"] > self.ttl]:
+            self._sessions.pop(key)
+
+    def peek(self, session_id: str) -> Optional[Dict[str, Any]]:
+        """La sessione se esiste, senza crearla né aspettarne il lock."""
+        with self._lock:
+            return self._sessions.get(session_id)
+
+    def drop(self, session_id: str) -> bool:
+        with self._lock:
+            return self._sessions.pop(session_id, None) is not None
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._sessions)
+
+def split_messages(messages: List[Dict[str, Any]]):
+    """
+    Messaggi OpenAI/Ollama -> (testo di sistema, turni precedenti, ultima domanda).
+    Le risposte dell'assistente vengono accoppiate alla domanda che le precede.
+    """
+    system, turns, pending = [], [], None
+    for message in messages or []:
+        role, content = message.get("role"), message.get("content") or ""
+        if isinstance(content, list):
+            # Formato OpenAI a parti: si tiene solo il testo
+            content = "".join(p.get("text", "") for p in content if isinstance(p, dict))
+        if role == "system":
+            system.append(content)
+        elif role == "user":
+            if pending is not None:
+                turns.append({"user": pending, "llm": ""})
+            pending = content
+        elif role == "assistant" and pending is not None:
+            turns.append({"user": pending, "llm": content})
+            pending = None
+    return "\n".join(system), turns, pending
+
+def seed_history(agent, system: str, turns: List[Dict[str, str]]) -> None:
+    """Cronologia inviata dal client (richieste senza sessione) caricata nell'agente."""
+    agent.clear_history()
+    agent.history.extend(turns)
+    agent.history_prefix = agent.budget.build_prefix(agent.history)
+    agent.system = system
+
+def ollama_timestamp() -> str:
+    """created_at delle risposte Ollama: data ISO 8601 in UTC, non un intero."""
+    return datetime.now(timezone.utc).isoformat()
+
+def usage_of(agent) -> Dict[str, int]:
+    turn = agent.metrics.turns[-1] if agent.metrics.turns else {}
+    prompt, completion = turn.get("prompt_eval_count", 0), turn.get("eval_count", 0)
+    return {"prompt_tokens": prompt, "completion_tokens": completion, "total_tokens": prompt + completion}
+
+class AgentRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    # ---------- helper di risposta ----------
+
+    def _send_json(self, data: dict, status: int = 200, headers: Optional[Dict[str, str]] = None) -> None:
+        body = json.dumps(data, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_error(self, status: int, message: str, headers: Optional[Dict[str, str]] = None) -> None:
+        # Stesso corpo per i due formati: OpenAI legge error.message, Ollama la stringa error
+        self._send_json({"error": {"message": message, "code": status}} if self.path.startswith("/v1/")
+                        else {"error": message}, status, headers)
+
+    def _start_stream(self, content_type: str, session_id: Optional[str]) -> None:
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Transfer-Encoding", "chunked")
+        if session_id:
+            self.send_header("X-Session-Id", session_id)
+        self.end_headers()
+
+    def _send_chunk(self, data: bytes) -> None:
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+        self.wfile.flush()
+
+    def _end_stream(self) -> None:
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+    def _read_json(self) -> Optional[dict]:
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+        except ValueError:
+            length = -1
+        if length < 0:
+            # Corpo di lunghezza ignota: la connessione non si può riusare
+            self.close_connection = True
+            return None
+        if not length:
+            return {}
+        try:
+            data = json.loads(self.rfile.read(length))
+        except ValueError:
+            return None
+        return data if isinstance(data, dict) else None
+
+    # ---------- endpoint ----------
+
+    def do_GET(self):
+        server = self.server
+        if self.path == "/health":
+            self._send_json({"status": "ok", "model": server.settings.selected_model,
+                             "sessions": len(server.sessions), "queue": server.queue.stats()})
+        elif self.path in ("/v1/models", "/api/tags"):
+            try:
+                names = list_model_names(server.client, server.settings.models_cache_ttl)
+            except Exception as e:
+                self._send_error(502, str(e))
+                return
+            if self.path == "/api/tags":
+                self._send_json({"models": [{"name": n, "model": n} for n in names]})
+            else:
+                self._send_json({"object": "list", "data": [
+                    {"id": n, "object": "model", "created": 0, "owned_by": "ollama"} for n in names
+                ]})
+        else:
+            self._send_error(404, "not found")
+
+    def do_DELETE(self):
+        if self.path.startswith("/sessions/"):
+            found = self.server.sessions.drop(self.path[len("/sessions/"):])
+            self._send_json({"deleted": found}, 200 if found else 404)
+        else:
+            self._send_error(404, "not found")
+
+    def do_POST(self):
+        if self.path.startswith("/sessions/") and self.path.endswith("/stop"):
+            session = self.server.sessions.peek(self.path[len("/sessions/"):-len("/stop")])
+            if session is None:
+                self._send_error(404, "unknown session")
+            else:
+                self._send_json({"stopped": session["agent"].cancel()})
+            return
+        if self.path not in ("/v1/chat/completions", "/api/chat", "/api/generate"):
+            self._send_error(404, "not found")
+            return
+        payload = self._read_json()
+        if payload is None:
+            self._send_error(400, "invalid request body")
+            return
+
+        if self.path == "/api/generate":
+            system, turns, prompt = payload.get("system", ""), [], payload.get("prompt")
+        else:
+            system, turns, prompt = split_messages(payload.get("messages"))
+        if not prompt:
+            self._send_error(400, "missing prompt (or no user message)")
+            return
+
+        server = self.server
+        session_id = self.headers.get("X-Session-Id") or payload.get("session")
+        session = server.sessions.get(str(session_id)) if session_id else None
+        try:
+            # Prima il turno della sessione, poi il posto in coda: chi aspetta una sessione
+            # occupata non toglie posti alle altre
+            with session["lock"] if session else nullcontext():
+                if session:
+                    agent = session["agent"]
+                    if system and system != agent.system:
+                        if agent.history:
+                            # La cronologia sul server è nata con un altro sistema
+                            self._send_error(400, "the system message of a session cannot change")
+                            return
+                        agent.system = system
+                if not server.queue.acquire():
+                    self._send_error(429, "server busy, retry later", {"Retry-After": "1"})
+                    return
+                try:
+                    if session:
+                        self._respond(agent, payload, prompt, str(session_id))
+                    else:
+                        agent = server.factory()
+                        seed_history(agent, system, turns)
+                        self._respond(agent, payload, prompt, None)
+                finally:
+                    server.queue.release()
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # il client ha chiuso la connessione: lo stream verso Ollama è già stato chiuso
+
+    def _respond(self, agent, payload: dict, prompt: str, session_id: Optional[str]) -> None:
+        if payload.get("model"):
+            agent.model = payload["model"]
+        # Ollama fa streaming di default, OpenAI no
+        stream = payload.get("stream", self.path != "/v1/chat/completions")
+        headers = {"X-Session-Id": session_id} if session_id else None
+        created = int(time.time())
+
+        if not stream:
+            agent.stream = False
+            try:
+                text = agent.ask(prompt)
+            except TaskCancelled as e:
+                self._send_error(409, str(e))
+                return
+            except Exception as e:
+                self._send_error(502, str(e))
+                return
+            self._send_json(self._full_response(agent, text, created), headers=headers)
+            return
+
+        agent.stream = True
+        chunks = agent.ask_stream(prompt)
+        try:
+            # Errori prima del primo pezzo (modello assente, Ollama irraggiungibile): risposta normale
+            first = next(chunks, None)
+        except Exception as e:
+            self._send_error(502, str(e))
+            return
+
+        sse = self.path == "/v1/chat/completions"
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:24]}"
+        self._start_stream("text/event-stream" if sse else "application/x-ndjson", session_id)
+        try:
+            if first is not None:
+                for piece in self._chain(first, chunks):
+                    self._send_chunk(self._stream_piece(agent, piece, created, completion_id))
+            self._send_chunk(self._stream_end(agent, created, completion_id))
+            if sse:
+                self._send_chunk(b"data: [DONE]\n\n")
+        except Exception as e:
+            if isinstance(e, (BrokenPipeError, ConnectionResetError)):
+                raise
+            # A stream iniziato lo stato HTTP è già partito: l'errore va nel corpo
+            error = {"error": {"message": str(e)}} if sse else {"error": str(e)}
+            self._send_chunk(self._encode(error, sse))
+        finally:
+            chunks.close()
+        self._end_stream()
+
+    @staticmethod
+    def _chain(first, chunks):
+        yield first
+        yield from chunks
+
+    def _encode(self, data: dict, sse: bool) -> bytes:
+        text = json.dumps(data, ensure_ascii=False)
+        return (f"data: {text}\n\n" if sse else text + "\n").encode("utf-8")
+
+    def _stream_piece(self, agent, piece: str, created: int, completion_id: str) -> bytes:
+        if self.path == "/v1/chat/completions":
+            return self._encode({
+                "id": completion_id, "object": "chat.completion.chunk", "created": created, "model": agent.model,
+                "choices": [{"index": 0, "delta": {"role": "assistant", "content": piece}, "finish_reason": None}],
+            }, True)
+        key = "response" if self.path == "/api/generate" else "message"
+        value = piece if key == "response" else {"role": "assistant", "content": piece}
+        return self._encode({"model": agent.model, "created_at": ollama_timestamp(), key: value, "done": False}, False)
+
+    def _stream_end(self, agent, created: int, completion_id: str) -> bytes:
+        usage = usage_of(agent)
+        # Stream interrotto con /sessions/<id>/stop: il client vede perché è finito
+        reason = "cancelled" if agent.interrupted else "stop"
+        if self.path == "/v1/chat/completions":
+            return self._encode({
+                "id": completion_id, "object": "chat.completion.chunk", "created": created, "model": agent.model,
+                "choices": [{"index": 0, "delta": {}, "finish_reason": reason}], "usage": usage,
+            }, True)
+        end = {"model": agent.model, "created_at": ollama_timestamp(), "done": True, "done_reason": reason,
+               "prompt_eval_count": usage["prompt_tokens"], "eval_count": usage["completion_tokens"]}
+        if self.path == "/api/generate":
+            end["response"] = ""
+        else:
+            end["message"] = {"role": "assistant", "content": ""}
+        return self._encode(end, False)
+
+    def _full_response(self, agent, text: str, created: int) -> dict:
+        usage = usage_of(agent)
+        if self.path == "/v1/chat/completions":
+            return {
+                "id": f"chatcmpl-{uuid.uuid4().hex[:24]}", "object": "chat.completion",
+                "created": created, "model": agent.model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+                "usage": usage,
+            }
+        data = {"model": agent.model, "created_at": ollama_timestamp(), "done": True, "done_reason": "stop",
+                "prompt_eval_count": usage["prompt_tokens"], "eval_count": usage["completion_tokens"]}
+        if self.path == "/api/generate":
+            data["response"] = text
+        else:
+            data["message"] = {"role": "assistant", "content": text}
+        return data
+
+class AgentServer(ThreadingHTTPServer):
+    """
+    Server HTTP davanti a LlamaAgent. `factory()` crea un agente (uno per sessione,
+    o uno per richiesta senza sessione); `client` è il client Ollama condiviso.
+    """
+    daemon_threads = True
+
+    def __init__(self, settings, factory: Callable[[], Any], client, host: str = "127.0.0.1",
+                 port: int = DEFAULT_PORT, concurrency: int = 4, queue_size: int = 16,
+                 session_ttl: float = 1800.0, verbose: bool = False):
+        super().__init__((host, port), AgentRequestHandler)
+        self.settings = settings
+        self.factory = factory
+        self.client = client
+        self.queue = RequestQueue(concurrency, queue_size)
+        self.sessions = SessionStore(factory, session_ttl)
+        self.verbose = verbose
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "AgentServer":
+        """In un thread separato (test e benchmark); da riga di comando si usa serve_forever()."""
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.shutdown()
+        self.server_close()
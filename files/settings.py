@@ -1,9 +1,10 @@
-import json
-import subprocess
 import os
 from datetime import datetime
 from colorama import Fore, Style
 from files.menu import menu_loop
+from files.config_store import CONFIG_STORE
+from files.backend import create_client, list_model_names, preload_model
+from files.profiles import PROFILE_STATS, list_presets, find_preset, next_preset_path
 
 SETTINGS_DIR = os.path.join(os.path.dirname(__file__), "files")
 SETTINGS_PATH = os.path.join(SETTINGS_DIR, "settings.json")
@@ -16,46 +17,90 @@ class Settings:
         "Dialog Type",
         "Interact with Computer (coming soon)",
         "Use Emoji",
+        "Stream Output",
         "Select Model",
         "Save Preset",
+        "Load Preset",
         "Return to Main Menu"
     ]
     
-    def __init__(self):
+    # Chiavi salvate in settings.json e nei preset
+    SETTINGS_KEYS = (
+        "default_mode", "dialog_type", "allow_system_interaction", "use_emoji", "stream_output",
+        "reuse_context", "context_budget", "history_window", "use_cache", "cache_max_entries",
+        "cache_ttl", "compare_models", "metrics_file", "hook_budget_ms", "hook_max_overruns",
+        "addons_parallel_load", "addon_workers", "addon_call_timeout", "journal_fsync",
+        "chat_compress_days", "memory_enabled", "memory_top_k", "embedding_model", "selected_model",
+        "ollama_url", "connect_timeout", "read_timeout", "pool_size", "models_cache_ttl",
+        "keep_alive", "profile", "options", "ollama_endpoints", "health_check_interval", "hedge_after_ms",
+        "max_concurrent_requests",
+    )
+
+    def __init__(self, interactive=True):
         self.default_mode = "chat"
         self.dialog_type = "general"
         self.allow_system_interaction = False
         self.use_emoji = False
+        self.stream_output = True
+        self.reuse_context = True
+        self.context_budget = 4096
+        self.history_window = 6
+        self.use_cache = False
+        self.cache_max_entries = 256
+        self.cache_ttl = 86400
+        self.compare_models = []
+        self.metrics_file = ""
+        self.hook_budget_ms = 50.0
+        self.hook_max_overruns = 3
+        self.addons_parallel_load = False
+        self.addon_workers = 2
+        self.addon_call_timeout = 5.0
+        self.journal_fsync = True
+        self.chat_compress_days = 30
+        self.memory_enabled = False
+        self.memory_top_k = 4
+        self.embedding_model = "nomic-embed-text"
         self.selected_model = None
+        self.ollama_url = "http://localhost:11434"
+        self.connect_timeout = 5.0
+        self.read_timeout = 300.0
+        self.pool_size = 4
+        self.models_cache_ttl = 300.0
+        self.keep_alive = "30m"
+        self.profile = "default"
+        self.options = {}
+        # Più server Ollama (URL): se la lista non è vuota sostituisce ollama_url
+        self.ollama_endpoints = []
+        self.health_check_interval = 10.0
+        # Duplica su un secondo server le richieste più lente di così (0 = mai)
+        self.hedge_after_ms = 0
+        # Generazioni contemporanee per server Ollama (0 = nessun limite); in coda le interattive passano avanti
+        self.max_concurrent_requests = 4
 
         self.load_settings()
-        self.ensure_model_selected()
+        if interactive:
+            self.ensure_model_selected()
 
     def load_settings(self):
-        if os.path.exists(SETTINGS_PATH):
-            try:
-                with open(SETTINGS_PATH, "r") as f:
-                    data = json.load(f)
-                self.default_mode = data.get("default_mode", self.default_mode)
-                self.dialog_type = data.get("dialog_type", self.dialog_type)
-                self.allow_system_interaction = data.get("allow_system_interaction", self.allow_system_interaction)
-                self.use_emoji = data.get("use_emoji", self.use_emoji)
-                self.selected_model = data.get("selected_model", self.selected_model)
-            except Exception as e:
-                print(Fore.RED + f"Failed to load settings: {e}" + Style.RESET_ALL)
+        try:
+            data = CONFIG_STORE.load(SETTINGS_PATH, {})
+            for key in self.SETTINGS_KEYS:
+                setattr(self, key, data.get(key, getattr(self, key)))
+        except Exception as e:
+            print(Fore.RED + f"Failed to load settings: {e}" + Style.RESET_ALL)
+
+    def to_dict(self) -> dict:
+        return {key: getattr(self, key) for key in self.SETTINGS_KEYS}
 
     def save_settings(self):
-        data = {
-            "default_mode": self.default_mode,
-            "dialog_type": self.dialog_type,
-            "allow_system_interaction": self.allow_system_interaction,
-            "use_emoji": self.use_emoji,
-            "selected_model": self.selected_model
-        }
+        # Scrittura differita e atomica: più modifiche ravvicinate diventano una sola scrittura
         try:
-            with open(SETTINGS_PATH, "w") as f:
-                json.dump(data, f, indent=2)
-            print(Fore.GREEN + f"Settings saved to {SETTINGS_PATH}" + Style.RESET_ALL)
+            CONFIG_STORE.set(SETTINGS_PATH, self.to_dict())
+            # Una scrittura precedente non riuscita: il file su disco è ancora vecchio
+            error = CONFIG_STORE.error(SETTINGS_PATH)
+            if error is not None:
+                raise error
+            print(Fore.GREEN + f"Settings will be saved to {SETTINGS_PATH}" + Style.RESET_ALL)
         except Exception as e:
             print(Fore.RED + f"Failed to save settings: {e}" + Style.RESET_ALL)
 
@@ -64,26 +109,34 @@ class Settings:
             print(Fore.YELLOW + "\nNo model selected. You must select one to continue." + Style.RESET_ALL)
             self.select_model()
 
-    def select_model(self):
+    def select_model(self, refresh=False):
+        # Lista da /api/tags (cache su disco): non serve la CLI di ollama né attendere il server
+        client = create_client(self)
         try:
-            result = subprocess.run(["ollama", "list"], capture_output=True, text=True)
-            lines = result.stdout.strip().splitlines()[1:]
-            models = [line.split()[0] for line in lines]
+            models = list_model_names(client, self.models_cache_ttl, refresh=refresh)
             if not models:
                 print(Fore.RED + "No models found." + Style.RESET_ALL)
                 return
 
-            idx = menu_loop(models)
+            options = models + ["Refresh list"]
+            idx = menu_loop(options)
             if idx == -1:
                 print(Fore.YELLOW + "Model selection cancelled." + Style.RESET_ALL)
                 return
+            if idx == len(models):
+                client.close()
+                return self.select_model(refresh=True)
 
             self.selected_model = models[idx]
             print(Fore.GREEN + f"Selected model: {self.selected_model}" + Style.RESET_ALL)
             self.save_settings()
+            # Il modello si carica mentre si torna al menu: la prima domanda non attende
+            preload_model(self, self.selected_model)
 
         except Exception as e:
             print(Fore.RED + f"Error listing models: {e}" + Style.RESET_ALL)
+        finally:
+            client.close()
 
     def select_emoji(self):
         options = ["Enable Emoji", "Disable Emoji", "Back"]
@@ -100,6 +153,21 @@ class Settings:
             elif choice == 2 or choice == -1:
                 break
     
+    def select_stream_output(self):
+        options = ["Enable Streaming", "Disable Streaming", "Back"]
+        while True:
+            choice = menu_loop(options)
+            if choice == 0:
+                self.stream_output = True
+                self.save_settings()
+                print(Fore.GREEN + "Streaming enabled." + Style.RESET_ALL)
+            elif choice == 1:
+                self.stream_output = False
+                self.save_settings()
+                print(Fore.GREEN + "Streaming disabled." + Style.RESET_ALL)
+            elif choice == 2 or choice == -1:
+                break
+
     def interact_with_computer(self):
         options = [
             "Feature Coming Soon!",
@@ -115,19 +183,21 @@ class Settings:
             choice = menu_loop(self.SETTINGS_MENU_OPTIONS)
             if choice == 0:
                 self.select_mode()
-                self.save_settings()
             elif choice == 1:
                 self.select_dialog_type()
-                self.save_settings()
             elif choice == 2:
                 self.interact_with_computer()
             elif choice == 3:
                 self.select_emoji()
             elif choice == 4:
-                self.select_model()
+                self.select_stream_output()
             elif choice == 5:
+                self.select_model()
+            elif choice == 6:
                 self.save_preset()
-            elif choice == 6 or choice == -1:
+            elif choice == 7:
+                self.select_preset()
+            elif choice == 8 or choice == -1:
                 break
 
     def select_mode(self):
@@ -197,21 +267,50 @@ class Settings:
                 return f"{prefix}Your task is: {user_input}"
             return f"{prefix}{user_input}"
     
-    def save_preset(self):
-        i = 1
-        while True:
-            path = os.path.join(SETTINGS_DIR, f"settings_preset{i}.json")
-            if not os.path.exists(path):
-                break
-            i += 1
-
-        data = {
-            "default_mode": self.default_mode,
-            "dialog_type": self.dialog_type,
-            "allow_system_interaction": self.allow_system_interaction,
-            "use_emoji": self.use_emoji,
-            "selected_model": self.selected_model
-        }
-        with open(path, "w") as f:
-            json.dump(data, f, indent=2)
+    def save_preset(self, name=None):
+        """Salva le impostazioni correnti (options comprese) come profilo con nome."""
+        if name is None:
+            name = input("Preset name (empty = automatic): ").strip()
+        existing = find_preset(name) if name else None
+        path = existing["path"] if existing else next_preset_path()
+        if not name:
+            name = os.path.splitext(os.path.basename(path))[0].replace("settings_", "")
+
+        self.profile = name
+        data = self.to_dict()
+        data["name"] = name
+        CONFIG_STORE.set(path, data)
+        CONFIG_STORE.flush(path)
+        self.save_settings()
         print(Fore.GREEN + f"Settings saved to {path}" + Style.RESET_ALL)
+
+    def load_preset(self, name) -> bool:
+        preset = find_preset(name)
+        if preset is None:
+            print(Fore.RED + f"Preset '{name}' not found." + Style.RESET_ALL)
+            return False
+        data = preset["data"]
+        for key in self.SETTINGS_KEYS:
+            if key in data:
+                setattr(self, key, data[key])
+        self.profile = preset["name"]
+        self.save_settings()
+        print(Fore.GREEN + f"Preset '{preset['name']}' loaded." + Style.RESET_ALL)
+        return True
+
+    def select_preset(self):
+        presets = list_presets()
+        if not presets:
+            print(Fore.YELLOW + "No presets saved." + Style.RESET_ALL)
+            return
+        labels = []
+        for preset in presets:
+            model = preset["data"].get("selected_model") or self.selected_model
+            stats = PROFILE_STATS.summary(preset["name"], model)
+            speed = f"{stats['tokens_per_s']:.1f} tok/s" if stats else "not measured"
+            labels.append(f"{preset['name']} ({model}, {speed})")
+        labels.append("Back")
+        idx = menu_loop(labels)
+        if idx == -1 or idx == len(presets):
+            return
+        self.load_preset(presets[idx]["name"])
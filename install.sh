@@ -183,7 +183,7 @@ main() {
     echo
     echo "Notes:"
     echo "- datetime, json, subprocess, importlib, typing are built-in modules"
-    echo "- msvcrt is Windows-specific (not available on Linux)"
+    echo "- Menu keys use termios on Linux/macOS and msvcrt on Windows (both built-in)"
     echo "- To start Ollama: ollama serve"
     echo "- To use the model: ollama run deepseek-r1:1.5b"
     echo
@@ -1,85 +1,422 @@
-import requests
+import time
+IMPORT_STARTED = time.perf_counter()  # per --profile-startup
 import os
-import re
-from datetime import datetime
+import sys
+import json
+import argparse
+import importlib.util
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from colorama import init, Fore, Style
 from files.menu import menu_loop, MENU_OPTIONS
-from files.settings import Settings, CHAT_DIR
+from files.settings import Settings
+from files.backend import BackendPool, ModelPreloader, client_config, create_client, list_model_names
+from files.context import ContextBudget, format_turns
+from files.cache import ResponseCache
+from files.metrics import MetricsTracker
+from files.filters import build_output_pipeline
+from files.journal import ChatJournal, compress_old_chats, list_chats, find_chat, chat_path, load_recent_turns
+from files.search import get_search_index
+from files.profiles import PROFILE_STATS, list_presets, load_options, parse_options
+from files.memory import RetrievalMemory, RECALL_HEADER, MEMORY_AVAILABLE
+from files.scheduler import SCHEDULER, TaskCancelled
 from files import addons
 from files.addons import (
         load_addons, apply_agent_modifiers,
         print_info, print_warning, print_error,
-        show_addons_menu
+        show_addons_menu, handle_custom_command, get_registered_commands,
+        run_user_input_hooks, run_model_output_hooks, run_model_output_stream_hooks,
+        set_hook_budget, get_hook_stats, reset_hook_stats, ADDON_MANAGER,
+        OUTPUT_FILTERS, MODEL_OUTPUT_HOOKS
     )
-
+IMPORT_FINISHED = time.perf_counter()
 
 init(autoreset=True)  # colorama
 
-def remove_emojis(text):
-    emoji_pattern = re.compile(
-        "["
-        u"\U0001F600-\U0001F64F"  # emoticon
-        u"\U0001F300-\U0001F5FF"  # simboli
-        u"\U0001F680-\U0001F6FF"  # trasporti
-        u"\U0001F1E0-\U0001F1FF"  # bandiere
-        u"\U00002700-\U000027BF"
-        u"\U0001F900-\U0001F9FF"
-        u"\U0001FA70-\U0001FAFF"
-        "]+", flags=re.UNICODE
-    )
-    return emoji_pattern.sub(r'', text)
-
 class LlamaAgent:
-    def __init__(self, persistent=False, settings=None):
+    def __init__(self, persistent=False, settings=None, client=None, journal=True):
         self.settings = settings or Settings()
         self.model = self.settings.selected_model or "llama3"
         self.persistent = persistent
+        self.stream = self.settings.stream_output
+        # Client condiviso tra più agenti (modalità server), altrimenti uno per agente
+        self.owns_client = client is None
+        self.client = client or create_client(self.settings)
+        self.client_config = client_config(self.settings)
+        self.preloader = ModelPreloader(self.client, self.settings)
         self.history = []
+        # Ultima risposta come registrata in cronologia (filtri e hook compresi)
+        self.last_response = ""
+        # Stato della conversazione incrementale (solo modalità persistente):
+        # - context: array restituito da Ollama, permette al server di riusare la KV cache
+        # - history_prefix: trascrizione già formattata, cresce solo in coda
+        self.context = None
+        self.context_model = None
+        self.history_prefix = ""
+        # Messaggio di sistema dei client (modalità server): va a Ollama nel campo "system",
+        # così resta valido anche dopo un riassunto o con il context riusato
+        self.system = ""
+        self.budget = ContextBudget.from_settings(self.client, self.settings)
+        self.cache = ResponseCache.from_settings(self.settings)
+        self.metrics = MetricsTracker.from_settings(self.settings)
+        # Journal su disco, una riga per turno (solo chat persistenti; journal=False: cronologia solo in memoria)
+        self.journal = self.new_journal() if persistent and journal else None
+        # Memoria a lungo termine (memory_enabled, richiede numpy): None se disattivata
+        self.memory = RetrievalMemory.from_settings(self.client, self.settings) if self.journal else None
+        # Generazioni in corso (files/scheduler.py): cancel() le interrompe tutte
+        self.tasks = set()
+        self._tasks_lock = threading.Lock()
+        # True se l'ultima risposta è stata interrotta (Ctrl-C, /stop): in cronologia resta la parte ricevuta
+        self.interrupted = False
 
-    def ask(self, user_input: str):
+    def new_journal(self):
+        return ChatJournal(self.model, fsync=self.settings.journal_fsync, search_index=get_search_index())
+
+    def clear_history(self):
+        self.history.clear()
+        self.context = None
+        self.context_model = None
+        self.history_prefix = ""
+        self.budget.reset()
+        if self.journal is not None and self.journal.turns:
+            # Dopo /clear si scrive in un journal nuovo: /load non deve riportare i turni cancellati
+            self.journal.close()
+            self.journal = self.new_journal()
+
+    def _build_payload(self, user_input: str, stream: bool):
         prompt = self.settings.format_prompt(user_input)
-        url = "http://localhost:11434/api/generate"
         payload = {
             "model": self.model,
             "prompt": prompt,
-            "stream": False
+            "stream": stream
         }
+        if self.settings.options:
+            # Opzioni del profilo attivo (num_ctx, num_predict, ...): fanno parte anche della chiave di cache
+            payload["options"] = dict(self.settings.options)
+        if self.system:
+            payload["system"] = self.system
 
         if self.persistent:
-            history_text = "\n".join(
-                f"User: {h['user']}\nAssistant: {h['llm']}" for h in self.history
-            )
-            payload["prompt"] = f"{history_text}\nUser: {prompt}\nAssistant:"
+            # Riassunto pronto dal thread di compattazione: si riparte dal prefisso ridotto
+            compacted = self.budget.apply_pending(self.history)
+            if compacted is not None:
+                self.history_prefix = compacted
+                self.context = None
 
-        response = requests.post(url, json=payload)
-        if response.status_code == 200:
-            result = response.json()["response"].strip()
+            if self.memory is not None:
+                payload["prompt"] = self._memory_prompt(prompt)
+            elif self.settings.reuse_context and self.context and self.context_model == self.model:
+                # Il server ha già i turni precedenti: si invia solo il nuovo
+                payload["context"] = self.context
+            else:
+                payload["prompt"] = f"{self.history_prefix}\nUser: {prompt}\nAssistant:"
 
-            # Rimuovi le emoji se disabilitate dalle impostazioni
-            if not self.settings.use_emoji:
-                result = remove_emojis(result)
+        return payload
 
-            if self.persistent:
-                self.history.append({"user": user_input, "llm": result})
+    def _memory_prompt(self, prompt: str) -> str:
+        """
+        Prompt a dimensione limitata: i turni passati più simili (da questa e dalle
+        altre chat) più gli ultimi history_window turni.
+        """
+        recent = self.history[-self.settings.history_window:]
+        after = self.journal.turns - len(recent)
+        parts = []
+        # Finché il journal è vuoto l'id non è definitivo (suffisso se il file esiste già)
+        chat_id = self.journal.chat_id if self.journal.turns else None
+        recalled = self.memory.recall(prompt, chat_id, after)
+        if recalled:
+            parts.append(f"{RECALL_HEADER}\n{format_turns(recalled)}\n")
+        if recent:
+            parts.append(format_turns(recent))
+        parts.append(f"User: {prompt}\nAssistant:")
+        return "\n".join(parts)
 
-            return result
+    def _record_turn(self, user_input: str, result: str, data: dict):
+        if not self.persistent:
+            return
+        self.history.append({"user": user_input, "llm": result})
+        if self.journal is not None:
+            try:
+                self.journal.append(user_input, result, self.model)
+            except OSError as e:
+                print(f"Error saving chat: {e}")
+        if self.history_prefix:
+            self.history_prefix += "\n"
+        self.history_prefix += f"User: {user_input}\nAssistant: {result}"
+        self.context = data.get("context")
+        self.context_model = self.model
+
+        if self.memory is not None:
+            # Embedding in background; il prompt non dipende dalla lunghezza della chat
+            self.memory.add_turn(self.journal.chat_id, self.journal.turns, user_input, result)
+            return
+        self.budget.update(data)
+        self.budget.maybe_compact(self.model, self.history, self.settings.options)
+
+    def resume_chat(self, entry: dict) -> int:
+        """
+        Riprende una chat salvata: carica solo gli ultimi turni che stanno nel budget
+        di contesto (il file non viene letto per intero) e continua il suo journal.
+        Restituisce il numero di turni caricati.
+        """
+        turns = load_recent_turns(chat_path(entry), self.budget.char_budget())
+        self.clear_history()
+        self.history.extend({"user": t.get("user", ""), "llm": t.get("llm", "")} for t in turns)
+        self.history_prefix = self.budget.build_prefix(self.history)
+
+        if self.journal is not None:
+            self.journal.close()
+        if not self.persistent:
+            self.persistent = True
+            self.memory = RetrievalMemory.from_settings(self.client, self.settings)
+        self.journal = self.new_journal()
+        # Journal compressi o vecchi .json: i nuovi turni vanno in un file nuovo
+        self.journal.resume(entry)
+
+        if self.history_prefix:
+            # Carica il modello e valuta la cronologia con la stessa richiesta
+            threading.Thread(target=self._warm_up, args=(self.model, self.history_prefix), daemon=True).start()
         else:
-            raise Exception(f"Request failed: {response.text}")
+            self.preloader.preload(self.model)
+        return len(turns)
+
+    def _start_task(self, name: str):
+        task = SCHEDULER.new_task(name)
+        with self._tasks_lock:
+            self.tasks.add(task)
+        return task
+
+    def _finish_task(self, task):
+        with self._tasks_lock:
+            self.tasks.discard(task)
+
+    def cancel(self) -> int:
+        """Interrompe le generazioni in corso (risposta e lavoro in background); restituisce quante."""
+        with self._tasks_lock:
+            tasks = list(self.tasks)
+        for task in tasks:
+            task.cancel()
+        return len(tasks)
+
+    def _warm_up(self, model: str, prefix: str):
+        """
+        Fa valutare la cronologia al server in background (un solo token generato):
+        al primo turno il prefisso è già nella KV cache e la risposta parte subito.
+        """
+        with SCHEDULER.background():
+            task = self._start_task("warm-up")
+        try:
+            data = self.client.generate({
+                "model": model,
+                "prompt": prefix,
+                "stream": False,
+                # Opzioni di caricamento del profilo: con valori diversi Ollama ricaricherebbe il modello
+                "options": {**load_options(self.settings.options), "num_predict": 1}
+            }, task)
+        except Exception:
+            return
+        finally:
+            self._finish_task(task)
+        if model == self.model and not self.budget.used_tokens:
+            self.budget.update({"prompt_eval_count": data.get("prompt_eval_count", 0)})
+
+    def _record_metrics(self, data: dict, elapsed: float, ttfb: float, cached: bool):
+        turn = self.metrics.record(self.model, data, elapsed, ttfb, cached=cached)
+        PROFILE_STATS.record(self.settings.profile, self.model, turn)
+
+    def apply_settings(self):
+        """Dopo un cambio di profilo: modello, streaming e server possono essere cambiati."""
+        self.stream = self.settings.stream_output
+        model = self.settings.selected_model or self.model
+        config = client_config(self.settings)
+        if self.owns_client and config != self.client_config:
+            self._replace_client(config)
+        elif model != self.model:
+            self.preloader.preload(model)
+        self.model = model
+
+    def _replace_client(self, config: dict):
+        """Nuovo client per i nuovi server o timeout: chi lo usa (budget, memoria) passa al nuovo."""
+        old = self.client
+        self.client = create_client(self.settings)
+        self.client_config = config
+        self.preloader = ModelPreloader(self.client, self.settings)
+        self.budget.client = self.client
+        if self.memory is not None:
+            self.memory.client = self.client
+        # Il context appartiene al server precedente
+        self.context = None
+        old.close()
+        self.preloader.preload(self.settings.selected_model or self.model)
+
+    def _cache_key(self, payload: dict):
+        # In modalità persistente la risposta dipende dalla cronologia: niente cache
+        if not self.settings.use_cache or self.persistent:
+            return None
+        return ResponseCache.make_key(payload["model"], payload["prompt"], payload.get("options"))
+
+    def ask(self, user_input: str):
+        if self.stream:
+            for _chunk in self.ask_stream(user_input):
+                pass
+            # Il testo registrato (hook compresi), uguale a quello della modalità senza streaming
+            return self.last_response
+
+        payload = self._build_payload(run_user_input_hooks(self, user_input), stream=False)
+        key = self._cache_key(payload)
+        start = time.perf_counter()
+        cached = self.cache.get(key) if key else None
+        if cached is not None:
+            data = {"response": cached}
+        else:
+            task = self._start_task("chat")
+            self.interrupted = False
+            try:
+                data = self.client.generate(payload, task)
+            except (KeyboardInterrupt, TaskCancelled):
+                # Senza streaming non c'è una risposta parziale da tenere
+                self.interrupted = True
+                raise TaskCancelled("Request cancelled: chat")
+            finally:
+                self._finish_task(task)
+            if key:
+                self.cache.put(key, data["response"], self.model)
+        # Senza streaming Ollama invia tutto alla fine: il primo byte coincide con il totale
+        elapsed = time.perf_counter() - start
+        self._record_metrics(data, elapsed, elapsed, cached is not None)
+        result = data["response"].strip()
+
+        # Emoji (se disabilitate dalle impostazioni) e filtri degli addon
+        result = self.output_pipeline().apply(result)
+        result = self.last_response = run_model_output_hooks(self, result)
+
+        self._record_turn(user_input, result, data)
+        return result
+
+    def output_pipeline(self):
+        """Nuova pipeline di filtri per una risposta (emoji + filtri degli addon)."""
+        return build_output_pipeline(self.settings, OUTPUT_FILTERS)
+
+    def ask_stream(self, user_input: str):
+        """
+        Come ask(), ma restituisce un generatore che produce i pezzi di testo
+        man mano che Ollama li invia (NDJSON). La risposta completa viene
+        comunque salvata in history alla fine dello stream.
+        """
+        payload = self._build_payload(run_user_input_hooks(self, user_input), stream=True)
+        key = self._cache_key(payload)
+        start = time.perf_counter()
+        ttfb = None
+        task = None
+        cached = self.cache.get(key) if key else None
+        if cached is not None:
+            # Hit: nessuna richiesta di rete, la risposta arriva come unico chunk
+            source = iter([{"response": cached, "done": True}])
+        else:
+            task = self._start_task("chat")
+            source = self.client.generate_stream(payload, task)
+
+        pipeline = self.output_pipeline()
+        parts = []
+        raw = []
+        last = {}
+        self.interrupted = False
+        # Gli hook sul testo completo possono riscrivere tutta la risposta (es. f"AI: {text}"):
+        # con almeno uno registrato la risposta si mostra a stream finito, nella loro versione,
+        # così chi legge vede lo stesso testo che va in cronologia
+        hold = bool(MODEL_OUTPUT_HOOKS)
+        try:
+            for data in source:
+                if ttfb is None:
+                    ttfb = time.perf_counter() - start
+                last = data
+                chunk = data.get("response", "")
+                raw.append(chunk)
+                # Come la strip() della modalità non-stream: niente spazi iniziali
+                if not parts:
+                    chunk = chunk.lstrip()
+
+                # Filtri applicati sul singolo pezzo, non sulla risposta finale
+                if chunk:
+                    chunk = pipeline.feed(chunk)
+                if chunk:
+                    chunk = run_model_output_stream_hooks(self, chunk)
+
+                if chunk:
+                    parts.append(chunk)
+                    if not hold:
+                        yield chunk
+        except (KeyboardInterrupt, TaskCancelled):
+            # Ctrl-C durante la lettura o /stop: la connessione è già chiusa, la chat continua
+            self._keep_partial(user_input, parts, source, task)
+            return
+        except GeneratorExit:
+            # Il chiamante ha smesso di leggere (Ctrl-C durante la stampa, client HTTP disconnesso)
+            self._keep_partial(user_input, parts, source, task)
+            raise
+        finally:
+            if task is not None:
+                self._finish_task(task)
+
+        # Quello che i filtri tenevano in attesa di un eventuale seguito
+        tail = pipeline.flush()
+        if tail:
+            tail = run_model_output_stream_hooks(self, tail)
+        if tail:
+            parts.append(tail)
+
+        result = "".join(parts).strip()
+        if hold:
+            result = run_model_output_hooks(self, result)
+        self.last_response = result
+        elapsed = time.perf_counter() - start
+
+        try:
+            if hold:
+                if result:
+                    yield result
+            elif tail:
+                yield tail
+        finally:
+            # Il modello ha finito: il turno si registra anche se il chiamante chiude il generatore qui
+            if key and cached is None:
+                self.cache.put(key, "".join(raw), self.model)
+            self._record_metrics(last, elapsed, ttfb or elapsed, cached is not None)
+            self._record_turn(user_input, result, last)
+
+    def _keep_partial(self, user_input: str, parts: list, source, task):
+        """Risposta interrotta: si chiude la connessione e la parte già ricevuta entra in cronologia."""
+        self.interrupted = True
+        if task is not None:
+            task.cancel()
+        if hasattr(source, "close"):
+            source.close()
+        result = self.last_response = "".join(parts).strip()
+        if result:
+            # Niente context di Ollama per una risposta troncata: il turno dopo riparte dalla trascrizione.
+            # Senza contatori finali il budget resta alla stima precedente
+            self._record_turn(user_input, result, {"prompt_eval_count": self.budget.used_tokens})
     
     def save_chat(self):
-        timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-        path = os.path.join(CHAT_DIR, f"chat_{timestamp}.json")
+        """
+        I turni sono già su disco (journal): qui si chiude il file e si
+        comprimono le chat più vecchie di chat_compress_days.
+        """
+        if self.journal is None:
+            return
+        if self.memory is not None:
+            self.memory.close()
         try:
-            import json
-            with open(path, "w", encoding="utf-8") as f:
-                json.dump(self.history, f, indent=2, ensure_ascii=False)
-            print(f"\nChat saved in: {path}")
+            path = self.journal.close()
+            if path:
+                print(f"\nChat saved in: {path}")
+            compress_old_chats(self.settings.chat_compress_days)
         except Exception as e:
             print(f"Error saving chat: {e}")
 
-def list_installed_models():
+def list_installed_models(client):
     try:
-        response = requests.get("http://localhost:11434/api/tags")
+        response = client.get("/api/tags")
         if response.status_code == 200:
             models = response.json().get("models", [])
             if not models:
@@ -106,11 +443,268 @@ def list_installed_models():
         print("Ollama not reachable:", e)
         input("Premi Invio per continuare...")
 
-def chat_loop(persistent, settings):
+def show_cache(agent, args):
+    if args == "clear":
+        agent.cache.clear()
+        print(Fore.YELLOW + "Cache cleared." + Style.RESET_ALL)
+        return
+
+    stats = agent.cache.stats()
+    state = "enabled" if agent.settings.use_cache else "disabled"
+    print(Fore.MAGENTA + f"Response cache ({state}):\n"
+          f"  hits: {stats['hits']}  misses: {stats['misses']}\n"
+          f"  memory entries: {stats['memory_entries']}/{agent.cache.max_entries}\n"
+          f"  disk entries: {stats['disk_entries']} ({stats['disk_bytes'] / 1024:.1f} KB)" + Style.RESET_ALL)
+
+def ask_model(agent, model, prompt, task=None):
+    """Una singola generazione senza cronologia, usata dal confronto tra modelli."""
+    start = time.perf_counter()
+    payload = {"model": model, "prompt": prompt}
+    if agent.settings.options:
+        payload["options"] = dict(agent.settings.options)
+    data = agent.client.generate(payload, task=task)
+    result = agent.output_pipeline().apply(data["response"].strip())
+    return result, time.perf_counter() - start
+
+def compare_models(agent, user_input, models=None):
+    """
+    Invia lo stesso prompt a più modelli in parallelo e stampa ogni risposta
+    appena arriva: il tempo totale è quello del modello più lento. Lo scheduler
+    manda a ogni server al massimo max_concurrent_requests richieste insieme:
+    oltre quel numero i modelli in più aspettano un posto libero.
+    Le richieste sono generazioni dell'agente: Ctrl-C e cancel() le interrompono.
+    """
+    if models is None:
+        models = [m["name"] for m in agent.client.tags()]
+        if agent.settings.compare_models:
+            models = [m for m in models if m in agent.settings.compare_models]
+    if not models:
+        print(Fore.RED + "No installed models found." + Style.RESET_ALL)
+        return {}
+
+    prompt = agent.settings.format_prompt(user_input)
+    results = {}
+    start = time.perf_counter()
+    limit = agent.settings.max_concurrent_requests
+    note = f", {limit} at a time per server" if 0 < limit < len(models) else ""
+    print(Fore.CYAN + f"Asking {len(models)} models{note}..." + Style.RESET_ALL)
+    tasks = {model: agent._start_task(f"compare {model}") for model in models}
+    pool = ThreadPoolExecutor(max_workers=len(models))
+    try:
+        futures = {pool.submit(ask_model, agent, model, prompt, tasks[model]): model for model in models}
+        for future in as_completed(futures):
+            model = futures[future]
+            try:
+                answer, elapsed = future.result()
+            except TaskCancelled:
+                print(Fore.YELLOW + f"[{model}] Interrotto" + Style.RESET_ALL)
+                continue
+            except Exception as e:
+                print(Fore.RED + f"[{model}] Errore: {e}" + Style.RESET_ALL)
+                continue
+            results[model] = (answer, elapsed)
+            print(Fore.GREEN + f"[{model}] {elapsed:.2f}s" + Style.RESET_ALL)
+            print(answer + "\n")
+    except KeyboardInterrupt:
+        # Senza cancel() la chiusura del pool aspetterebbe tutti i modelli
+        for task in tasks.values():
+            task.cancel()
+        raise
+    finally:
+        pool.shutdown(wait=True)
+        for task in tasks.values():
+            agent._finish_task(task)
+    print(Fore.CYAN + f"Done in {time.perf_counter() - start:.2f}s" + Style.RESET_ALL)
+    return results
+
+def show_stats(agent):
+    def line(label, stats):
+        return (f"{label}: {stats['turns']} turns ({stats['cached']} cached), "
+                f"{stats['tokens_per_s']:.1f} tok/s, prompt {stats['prompt_tokens_per_s']:.1f} tok/s\n"
+                f"    latency p50 {stats['p50_latency']:.2f}s  p95 {stats['p95_latency']:.2f}s  "
+                f"first byte p50 {stats['p50_ttfb']:.2f}s  model load {stats['load_fraction'] * 100:.0f}%")
+
+    session = agent.metrics.summary()
+    if not session["turns"]:
+        print(Fore.YELLOW + "No statistics yet." + Style.RESET_ALL)
+        return
+
+    output = [line("Session", session)]
+    for model in agent.metrics.models():
+        output.append(line(f"  {model}", agent.metrics.summary(model)))
+    if agent.metrics.export_path:
+        output.append(f"Exported to: {agent.metrics.export_path}")
+    print(Fore.MAGENTA + "\n".join(output) + Style.RESET_ALL)
+
+def show_hooks(args):
+    if args == "reset":
+        reset_hook_stats()
+        print(Fore.YELLOW + "Hook statistics reset, disabled hooks enabled again." + Style.RESET_ALL)
+        return
+
+    stats = get_hook_stats()
+    if not stats:
+        print(Fore.YELLOW + "No hooks have run yet." + Style.RESET_ALL)
+        return
+    lines = ["Hooks (slowest first):"]
+    for s in stats:
+        avg = s["total_ms"] / s["calls"] if s["calls"] else 0.0
+        state = " [DISABLED]" if s["disabled"] else ""
+        lines.append(f"  {s['kind']:<17}{s['name']}: {s['calls']} calls, total {s['total_ms']:.1f} ms, "
+                     f"avg {avg:.2f} ms, max {s['max_ms']:.1f} ms{state}")
+    print(Fore.MAGENTA + "\n".join(lines) + Style.RESET_ALL)
+
+def choose_chat():
+    """Menu delle chat salvate (dall'indice, senza aprire i file). None se si torna indietro."""
+    chats = list_chats()
+    if not chats:
+        print(Fore.YELLOW + "Nessuna chat salvata." + Style.RESET_ALL)
+        return None
+    labels = [
+        f"{time.strftime('%Y-%m-%d %H:%M', time.localtime(c.get('started', 0)))}  "
+        f"{c.get('title') or c['id']} ({c.get('turns', 0)} turns)"
+        for c in chats
+    ] + ["Back"]
+    choice = menu_loop(labels)
+    if choice == -1 or choice == len(labels) - 1:
+        return None
+    return chats[choice]
+
+def resume_chat(agent, query=""):
+    entry = find_chat(query) if query else choose_chat()
+    if entry is None:
+        if query:
+            print(Fore.YELLOW + f"Nessuna chat trovata per '{query}'." + Style.RESET_ALL)
+        return
+    try:
+        loaded = agent.resume_chat(entry)
+    except (OSError, ValueError) as e:
+        print(Fore.RED + f"Errore nel caricare la chat: {e}" + Style.RESET_ALL)
+        return
+    skipped = entry.get("turns", loaded) - loaded
+    note = f" ({skipped} older turns not loaded)" if skipped > 0 else ""
+    print(Fore.GREEN + f"Resumed {entry['id']}: {loaded} turns{note}." + Style.RESET_ALL)
+    for turn in agent.history[-2:]:
+        print(Fore.CYAN + f"User: {turn['user']}" + Style.RESET_ALL)
+        print(f"Assistant: {turn['llm']}")
+
+def search_chats(query):
+    if not query:
+        print(Fore.YELLOW + "Uso: /search <parole>" + Style.RESET_ALL)
+        return
+    index = get_search_index()
+    start = time.perf_counter()
+    try:
+        results = index.search(query, mark=(Fore.YELLOW, Style.RESET_ALL))
+    except Exception as e:
+        print(Fore.RED + f"Errore: {e}" + Style.RESET_ALL)
+        return
+    elapsed = (time.perf_counter() - start) * 1000
+    if index.indexing():
+        print(Fore.YELLOW + "Indicizzazione delle chat in corso: risultati parziali." + Style.RESET_ALL)
+    if not results:
+        print(Fore.YELLOW + f"Nessun risultato ({elapsed:.1f} ms)." + Style.RESET_ALL)
+        return
+    print(Fore.MAGENTA + f"{len(results)} risultati in {elapsed:.1f} ms (riprendi con /load <id>):" + Style.RESET_ALL)
+    for r in results:
+        snippet = " ".join(r["snippet"].split())
+        print(Fore.CYAN + f"{r['chat_id']} #{r['turn']}" + Style.RESET_ALL + f"  {snippet}")
+
+def show_profiles(agent):
+    settings = agent.settings
+    options = ", ".join(f"{k}={v}" for k, v in settings.options.items()) or "Ollama defaults"
+    lines = [f"Active profile: {settings.profile} ({options})", f"Measured speed on {agent.model}:"]
+    names = [settings.profile] + [p["name"] for p in list_presets() if p["name"] != settings.profile]
+    for name in names:
+        stats = PROFILE_STATS.summary(name, agent.model)
+        if stats:
+            lines.append(f"  {name:<16}{stats['tokens_per_s']:8.1f} tok/s  prompt {stats['prompt_tokens_per_s']:.1f} tok/s  "
+                         f"load {stats['load_seconds']:.2f}s  ({stats['turns']} turns)")
+        else:
+            lines.append(f"  {name:<16}  not measured")
+    print(Fore.MAGENTA + "\n".join(lines) + Style.RESET_ALL)
+
+def profile_command(agent, args):
+    """
+    /profile                      elenco profili con i token/s misurati
+    /profile <nome>               carica un profilo
+    /profile save <nome>          salva le impostazioni correnti come profilo
+    /profile set num_ctx=8192 ... cambia le opzioni di Ollama (`chiave=` la rimuove)
+    """
+    settings = agent.settings
+    command, _, rest = args.partition(" ")
+    rest = rest.strip()
+    if not command:
+        show_profiles(agent)
+    elif command == "save":
+        if not rest:
+            print(Fore.YELLOW + "Uso: /profile save <nome>" + Style.RESET_ALL)
+            return
+        settings.save_preset(rest)
+    elif command == "set":
+        try:
+            changes = parse_options(rest)
+        except ValueError as e:
+            print(Fore.RED + f"Errore: {e}" + Style.RESET_ALL)
+            return
+        options = dict(settings.options)
+        for key, value in changes.items():
+            if value is None:
+                options.pop(key, None)
+            else:
+                options[key] = value
+        settings.options = options
+        # Opzioni modificate a mano: i token/s non vanno attribuiti al profilo salvato
+        settings.profile = "custom"
+        settings.save_settings()
+        show_profiles(agent)
+    elif settings.load_preset(args):
+        agent.apply_settings()
+
+MODEL_STATUS_MARKS = {
+    "resident": Fore.GREEN + "●" + Style.RESET_ALL,
+    "loading": Fore.YELLOW + "◐" + Style.RESET_ALL,
+    "not loaded": Fore.RED + "○" + Style.RESET_ALL,
+    "unknown": Style.DIM + "?" + Style.RESET_ALL,
+}
+
+def show_model_status(agent):
+    status = agent.preloader.status(agent.model)
+    info = agent.preloader.info(agent.model)
+    lines = [f"{MODEL_STATUS_MARKS[status]} {agent.model}: {status} (keep_alive: {agent.settings.keep_alive})"]
+    if info.get("size_vram") is not None:
+        lines.append(f"  VRAM: {info['size_vram'] / 2**20:.0f} MiB")
+    if info.get("expires_at"):
+        lines.append(f"  unload at: {info['expires_at']}")
+    for url, queue in SCHEDULER.stats().items():
+        lines.append(f"  {url}: {queue['running']} in corso, {queue['waiting']} in coda "
+                     f"({queue['waiting_background']} in background)")
+    print("\n".join(lines))
+
+def show_backends(agent):
+    if not isinstance(agent.client, BackendPool):
+        print(Fore.YELLOW + f"Un solo server: {agent.client.base_url} (vedi ollama_endpoints in settings.json)" + Style.RESET_ALL)
+        return
+    marks = {True: MODEL_STATUS_MARKS["resident"], False: MODEL_STATUS_MARKS["not loaded"], None: MODEL_STATUS_MARKS["unknown"]}
+    for row in agent.client.stats():
+        latency = f"{row['latency_ms']:.1f} ms" if row["latency_ms"] is not None else "-"
+        has_model = "?" if row["models"] is None else ("sì" if agent.model in row["models"] else "no")
+        print(f"{marks[row['healthy']]} {row['url']}  latency: {latency}  in flight: {row['in_flight']}  "
+              f"requests: {row['requests']}  failures: {row['failures']}  {agent.model}: {has_model}")
+        if row["healthy"] is False and row["last_error"]:
+            print(Style.DIM + f"  {row['last_error'][:120]}" + Style.RESET_ALL)
+
+def chat_loop(persistent, settings, resume=None):
     agent = LlamaAgent(persistent=persistent, settings=settings)
+    # Il modello si carica mentre l'utente scrive la prima domanda
+    agent.preloader.preload(agent.model)
+    # Apre l'indice di ricerca: se manca o è indietro si aggiorna in background
+    get_search_index()
+    set_hook_budget(settings.hook_budget_ms, settings.hook_max_overruns)
+    ADDON_MANAGER.configure_isolation(settings.addon_workers, settings.addon_call_timeout)
 
     # Carica e applica gli addon che modificano l'agente (in modo sicuro)
-    addons_list = load_addons()
+    addons_list = load_addons(parallel=settings.addons_parallel_load)
     for addon in addons_list:
         try:
             if hasattr(addon, "modify_agent") and callable(addon.modify_agent):
@@ -118,11 +712,18 @@ def chat_loop(persistent, settings):
         except Exception as e:
             print(Fore.RED + f"[Addon] Errore nell'applicare '{addon.__name__}': {e}" + Style.RESET_ALL)
 
+    if settings.memory_enabled and not MEMORY_AVAILABLE:
+        print_warning("memory_enabled richiede numpy (pip install numpy): memoria disattivata.")
+
+    if resume is not None:
+        resume_chat(agent, resume)
+
     multiline_mode = False
     buffer = []
 
     while True:
-        user_input = input(">>> ").strip()
+        # ● in memoria, ◐ caricamento, ○ scaricato (es. dopo keep_alive)
+        user_input = input(f"{MODEL_STATUS_MARKS[agent.preloader.status(agent.model)]} >>> ").strip()
 
         if user_input == "":
             continue
@@ -134,10 +735,10 @@ def chat_loop(persistent, settings):
             elif user_input == "/bye":
                 break
             elif user_input == "/clear":
-                agent.history.clear()
+                agent.clear_history()
                 print(Fore.YELLOW + "Session cleared." + Style.RESET_ALL)
             elif user_input == "/show":
-                list_installed_models()
+                list_installed_models(agent.client)
             elif user_input == "/multiline":
                 multiline_mode = True
                 print("Multiline mode ON. End input with /multiline-stop.")
@@ -146,6 +747,46 @@ def chat_loop(persistent, settings):
                 multiline_mode = False
                 user_input = "\n".join(buffer)
                 buffer = []
+            elif user_input.startswith("/compare"):
+                question = user_input[len("/compare"):].strip()
+                if not question:
+                    print(Fore.YELLOW + "Uso: /compare <domanda>" + Style.RESET_ALL)
+                    continue
+                try:
+                    compare_models(agent, question)
+                except (KeyboardInterrupt, TaskCancelled):
+                    print(Fore.YELLOW + "\n[Interrotto]" + Style.RESET_ALL)
+                except Exception as e:
+                    print(Fore.RED + f"Errore: {e}" + Style.RESET_ALL)
+                continue
+            elif user_input.startswith("/hooks"):
+                show_hooks(user_input[len("/hooks"):].strip())
+                continue
+            elif user_input == "/stats":
+                show_stats(agent)
+                continue
+            elif user_input.startswith("/profile"):
+                profile_command(agent, user_input[len("/profile"):].strip())
+                continue
+            elif user_input == "/status":
+                show_model_status(agent)
+                continue
+            elif user_input == "/backends":
+                show_backends(agent)
+                continue
+            elif user_input == "/stop":
+                stopped = agent.cancel()
+                print(Fore.YELLOW + f"Richieste interrotte: {stopped}" + Style.RESET_ALL)
+                continue
+            elif user_input.startswith("/search"):
+                search_chats(user_input[len("/search"):].strip())
+                continue
+            elif user_input.startswith("/load"):
+                resume_chat(agent, user_input[len("/load"):].strip())
+                continue
+            elif user_input.startswith("/cache"):
+                show_cache(agent, user_input[len("/cache"):].strip())
+                continue
             elif user_input in ("/?", "/help"):
                 print(Fore.MAGENTA + "Comandi disponibili:\n"
                       "/exit - Esce dalla chat\n"
@@ -153,10 +794,27 @@ def chat_loop(persistent, settings):
                       "/show - Mostra modelli installati\n"
                       "/multiline - Avvia modalità multilinea\n"
                       "/multiline-stop - Termina modalità multilinea\n"
+                      "/compare <domanda> - Chiede a tutti i modelli installati in parallelo\n"
+                      "/load [id|testo] - Riprende una chat salvata\n"
+                      "/search <parole> - Cerca nelle chat salvate\n"
+                      "/status - Stato del modello (in memoria o no)\n"
+                      "/backends - Stato dei server Ollama (con ollama_endpoints)\n"
+                      "/stop - Interrompe le richieste ancora in corso (Ctrl-C durante una risposta)\n"
+                      "/profile [nome|save <nome>|set num_ctx=...] - Profili di prestazioni\n"
+                      "/stats - Statistiche di velocità e latenza della sessione\n"
+                      "/cache [clear] - Statistiche o svuotamento della cache risposte\n"
+                      "/hooks [reset] - Tempi degli hook degli addon\n"
                       "/help - Mostra questo messaggio" + Style.RESET_ALL)
+                commands = get_registered_commands()
+                if commands:
+                    print(Fore.MAGENTA + "Comandi addon: " + ", ".join(commands) + Style.RESET_ALL)
                 continue
             else:
-                print(Fore.YELLOW + "Comando non implementato." + Style.RESET_ALL)
+                handled, output = handle_custom_command(agent, user_input, settings)
+                if not handled:
+                    print(Fore.YELLOW + "Comando non implementato." + Style.RESET_ALL)
+                elif output:
+                    print(output)
                 continue
 
         if multiline_mode:
@@ -164,22 +822,178 @@ def chat_loop(persistent, settings):
             continue
 
         try:
-            response = agent.ask(user_input)
-            print(Fore.GREEN + "Response:" + Style.RESET_ALL, response)
+            if agent.stream:
+                print(Fore.GREEN + "Response:" + Style.RESET_ALL, end=" ", flush=True)
+                stream = agent.ask_stream(user_input)
+                try:
+                    for chunk in stream:
+                        print(chunk, end="", flush=True)
+                except KeyboardInterrupt:
+                    # Ctrl-C arrivato durante la stampa: chiude lo stream e tiene la parte ricevuta
+                    stream.close()
+                print()
+                if agent.interrupted:
+                    print(Fore.YELLOW + "[Interrotto: la risposta parziale resta nella chat]" + Style.RESET_ALL)
+            else:
+                response = agent.ask(user_input)
+                print(Fore.GREEN + "Response:" + Style.RESET_ALL, response)
+        except (KeyboardInterrupt, TaskCancelled):
+            print(Fore.YELLOW + "\n[Interrotto]" + Style.RESET_ALL)
         except Exception as e:
             print(Fore.RED + f"Errore: {e}" + Style.RESET_ALL)
 
-    if persistent:
+    if agent.persistent:
         agent.save_chat()
 
+    agent.client.close()
+
+
+def read_batch_prompts(path):
+    """
+    Legge i prompt da un file JSONL (o da stdin se path == "-"), una riga alla volta.
+    Ogni riga: {"id": ..., "prompt": ...}; accetta anche "request_id" e "body".
+    """
+    f = sys.stdin if path == "-" else open(path, "r", encoding="utf-8")
+    try:
+        for n, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                item = json.loads(line)
+            except ValueError as e:
+                print_warning(f"[Batch] Riga {n} ignorata: {e}")
+                continue
+            if not isinstance(item, dict):
+                print_warning(f"[Batch] Riga {n} ignorata: non è un oggetto JSON")
+                continue
+            item_id = str(item.get("id", item.get("request_id", n)))
+            prompt = item.get("prompt", item.get("body"))
+            if not prompt:
+                print_warning(f"[Batch] Riga {n} senza prompt, ignorata.")
+                continue
+            yield item_id, prompt
+    finally:
+        if f is not sys.stdin:
+            f.close()
+
+def load_done_ids(path):
+    """Id già completati con successo in un file di output precedente (per la ripresa)."""
+    done = set()
+    if not os.path.exists(path):
+        return done
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                item = json.loads(line)
+            except ValueError:
+                continue  # riga troncata da un'interruzione
+            if isinstance(item, dict) and "error" not in item:
+                done.add(str(item.get("id")))
+    return done
+
+def run_batch(input_path, output_path, concurrency=4, settings=None):
+    """
+    Modalità headless: esegue i prompt con al massimo `concurrency` richieste in volo
+    e scrive i risultati in output_path (JSONL) nell'ordine in cui terminano.
+    Gli id già presenti nell'output vengono saltati.
+    """
+    settings = settings or Settings(interactive=False)
+    # Connessioni e posti nello scheduler per server bastano per `concurrency` richieste in volo,
+    # altrimenti il limite effettivo sarebbe il più basso dei due (solo per questa esecuzione)
+    if settings.pool_size < concurrency:
+        settings.pool_size = concurrency
+    if 0 < settings.max_concurrent_requests < concurrency:
+        print_info(f"[Batch] max_concurrent_requests portato da {settings.max_concurrent_requests} "
+                   f"a {concurrency} per questa esecuzione.")
+        settings.max_concurrent_requests = concurrency
+    agent = LlamaAgent(persistent=False, settings=settings)
+    agent.stream = False
+
+    done = load_done_ids(output_path)
+    if done:
+        print_info(f"[Batch] Ripresa: {len(done)} prompt già completati.")
+
+    write_lock = threading.Lock()
+    # Limita i prompt letti ma non ancora terminati: stdin può essere infinito
+    slots = threading.BoundedSemaphore(concurrency * 2)
+    counts = {"ok": 0, "error": 0}
+    start = time.perf_counter()
+
+    def work(item_id, prompt):
+        started = time.perf_counter()
+        record = {"id": item_id, "model": agent.model}
+        try:
+            record["response"] = agent.ask(prompt)
+        except Exception as e:
+            record["error"] = str(e)
+        record["elapsed"] = round(time.perf_counter() - started, 3)
+        with write_lock:
+            out.write(json.dumps(record, ensure_ascii=False) + "\n")
+            out.flush()
+            counts["error" if "error" in record else "ok"] += 1
+
+    with open(output_path, "a", encoding="utf-8") as out:
+        # Un'interruzione può aver lasciato l'ultima riga senza newline
+        if out.tell() > 0:
+            with open(output_path, "rb") as f:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b"\n":
+                    out.write("\n")
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            for item_id, prompt in read_batch_prompts(input_path):
+                if item_id in done:
+                    continue
+                done.add(item_id)
+                slots.acquire()
+                future = pool.submit(work, item_id, prompt)
+                future.add_done_callback(lambda _f: slots.release())
+
+    agent.client.close()
+    elapsed = time.perf_counter() - start
+    print_info(f"[Batch] {counts['ok']} ok, {counts['error']} errori in {elapsed:.1f}s -> {output_path}")
+    return counts
+
+def run_server(settings, host="127.0.0.1", port=None, concurrency=4, queue_size=16, verbose=False):
+    """
+    Modalità server (files/server.py): un agente per sessione, tutti sullo stesso
+    client Ollama, con addon e hook caricati una volta sola.
+    """
+    from files.server import AgentServer, DEFAULT_PORT
+
+    set_hook_budget(settings.hook_budget_ms, settings.hook_max_overruns)
+    ADDON_MANAGER.configure_isolation(settings.addon_workers, settings.addon_call_timeout)
+    addons_list = load_addons(parallel=settings.addons_parallel_load)
+    client = create_client(settings)
+    ModelPreloader(client, settings).preload(settings.selected_model)
+
+    def factory():
+        agent = LlamaAgent(persistent=True, settings=settings, client=client, journal=False)
+        for addon in addons_list:
+            try:
+                if hasattr(addon, "modify_agent") and callable(addon.modify_agent):
+                    addon.modify_agent(agent)
+            except Exception as e:
+                print_error(f"[Addon] Errore nell'applicare '{addon.__name__}': {e}")
+        return agent
+
+    server = AgentServer(settings, factory, client, host=host, port=port or DEFAULT_PORT,
+                         concurrency=concurrency, queue_size=queue_size, verbose=verbose)
+    print_info(f"[Server] {settings.selected_model} su {server.url} "
+               f"(concurrency {server.queue.concurrency}, coda {server.queue.max_waiting})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        client.close()
+        ADDON_MANAGER.shutdown()
 
 def main_menu():
+    # Settings() chiede già il modello se manca: una sola selezione all'avvio
     settings = Settings()
 
-    if not settings.selected_model:
-        print(Fore.YELLOW + "\nNo model selected. You must select one to continue." + Style.RESET_ALL)
-        settings.select_model()
-
     while True:
         choice = menu_loop(MENU_OPTIONS)
 
@@ -188,14 +1002,87 @@ def main_menu():
         elif choice == 1:
             chat_loop(persistent=True, settings=settings)
         elif choice == 2:
-            settings.show_menu()
+            entry = choose_chat()
+            if entry is not None:
+                chat_loop(persistent=True, settings=settings, resume=entry["id"])
         elif choice == 3:
-            show_addons_menu(load_addons())
-        elif choice == 4 or choice == -1:
+            settings.show_menu()
+        elif choice == 4:
+            show_addons_menu()
+        elif choice == 5 or choice == -1:
+            ADDON_MANAGER.shutdown()
             print("Exiting.")
             break
         else:
             print("Invalid option.")
 
+# Moduli caricati solo al primo utilizzo: il loro costo non pesa sull'avvio
+DEFERRED_IMPORTS = ("requests", "numpy", "sqlite3", "multiprocessing")
+
+def profile_startup():
+    """Tempi dell'avvio fino al menu principale, più il costo degli import rimandati."""
+    rows = [("import main.py", IMPORT_FINISHED - IMPORT_STARTED)]
+
+    def step(label, func):
+        start = time.perf_counter()
+        result = None
+        try:
+            result = func()
+        except Exception as e:
+            label += f" (error: {e})"
+        rows.append((label, time.perf_counter() - start))
+        return result
+
+    settings = step("Settings()", lambda: Settings(interactive=False))
+    client = step("create_client()", lambda: create_client(settings))
+    step("model list (/api/tags, cached)", lambda: list_model_names(client, settings.models_cache_ttl))
+    step("addon scan (manifest)", ADDON_MANAGER.scan)
+    total = sum(elapsed for _label, elapsed in rows)
+
+    deferred = []
+    for module in DEFERRED_IMPORTS:
+        if module in sys.modules or importlib.util.find_spec(module) is None:
+            continue
+        start = time.perf_counter()
+        importlib.import_module(module)
+        deferred.append((module, time.perf_counter() - start))
+    client.close()
+
+    lines = ["Startup:"]
+    lines += [f"  {label:<36}{elapsed * 1000:8.1f} ms" for label, elapsed in rows]
+    lines.append(f"  {'total':<36}{total * 1000:8.1f} ms")
+    if deferred:
+        lines.append("Deferred imports (paid on first use):")
+        lines += [f"  {module:<36}{elapsed * 1000:8.1f} ms" for module, elapsed in deferred]
+    print(Fore.MAGENTA + "\n".join(lines) + Style.RESET_ALL)
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="ModulaR LLM EMULATOR")
+    parser.add_argument("--batch", metavar="INPUT", help="Esegue i prompt di un file JSONL ('-' per stdin) senza menu")
+    parser.add_argument("--output", metavar="OUTPUT", default="batch_results.jsonl", help="File JSONL dei risultati")
+    parser.add_argument("--concurrency", type=int, default=4, help="Richieste contemporanee in modalità batch o server")
+    parser.add_argument("--model", help="Modello da usare al posto di quello nelle impostazioni")
+    parser.add_argument("--profile-startup", action="store_true", help="Mostra i tempi di import e inizializzazione ed esce")
+    parser.add_argument("--serve", action="store_true", help="Espone l'agente su HTTP (API OpenAI e Ollama)")
+    parser.add_argument("--host", default="127.0.0.1", help="Indirizzo della modalità server")
+    parser.add_argument("--port", type=int, help="Porta della modalità server (default 8085)")
+    parser.add_argument("--queue-size", type=int, default=16, help="Richieste in attesa prima di rispondere 429")
+    parser.add_argument("--verbose", action="store_true", help="Log di ogni richiesta in modalità server")
+    return parser.parse_args(argv)
+
 if __name__ == "__main__":
-    main_menu()
+    args = parse_args()
+    if args.profile_startup:
+        profile_startup()
+    elif args.batch:
+        batch_settings = Settings(interactive=False)
+        if args.model:
+            batch_settings.selected_model = args.model
+        run_batch(args.batch, args.output, max(1, args.concurrency), batch_settings)
+    elif args.serve:
+        server_settings = Settings(interactive=False)
+        if args.model:
+            server_settings.selected_model = args.model
+        run_server(server_settings, args.host, args.port, max(1, args.concurrency), max(0, args.queue_size), args.verbose)
+    else:
+        main_menu()
@@ -0,0 +1,129 @@
+import pytest
+
+from files import addons, journal, settings as settings_module
+from files.profiles import PROFILE_STATS
+import main
+
+class FakeClient:
+    """Al posto di Ollama: la risposta arriva nei pezzi indicati."""
+
+    base_url = "fake"
+
+    def __init__(self, pieces):
+        self.pieces = list(pieces)
+        self.payloads = []
+
+    def generate_stream(self, payload, task=None):
+        self.payloads.append(payload)
+        for piece in self.pieces:
+            yield {"response": piece, "done": False}
+        yield {"response": "", "done": True}
+
+    def generate(self, payload, task=None):
+        self.payloads.append(payload)
+        return {"response": "".join(self.pieces), "done": True}
+
+    def running(self):
+        return []
+
+    def close(self):
+        pass
+
+@pytest.fixture
+def make_agent(tmp_path, monkeypatch):
+    # Niente file dell'utente: impostazioni di default, chat e statistiche in tmp_path
+    monkeypatch.setattr(settings_module, "SETTINGS_PATH", str(tmp_path / "settings.json"))
+    monkeypatch.setattr(journal, "CHAT_DIR", str(tmp_path / "chats"))
+    monkeypatch.setattr(PROFILE_STATS, "path", str(tmp_path / "profile_stats.json"))
+    monkeypatch.setattr(addons, "MODEL_OUTPUT_HOOKS", [])
+    monkeypatch.setattr(main, "MODEL_OUTPUT_HOOKS", addons.MODEL_OUTPUT_HOOKS)
+
+    def make(pieces, stream=True, journal_enabled=False):
+        settings = settings_module.Settings(interactive=False)
+        settings.selected_model = "test-model"
+        settings.stream_output = stream
+        agent = main.LlamaAgent(persistent=True, settings=settings, client=FakeClient(pieces),
+                                journal=journal_enabled)
+        return agent
+    return make
+
+def hook(func):
+    addons.MODEL_OUTPUT_HOOKS.append(func)
+
+def test_stream_shows_the_hooked_text(make_agent):
+    hook(lambda agent, text: f"AI: {text}")
+    agent = make_agent(["Hello", " world"])
+    shown = "".join(agent.ask_stream("hi"))
+    assert shown == "AI: Hello world"
+    assert agent.history[-1]["llm"] == "AI: Hello world"
+
+def test_ask_returns_the_same_text_with_and_without_streaming(make_agent):
+    hook(lambda agent, text: text.upper())
+    streamed = make_agent([" Hello", " world "], stream=True).ask("hi")
+    plain = make_agent([" Hello", " world "], stream=False).ask("hi")
+    assert streamed == plain == "HELLO WORLD"
+
+def test_stream_without_hooks_is_not_held_back(make_agent):
+    agent = make_agent(["one ", "two ", "three"])
+    stream = agent.ask_stream("hi")
+    assert next(stream) == "one "
+    assert list(stream) == ["two ", "three"]
+    assert agent.history[-1]["llm"] == "one two three"
+
+def test_turn_is_recorded_when_consumer_closes_after_the_model_finished(make_agent):
+    hook(lambda agent, text: text + " [signed]")
+    agent = make_agent(["word1", " word2"])
+    stream = agent.ask_stream("hi")
+    assert next(stream) == "word1 word2 [signed]"
+    stream.close()
+    assert agent.history[-1]["llm"] == "word1 word2 [signed]"
+    assert not agent.interrupted
+
+def test_partial_answer_is_kept_when_consumer_stops_early(make_agent):
+    agent = make_agent(["first ", "second ", "third"])
+    stream = agent.ask_stream("hi")
+    next(stream)
+    stream.close()
+    assert agent.interrupted
+    assert agent.history[-1]["llm"] == "first"
+
+def test_clear_starts_a_new_journal(make_agent):
+    agent = make_agent(["answer"], stream=False, journal_enabled=True)
+    agent.ask("prima della pulizia")
+    old_path = agent.journal.path
+    agent.clear_history()
+    agent.ask("dopo la pulizia")
+    agent.save_chat()
+    assert agent.journal.path != old_path
+    # /load della chat corrente: solo i turni dopo /clear
+    entry = journal.find_chat(agent.journal.chat_id)
+    resumed = make_agent(["answer"], stream=False)
+    assert resumed.resume_chat(entry) == 1
+    assert [t["user"] for t in resumed.history] == ["dopo la pulizia"]
+
+def test_clear_on_an_empty_journal_keeps_it(make_agent):
+    agent = make_agent(["answer"], stream=False, journal_enabled=True)
+    current = agent.journal
+    agent.clear_history()
+    assert agent.journal is current
+
+def test_profile_with_another_server_rebuilds_the_client(make_agent, monkeypatch):
+    closed = []
+    class ClosingClient(FakeClient):
+        def close(self):
+            closed.append(self)
+    monkeypatch.setattr(main, "create_client", lambda settings: ClosingClient(["answer"]))
+    settings = settings_module.Settings(interactive=False)
+    settings.selected_model = "test-model"
+    agent = main.LlamaAgent(settings=settings)
+    old = agent.client
+
+    agent.apply_settings()
+    assert agent.client is old  # stesso server: nessun client nuovo
+
+    settings.ollama_url = "http://altro-server:11434"
+    agent.apply_settings()
+    assert agent.client is not old
+    assert closed == [old]
+    assert agent.budget.client is agent.client
+    assert agent.preloader.client is agent.client
@@ -0,0 +1,65 @@
+import json
+
+import pytest
+
+import main
+from files import settings as settings_module
+from files.profiles import PROFILE_STATS
+
+def write_lines(path, lines):
+    path.write_text("\n".join(lines) + "\n", encoding="utf-8")
+    return str(path)
+
+def test_read_batch_prompts_skips_lines_that_are_not_objects(tmp_path, capsys):
+    path = write_lines(tmp_path / "in.jsonl", [
+        '{"id": "a", "prompt": "first"}',
+        '"text"', "[1]", "3", "{broken",
+        '{"request_id": "b", "body": "second"}',
+        '{"id": "c"}',
+    ])
+    assert list(main.read_batch_prompts(path)) == [("a", "first"), ("b", "second")]
+    assert capsys.readouterr().out.count("ignorata") == 5
+
+def test_load_done_ids_ignores_errors_and_malformed_lines(tmp_path):
+    path = write_lines(tmp_path / "out.jsonl", [
+        '{"id": "a", "response": "ok"}',
+        '{"id": "b", "error": "boom"}',
+        '"text"', "[1]",
+        '{"id": "c", "resp',
+    ])
+    assert main.load_done_ids(path) == {"a"}
+    assert main.load_done_ids(str(tmp_path / "missing.jsonl")) == set()
+
+class FakeClient:
+    base_url = "fake"
+
+    def generate_stream(self, payload, task=None):
+        yield {"response": "answer to " + payload["prompt"].split()[-1], "done": True}
+
+    def generate(self, payload, task=None):
+        return {"response": "answer", "done": True}
+
+    def close(self):
+        pass
+
+@pytest.fixture
+def settings(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings_module, "SETTINGS_PATH", str(tmp_path / "settings.json"))
+    monkeypatch.setattr(PROFILE_STATS, "path", str(tmp_path / "profile_stats.json"))
+    monkeypatch.setattr(main, "create_client", lambda settings: FakeClient())
+    settings = settings_module.Settings(interactive=False)
+    settings.selected_model = "test-model"
+    return settings
+
+def test_run_batch_resumes_and_raises_connection_limits(tmp_path, settings):
+    input_path = write_lines(tmp_path / "in.jsonl", [
+        json.dumps({"id": str(i), "prompt": f"question {i}"}) for i in range(5)
+    ])
+    output_path = write_lines(tmp_path / "out.jsonl", ['{"id": "0", "response": "done before"}'])
+
+    counts = main.run_batch(input_path, output_path, concurrency=8, settings=settings)
+    assert counts == {"ok": 4, "error": 0}
+    assert settings.pool_size == 8 and settings.max_concurrent_requests == 8
+
+    records = [json.loads(line) for line in open(output_path, encoding="utf-8")]
+    assert sorted(r["id"] for r in records) == ["0", "1", "2", "3", "4"]
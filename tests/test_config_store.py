@@ -0,0 +1,24 @@
+import time
+
+import pytest
+
+from files.config_store import ConfigStore
+
+def test_failed_deferred_write_is_reported_and_retried(tmp_path):
+    blocker = tmp_path / "sub"
+    blocker.write_text("")  # un file al posto della cartella: la scrittura fallisce
+    path = str(blocker / "config.json")
+    store = ConfigStore(delay=0.01)
+    store.set(path, {"a": 1})
+    deadline = time.time() + 5
+    while store.error(path) is None and time.time() < deadline:
+        time.sleep(0.01)
+    assert isinstance(store.error(path), OSError)
+    with pytest.raises(OSError):
+        store.flush(path)
+
+    # La modifica è rimasta in attesa: appena si può scrivere arriva su disco
+    blocker.unlink()
+    store.flush(path)
+    assert store.error(path) is None
+    assert ConfigStore().load(path) == {"a": 1}
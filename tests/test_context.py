@@ -0,0 +1,65 @@
+import threading
+
+from files.context import ContextBudget
+
+class FakeClient:
+    """generate() attende `release` prima di restituire il riassunto."""
+
+    def __init__(self, summary="SUMMARY"):
+        self.summary = summary
+        self.release = threading.Event()
+        self.release.set()
+        self.calls = 0
+
+    def generate(self, payload, task=None):
+        self.calls += 1
+        self.release.wait(5)
+        return {"response": self.summary}
+
+def turns(n, size=1):
+    return [{"user": f"u{i}" * size, "llm": f"a{i}"} for i in range(n)]
+
+def compact(budget, history):
+    budget.used_tokens = budget.max_tokens
+    budget.maybe_compact("m", history)
+    if budget._worker is not None:
+        budget._worker.join(5)
+
+def test_summary_replaces_old_turns():
+    budget = ContextBudget(FakeClient(), max_tokens=100, window=2)
+    history = turns(5)
+    compact(budget, history)
+    prefix = budget.apply_pending(history)
+    assert budget.summarized_turns == 3
+    assert prefix.startswith("Summary of the earlier conversation: SUMMARY")
+    assert "u3" in prefix and "u2" not in prefix
+
+def test_summary_running_during_reset_is_discarded():
+    client = FakeClient("OLD SECRET SUMMARY")
+    client.release.clear()
+    budget = ContextBudget(client, max_tokens=100, window=2)
+    budget.used_tokens = 100
+    budget.maybe_compact("m", turns(6))
+    budget.reset()
+    client.release.set()
+    budget._worker.join(5)
+
+    history = turns(1)
+    assert budget.apply_pending(history) is None
+    assert budget.summarized_turns == 0
+    assert "SECRET" not in budget.build_prefix(history)
+
+def test_summarized_turns_never_exceed_history():
+    budget = ContextBudget(FakeClient(), max_tokens=100, window=1)
+    compact(budget, turns(4))
+    # La cronologia si è accorciata nel frattempo (stessa generazione)
+    history = turns(2)
+    budget.apply_pending(history)
+    assert budget.summarized_turns == 2
+
+def test_no_compaction_when_window_alone_is_over_budget():
+    client = FakeClient()
+    budget = ContextBudget(client, max_tokens=100, window=2)
+    compact(budget, turns(5, size=200))
+    assert client.calls == 0
+    assert budget.apply_pending(turns(5)) is None
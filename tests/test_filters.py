@@ -0,0 +1,38 @@
+import re
+
+from files.filters import (DEFAULT_WINDOW, EmojiFilter, OutputFilterPipeline, RegexFilter,
+                           make_filter, match_width, remove_emojis)
+
+def stream(stage, chunks):
+    pipeline = OutputFilterPipeline([stage])
+    return "".join(pipeline.feed(c) for c in chunks) + pipeline.flush()
+
+def test_string_pattern_matches_split_across_chunks():
+    chunks = ["Hi <", "think", "> secret </", "think>"]
+    assert stream(make_filter(r"</?think>"), chunks) == "Hi  secret "
+
+def test_window_is_derived_from_pattern():
+    assert match_width(re.compile(r"</?think>")) == 8
+    assert match_width(re.compile("password")) == 8
+    assert match_width(re.compile(r"<think>.*?</think>")) == DEFAULT_WINDOW
+    assert RegexFilter("abc", window=1).window == 1
+
+def test_unbounded_pattern_within_default_window():
+    chunks = ["before <think>", "hidden ", "reasoning</th", "ink> after"]
+    assert stream(RegexFilter(r"<think>.*?</think>"), chunks) == "before  after"
+
+def test_every_split_point():
+    text = "a password here and password there"
+    for i in range(len(text) + 1):
+        out = stream(RegexFilter("password", "***"), [text[:i], text[i:]])
+        assert out == "a *** here and *** there"
+
+def test_emoji_sequence_split_across_chunks():
+    family = "\U0001F468‍\U0001F469"
+    assert stream(EmojiFilter(), ["ok " + family[:2], family[2:] + " done"]) == "ok  done"
+    assert remove_emojis("hi \U0001F600") == "hi "
+
+def test_pipeline_reassembles_utf8_bytes():
+    data = "città".encode("utf-8")
+    pipeline = OutputFilterPipeline()
+    assert pipeline.feed(data[:4]) + pipeline.feed(data[4:]) + pipeline.flush() == "città"
@@ -0,0 +1,76 @@
+import json
+import os
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from files import memory
+from files.memory import VectorStore
+
+@pytest.fixture(autouse=True)
+def numpy_loaded():
+    memory._load_numpy()
+
+def unit(*values):
+    v = np.array(values, dtype=np.float32)
+    return v / np.linalg.norm(v)
+
+def add_turns(store, n):
+    for i in range(n):
+        store.add(unit(1.0, float(i), 0.5), {"turn": i + 1, "user": f"u{i}", "llm": f"a{i}"})
+
+def test_add_appends_and_reloads(tmp_path):
+    store = VectorStore(str(tmp_path), "chat")
+    add_turns(store, 20)
+    size = os.path.getsize(store.vec_path)
+    store.add(unit(0.0, 1.0, 0.0), {"turn": 21, "user": "last", "llm": "x"})
+    # Una riga in più, non un file riscritto
+    assert os.path.getsize(store.vec_path) == size + 3 * 4
+
+    loaded = VectorStore.load(str(tmp_path), "chat")
+    assert len(loaded) == 21
+    assert [m["row"] for m in loaded.meta] == list(range(21))
+    score, turn = loaded.top(unit(0.0, 1.0, 0.0), 1)[0]
+    assert turn["user"] == "last" and score == pytest.approx(1.0)
+
+def test_crash_after_vector_write_is_truncated(tmp_path):
+    store = VectorStore(str(tmp_path), "chat")
+    add_turns(store, 3)
+    # Crash tra le due scritture: vettore scritto, riga di testo no
+    with open(store.vec_path, "ab") as f:
+        f.write(unit(0.0, 0.0, 1.0).tobytes())
+
+    loaded = VectorStore.load(str(tmp_path), "chat", mmap=False)
+    assert len(loaded) == 3
+    loaded.add(unit(0.0, 0.0, 1.0), {"turn": 4, "user": "after crash", "llm": "x"})
+    again = VectorStore.load(str(tmp_path), "chat")
+    assert len(again) == len(again.meta) == 4
+    assert again.top(unit(0.0, 0.0, 1.0), 1)[0][1]["user"] == "after crash"
+
+def test_partial_meta_line_is_dropped(tmp_path):
+    store = VectorStore(str(tmp_path), "chat")
+    add_turns(store, 2)
+    with open(store.vec_path, "ab") as f:
+        f.write(unit(0.0, 0.0, 1.0).tobytes())
+    with open(store.meta_path, "a", encoding="utf-8") as f:
+        f.write('{"turn": 3, "us')
+
+    loaded = VectorStore.load(str(tmp_path), "chat", mmap=False)
+    assert len(loaded) == 2 and len(loaded.meta) == 2
+    loaded.add(unit(0.0, 1.0, 1.0), {"turn": 3, "user": "ok", "llm": "x"})
+    with open(store.meta_path, encoding="utf-8") as f:
+        assert [json.loads(line)["turn"] for line in f] == [1, 2, 3]
+
+def test_old_npy_store_is_converted(tmp_path):
+    vectors = np.stack([unit(1.0, 0.0, 0.0), unit(0.0, 1.0, 0.0)])
+    np.save(tmp_path / "old.npy", vectors)
+    # Formato precedente: il testo poteva avere una riga più dei vettori
+    with open(tmp_path / "old.jsonl", "w", encoding="utf-8") as f:
+        for i in range(3):
+            f.write(json.dumps({"turn": i + 1, "user": f"u{i}", "llm": "x"}) + "\n")
+
+    loaded = VectorStore.load(str(tmp_path), "old")
+    assert len(loaded) == len(loaded.meta) == 2
+    assert not (tmp_path / "old.npy").exists()
+    assert loaded.top(unit(0.0, 1.0, 0.0), 1)[0][1]["user"] == "u1"